@@ -0,0 +1,66 @@
+"""
+Saves benchmark results as JSON baselines
+and compares later runs against them.
+"""
+import datetime
+import json
+import platform
+import subprocess
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--save", metavar="FILE", help="write the results to a JSON baseline")
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="compare the results against a JSON baseline")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save(path: str, suite: str, results: dict, settings: dict = None):
+    data = {
+        "suite": suite,
+        "revision": git_revision(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings or {},
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print("saved baseline to {}".format(path))
+
+
+def compare(path: str, results: dict, higher_is_better=()):
+    """
+    Prints the change of every metric against the baseline,
+    regressions are marked with a "!".
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    print("\ncompared to {} ({}, {})".format(path, baseline["revision"],
+                                             baseline["date"]))
+    old_results = baseline["results"]
+    for name, metrics in results.items():
+        old_metrics = old_results.get(name)
+        if old_metrics is None:
+            print("{:<32} not in baseline".format(name))
+            continue
+        for metric, value in metrics.items():
+            old = old_metrics.get(metric)
+            if not old:
+                continue
+            change = (value - old) / old * 100
+            worse = change < 0 if metric in higher_is_better else change > 0
+            print("{:<32} {:<8} {:>12.2f} -> {:>12.2f} {:>+8.1f}% {}".format(
+                name, metric, old, value, change, "!" if worse else ""))
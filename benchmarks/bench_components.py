@@ -0,0 +1,140 @@
+"""
+Per-request cost of the pieces every request goes through.
+Run from the repository root:
+    python -m benchmarks.bench_components
+    python -m benchmarks.bench_components --save components.json
+"""
+import argparse
+import functools
+import timeit
+
+from werkzeug.exceptions import NotFound
+from werkzeug.wrappers import Response
+
+from benchmarks import baseline
+from benchmarks.bench_router import make_mapper
+from responds.app import Application
+from responds.backends.http1 import CommonHeaders, ResponseSerializer
+from responds.backends.httptools_ import HTTPToolsBackend
+from responds.fakewsgi import to_wsgi_environment
+from responds.middleware import after, around, before
+from responds.request import NativeRequest
+from responds.route import Route
+from responds.serializers import SERIALIZERS
+from responds.util import json, wrap_response
+from responds.websocket import parse_frame, unmask
+
+HEADERS = [("Host", "localhost:8080"), ("User-Agent", "bench/1.0"),
+           ("Accept", "*/*"), ("Accept-Encoding", "gzip, deflate"),
+           ("Connection", "keep-alive")]
+# a typical small API payload
+DOCUMENT = {
+    "id": 42,
+    "name": "thing",
+    "tags": ["a", "b", "c"],
+    "price": 9.99,
+    "owner": {"id": 7, "name": "someone"},
+    "items": [{"id": i, "done": i % 2 == 0} for i in range(20)],
+}
+
+
+def bench(fn) -> float:
+    # best of 5, in microseconds per call
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=5)) / number * 1e6
+
+
+def drive(factory):
+    # runs a coroutine that never suspends, without an event loop
+    def run():
+        try:
+            factory().send(None)
+        except StopIteration as e:
+            return e.value
+        raise RuntimeError("the coroutine suspended")
+
+    return run
+
+
+def pipeline(middleware) -> Route:
+    async def handler(ctx):
+        return "hello world"
+
+    route = Route(handler)
+    route.compose(middleware)
+    return route
+
+
+def cases():
+    environ = to_wsgi_environment(HEADERS, "GET", "/api/v1/things99/42")
+    mapper = make_mapper(100)
+    serializer = ResponseSerializer(CommonHeaders("responds", "responds"))
+    req = NativeRequest("GET", b"/api/v1/things99/42?page=2", HEADERS)
+    body = b"x" * 1024
+
+    yield "to_wsgi_environment", lambda: to_wsgi_environment(
+        HEADERS, "GET", "/api/v1/things99/42?page=2")
+    yield "NativeRequest.path", lambda: NativeRequest(
+        "GET", b"/api/v1/things99/42?page=2", HEADERS).path
+    yield "Mapper.match (100 routes)", lambda: mapper.match(environ)
+    yield "wrap_response (str)", lambda: wrap_response("hello world")
+    yield "wrap_response (tuple)", lambda: wrap_response(
+        ("hello world", 201, [("X-Thing", "1")]))
+    yield "create_response (1 KiB)", lambda: serializer.serialize(
+        Response(body), req)
+
+    payload = bytearray(2**16)
+    yield "websocket unmask (64 KiB)", lambda: unmask(payload, b"\x01\x02\x03\x04")
+    frame = b"\x82\xfe\x04\x00\x01\x02\x03\x04" + bytes(1024)
+    yield "websocket parse_frame (1 KiB)", lambda: parse_frame(
+        bytearray(frame), 2**20)
+
+    bare = pipeline([])
+    yield "pipeline (no middleware)", drive(lambda: bare.pipeline(None))
+    layered = pipeline([
+        before(lambda ctx: None),
+        after(lambda ctx, res: None),
+        around(lambda ctx, call_next: call_next()),
+    ])
+    yield "pipeline (3 middleware)", drive(lambda: layered.pipeline(None))
+
+    app = Application("bench", HTTPToolsBackend)
+    yield "NotFound.get_response", lambda: NotFound().get_response()
+    yield "Application.error_page (404)", lambda: app.error_page(NotFound())
+
+    yield "wrap_response (util.json)", lambda: wrap_response(json(DOCUMENT))
+    for cls in SERIALIZERS:
+        try:
+            json_serializer = cls()
+        except Exception:
+            # not installed
+            continue
+        encoded = json_serializer.dumps(DOCUMENT)
+        yield "{}.dumps".format(cls.name), functools.partial(
+            json_serializer.dumps, DOCUMENT)
+        yield "{}.loads".format(cls.name), functools.partial(
+            json_serializer.loads, encoded)
+        yield "wrap_response (dict, {})".format(
+            cls.name), functools.partial(wrap_response, DOCUMENT,
+                                         json_serializer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = {}
+    print("{:<32} {:>10}".format("component", "us/call"))
+    for name, fn in cases():
+        results[name] = {"us": bench(fn)}
+        print("{:<32} {:>10.2f}".format(name, results[name]["us"]))
+    if args.save:
+        baseline.save(args.save, "components", results)
+    if args.compare:
+        baseline.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Requests/sec and latency percentiles for the full request path,
+against a server running in a separate process.
+Run from the repository root:
+    python -m benchmarks.bench_http
+    python -m benchmarks.bench_http --duration 10 --save baseline.json
+    python -m benchmarks.bench_http --compare baseline.json
+    python -m benchmarks.bench_http --engine uvloop --compare baseline.json
+    python -m benchmarks.bench_http --gc
+"""
+import argparse
+import asyncio
+import gc
+import importlib
+import multiprocessing
+import socket
+import time
+from array import array
+
+from benchmarks import baseline
+
+BACKENDS = {
+    "httptools": "responds.backends.httptools_:HTTPToolsBackend",
+    "h2": "responds.backends.h2_:H2Backend",
+}
+# filler routes registered before the one that gets requested
+ROUTE_TABLE_SIZE = 1000
+POST_BODY = b"x" * 1024
+JSON_BODY = b'{"id":42,"name":"thing","tags":["a","b","c"],"price":9.99}'
+ECHO_HEADERS = "".join("X-Bench-{}: value-{}\r\n".format(i, i)
+                       for i in range(10))
+
+
+def request(method: str,
+            path: str,
+            headers: str = "",
+            body: bytes = b"",
+            keep_alive: bool = True) -> bytes:
+    head = "{} {} HTTP/1.1\r\nHost: localhost\r\n{}".format(
+        method, path, headers)
+    if body:
+        head += "Content-Length: {}\r\n".format(len(body))
+    if not keep_alive:
+        head += "Connection: close\r\n"
+    return (head + "\r\n").encode("ascii") + body
+
+
+# name -> (request, keep-alive)
+SCENARIOS = {
+    "hello": (request("GET", "/"), True),
+    "json": (request("GET", "/json"), True),
+    "json-dict": (request("GET", "/json-dict"), True),
+    "json-post": (request(
+        "POST", "/json-post", "Content-Type: application/json\r\n",
+        JSON_BODY), True),
+    "header-echo": (request("GET", "/headers", ECHO_HEADERS), True),
+    "post-1k": (request("POST", "/post", body=POST_BODY), True),
+    "route-table-{}".format(ROUTE_TABLE_SIZE):
+    (request("GET", "/table/last/42"), True),
+    "hello-close": (request("GET", "/", keep_alive=False), False),
+    # what a scanner gets
+    "not-found": (request("GET", "/wp-login.php"), True),
+}
+
+
+def make_app(backend_path: str, serializer: str = None):
+    from responds.app import Application
+    from responds.util import json as json_response
+
+    module, name = backend_path.split(":")
+    backend = getattr(importlib.import_module(module), name)
+    app = Application("bench", backend, serializer=serializer)
+
+    @app.route("/")
+    async def hello(ctx):
+        return b"Hello, World!"
+
+    @app.route("/json")
+    async def json_(ctx):
+        return json_response({"message": "Hello, World!"})
+
+    @app.route("/json-dict")
+    async def json_dict(ctx):
+        return {"message": "Hello, World!"}
+
+    @app.route("/json-post", methods=("POST", ))
+    async def json_post(ctx):
+        thing = ctx.json
+        return {"id": thing["id"], "tags": len(thing["tags"])}
+
+    @app.route("/headers")
+    async def headers(ctx):
+        return json_response(dict(ctx.native.headers))
+
+    @app.route("/post", methods=("POST", ))
+    async def post(ctx):
+        return str(len(ctx.native.data))
+
+    for i in range(ROUTE_TABLE_SIZE):
+
+        async def filler(ctx):
+            return b""
+
+        filler.__name__ = "filler_{}".format(i)
+        app.route("/table/{}/<int:id>".format(i))(filler)
+
+    @app.route("/table/last/<int:id>")
+    async def last(ctx):
+        return str(ctx.params["id"])
+
+    app.build()
+    return app
+
+
+# what the server's collections add up to, shared with the parent
+GC_GEN0, GC_GEN1, GC_GEN2, GC_PAUSE, GC_MAX_PAUSE, GC_COLLECTED = range(6)
+
+
+def record_gc(stats):
+    """
+    Adds every collection in this process to stats.
+    """
+    clock = time.perf_counter
+    started = [0.0]
+
+    def callback(phase: str, info: dict):
+        if phase == "start":
+            started[0] = clock()
+            return
+        pause = clock() - started[0]
+        with stats.get_lock():
+            stats[info["generation"]] += 1
+            stats[GC_PAUSE] += pause
+            stats[GC_MAX_PAUSE] = max(stats[GC_MAX_PAUSE], pause)
+            stats[GC_COLLECTED] += info["collected"]
+
+    gc.callbacks.append(callback)
+
+
+def serve(backend_path: str, serializer: str, engine: str, port: int,
+          workers: int, gc_stats=None):
+    app = make_app(backend_path, serializer)
+    if gc_stats is not None:
+        # workers are forked after this, they inherit the callback
+        record_gc(gc_stats)
+    app.run("127.0.0.1", port, workers=workers, engine=engine)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise SystemExit("server didn't come up on port {}".format(port))
+
+
+async def read_response(reader: asyncio.StreamReader, keep_alive: bool):
+    head = await reader.readuntil(b"\r\n\r\n")
+    if not keep_alive:
+        await reader.read()
+        return
+    start = head.lower().find(b"\r\ncontent-length:")
+    if start < 0:
+        raise Exception("responses need a Content-Length")
+    end = head.find(b"\r\n", start + 2)
+    await reader.readexactly(int(head[start + 17:end]))
+
+
+async def connection(port: int, payload: bytes, keep_alive: bool,
+                     record_after: float, stop_at: float, latencies: array,
+                     completed: list):
+    clock = time.perf_counter
+    reader = writer = None
+    while True:
+        start = clock()
+        if start >= stop_at:
+            break
+        if reader is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(payload)
+        await read_response(reader, keep_alive)
+        end = clock()
+        # the warmup counts too, the server's collections include it
+        completed[0] += 1
+        if start >= record_after:
+            latencies.append(end - start)
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_connections(port: int, scenario: str, connections: int,
+                          warmup: float, duration: float) -> (array, int):
+    payload, keep_alive = SCENARIOS[scenario]
+    latencies = array("d")
+    completed = [0]
+    now = time.perf_counter()
+    await asyncio.gather(*(connection(port, payload, keep_alive, now + warmup,
+                                      now + warmup + duration, latencies,
+                                      completed)
+                           for _ in range(connections)))
+    return latencies, completed[0]
+
+
+def client(port: int, scenario: str, connections: int, warmup: float,
+           duration: float, results):
+    latencies, completed = asyncio.run(
+        run_connections(port, scenario, connections, warmup, duration))
+    results.put((latencies.tobytes(), completed))
+
+
+def percentile(ordered, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_scenario(port: int, scenario: str, args, gc_stats=None) -> dict:
+    if gc_stats is not None:
+        with gc_stats.get_lock():
+            gc_stats[:] = [0.0] * len(gc_stats)
+    results = multiprocessing.Queue()
+    per_client = max(1, args.connections // args.clients)
+    clients = [
+        multiprocessing.Process(
+            target=client,
+            args=(port, scenario, per_client, args.warmup, args.duration,
+                  results)) for _ in range(args.clients)
+    ]
+    for proc in clients:
+        proc.start()
+    latencies = array("d")
+    completed = 0
+    for _ in clients:
+        data, count = results.get()
+        latencies.frombytes(data)
+        completed += count
+    for proc in clients:
+        proc.join()
+    ordered = sorted(latencies)
+    if not ordered:
+        raise SystemExit("no requests completed for {}".format(scenario))
+    result = {
+        "rps": len(ordered) / args.duration,
+        "p50": percentile(ordered, 0.50) * 1e3,
+        "p99": percentile(ordered, 0.99) * 1e3,
+        "p999": percentile(ordered, 0.999) * 1e3,
+    }
+    if gc_stats is not None:
+        with gc_stats.get_lock():
+            stats = list(gc_stats)
+        # per 10k requests, so they compare across durations
+        per = 1e4 / completed
+        result.update({
+            "gc0": stats[GC_GEN0] * per,
+            "gc1": stats[GC_GEN1] * per,
+            "gc2": stats[GC_GEN2] * per,
+            "gc_ms": stats[GC_PAUSE] * 1e3 * per,
+            "gc_max_ms": stats[GC_MAX_PAUSE] * 1e3,
+            "collected": stats[GC_COLLECTED] / completed,
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--backend", choices=BACKENDS, default="httptools")
+    parser.add_argument("--engine", choices=("curio", "asyncio", "uvloop"),
+                        default=None,
+                        help="event loop, swaps in its backend if needed")
+    parser.add_argument("--serializer", default=None,
+                        help="json, orjson, ujson or auto")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server worker processes")
+    parser.add_argument("--clients", type=int, default=2,
+                        help="load generator processes")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds measured per scenario")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="run only these, can be repeated")
+    parser.add_argument("--gc", action="store_true",
+                        help="also report the server's garbage collections")
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    port = free_port()
+    gc_stats = multiprocessing.Array("d", 6) if args.gc else None
+    server = multiprocessing.Process(
+        target=serve,
+        args=(BACKENDS[args.backend], args.serializer, args.engine, port,
+              args.workers, gc_stats))
+    server.start()
+    results = {}
+    try:
+        wait_for(port)
+        head = "{:<20} {:>10} {:>9} {:>9} {:>9}".format(
+            "scenario", "req/s", "p50 ms", "p99 ms", "p999 ms")
+        if args.gc:
+            head += " {:>17} {:>10} {:>10} {:>9}".format(
+                "gen0/1/2 per 10k", "ms per 10k", "max ms", "freed/req")
+        print(head)
+        for scenario in args.scenario or SCENARIOS:
+            result = run_scenario(port, scenario, args, gc_stats)
+            results[scenario] = result
+            line = "{:<20} {:>10.0f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                scenario, result["rps"], result["p50"], result["p99"],
+                result["p999"])
+            if args.gc:
+                line += " {:>17} {:>10.2f} {:>10.3f} {:>9.2f}".format(
+                    "{:.1f}/{:.1f}/{:.1f}".format(
+                        result["gc0"], result["gc1"], result["gc2"]),
+                    result["gc_ms"], result["gc_max_ms"],
+                    result["collected"])
+            print(line)
+    finally:
+        server.terminate()
+        server.join()
+
+    settings = {
+        name: getattr(args, name)
+        for name in ("backend", "engine", "serializer", "workers", "clients",
+                     "connections", "duration", "warmup", "gc")
+    }
+    if args.save:
+        baseline.save(args.save, "http", results, settings)
+    if args.compare:
+        baseline.compare(args.compare, results, higher_is_better=("rps", ))
+
+
+if __name__ == "__main__":
+    main()
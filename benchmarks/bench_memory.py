@@ -0,0 +1,101 @@
+"""
+Memory blocks and bytes that every parsed request
+and every connection holds on to while it's being served.
+Run from the repository root:
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --save memory.json
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+
+from benchmarks import baseline
+from responds.app import Application
+from responds.backends.httptools_ import HTTPToolsBackend, HTTPToolsSession
+
+COUNT = 2000
+# what a browser sends
+REQUEST = (b"GET /api/v1/things/42?page=2 HTTP/1.1\r\n"
+           b"Host: localhost:8080\r\n"
+           b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) bench/1.0\r\n"
+           b"Accept: text/html,application/xhtml+xml,*/*;q=0.8\r\n"
+           b"Accept-Language: en-US,en;q=0.5\r\n"
+           b"Accept-Encoding: gzip, deflate\r\n"
+           b"Cookie: session=0123456789abcdef\r\n"
+           b"Connection: keep-alive\r\n\r\n")
+
+
+class FakeSocket(object):
+    def getsockname(self) -> (str, int):
+        return "127.0.0.1", 8080
+
+
+def session() -> HTTPToolsSession:
+    return HTTPToolsSession(FakeSocket(), ("127.0.0.1", 40000))
+
+
+def measure(build) -> (float, float):
+    """
+    Blocks and bytes per object of what build(COUNT) keeps alive.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        start = tracemalloc.get_traced_memory()[0]
+        kept = build(COUNT)
+        size = tracemalloc.get_traced_memory()[0] - start
+        blocks = sys.getallocatedblocks() - blocks
+        tracemalloc.stop()
+        del kept
+    finally:
+        gc.enable()
+    return blocks / COUNT, size / COUNT
+
+
+def parsed_requests(count: int) -> HTTPToolsSession:
+    # pipelined, so the session holds on to every message
+    held = session()
+    held.parser.feed_data(REQUEST * count)
+    return held
+
+
+def contexts(count: int) -> list:
+    app = Application("bench", HTTPToolsBackend)
+    held = session()
+    held.parser.feed_data(REQUEST * count)
+    return [
+        app.create_context(message.request, {"id": 42}, message.request.body)
+        for message in held.messages
+    ]
+
+
+def connections(count: int) -> list:
+    return [session() for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    # the first parse warms up caches that live for the process
+    parsed_requests(1)
+    results = {}
+    print("{:<28} {:>10} {:>10}".format("held", "blocks", "bytes"))
+    for name, build in (("parsed request", parsed_requests),
+                        ("parsed request + context", contexts),
+                        ("idle connection", connections)):
+        blocks, size = measure(build)
+        results[name] = {"blocks": blocks, "bytes": size}
+        print("{:<28} {:>10.1f} {:>10.0f}".format(name, blocks, size))
+    if args.save:
+        baseline.save(args.save, "memory", results)
+    if args.compare:
+        baseline.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Route lookup cost for growing route tables.
+Run from the repository root:
+    python -m benchmarks.bench_router
+"""
+import timeit
+
+from werkzeug.routing import Map, Rule
+
+from responds.mapper import Mapper
+from responds.route import Route
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def make_mapper(size: int) -> Mapper:
+    mapper = Mapper("bench")
+    for i in range(size):
+        # half static, half with a typed converter
+        if i % 2:
+            url = "/api/v1/things{}/<int:thing_id>".format(i)
+        else:
+            url = "/api/v1/static{}".format(i)
+
+        def handler(ctx):
+            return b""
+
+        handler.__name__ = "handler_{}".format(i)
+        route = Route(handler)
+        route.add_path(url, ("GET", ), False)
+        mapper.add_route(route)
+    mapper.build()
+    return mapper
+
+
+def make_werkzeug_map(size: int):
+    rules = []
+    for i in range(size):
+        if i % 2:
+            url = "/api/v1/things{}/<int:thing_id>".format(i)
+        else:
+            url = "/api/v1/static{}".format(i)
+        rules.append(Rule(url, methods=("GET", ), endpoint=str(i)))
+    return Map(rules).bind("localhost")
+
+
+def paths(size: int):
+    last_static = size - 1 if (size - 1) % 2 == 0 else size - 2
+    last_dynamic = size - 1 if (size - 1) % 2 else size - 2
+    return [
+        ("static, last registered", "/api/v1/static{}".format(last_static)),
+        ("int converter, last registered",
+         "/api/v1/things{}/42".format(last_dynamic)),
+        ("miss (404)", "/api/v2/nothing"),
+    ]
+
+
+def bench(fn) -> float:
+    # best of 5, in microseconds per call
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print("{:>6}  {:<32} {:>12} {:>12}".format("routes", "lookup",
+                                                 "responds us", "werkzeug us"))
+    for size in SIZES:
+        router = make_mapper(size).router
+        adapter = make_werkzeug_map(size)
+        for name, path in paths(size):
+
+            def ours():
+                try:
+                    router.lookup(path, "GET")
+                except Exception:
+                    pass
+
+            def theirs():
+                try:
+                    adapter.match(path, "GET")
+                except Exception:
+                    pass
+
+            print("{:>6}  {:<32} {:>12.2f} {:>12.2f}".format(
+                size, name, bench(ours), bench(theirs)))
+
+
+if __name__ == "__main__":
+    main()
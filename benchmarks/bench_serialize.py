@@ -0,0 +1,96 @@
+"""
+Response serialization + send cost, old WSGI path vs ResponseSerializer.
+Run from the repository root:
+    python -m benchmarks.bench_serialize
+"""
+import socket
+import threading
+import time
+
+import curio
+from werkzeug.wrappers import Response
+
+from responds.backends.http1 import ResponseSerializer, sendall_vectored
+from responds.fakewsgi import to_wsgi_environment
+from responds.request import NativeRequest
+
+SIZES = (("1 KiB", 2**10), ("64 KiB", 2**16), ("10 MiB", 10 * 2**20))
+CHUNK = 2**16
+# roughly the same amount of bytes per measurement
+TOTAL = 64 * 2**20
+
+
+class _OldWrapper(object):
+    # the pre-serializer create_response, kept for comparison
+    def __init__(self):
+        self.headers = []
+        self.real_body = b""
+        self.status = None
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = headers
+
+
+def old_create_response(response: Response, environ) -> bytes:
+    wrapper = _OldWrapper()
+    for part in response(environ, wrapper.start_response):
+        wrapper.real_body += part
+    res = "HTTP/1.1 " + wrapper.status + "\r\n"
+    for name, value in wrapper.headers:
+        res += name + ": " + value + "\r\n"
+    res += "\r\n"
+    res = res.encode("utf-8")
+    res += wrapper.real_body
+    return res
+
+
+def drain(sock: socket.socket):
+    while sock.recv(2**20):
+        pass
+
+
+def make_response(size: int, chunked: bool) -> Response:
+    if not chunked:
+        return Response(b"x" * size)
+    chunks = [b"x" * min(CHUNK, size - i) for i in range(0, size, CHUNK)]
+    return Response(chunks)
+
+
+async def run(sock, size: int, chunked: bool):
+    environ = to_wsgi_environment([], "GET", "/")
+    req = NativeRequest("GET", b"/", [])
+    serializer = ResponseSerializer()
+    iterations = max(TOTAL // size, 4)
+    results = []
+    for name in ("old", "new"):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            res = make_response(size, chunked)
+            if name == "old":
+                await sock.sendall(old_create_response(res, environ))
+            else:
+                await sendall_vectored(sock,
+                                       serializer.serialize(res, req))
+        results.append((time.perf_counter() - start) / iterations * 1e6)
+    return results
+
+
+async def main():
+    ours, theirs = socket.socketpair()
+    thread = threading.Thread(target=drain, args=(theirs, ), daemon=True)
+    thread.start()
+    sock = curio.io.Socket(ours)
+    print("{:<8} {:<8} {:>12} {:>12}".format("size", "chunks", "old us",
+                                             "new us"))
+    for label, size in SIZES:
+        for chunked in (False, True):
+            old, new = await run(sock, size, chunked)
+            print("{:<8} {:<8} {:>12.1f} {:>12.1f}".format(
+                label, "64 KiB" if chunked else "1", old, new))
+    await sock.close()
+    thread.join()
+
+
+if __name__ == "__main__":
+    curio.run(main)
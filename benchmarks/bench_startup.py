@@ -0,0 +1,110 @@
+"""
+Cold start cost of large route tables, split into defining the groups,
+registering them and building the application.
+Run from the repository root:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --save startup.json
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+
+from benchmarks import baseline
+from responds.app import Application
+from responds.backends.httptools_ import HTTPToolsBackend
+from responds.group import Group, error_handler, prefix, route
+
+SIZES = (1000, 4000, 8000)
+ROUTES_PER_GROUP = 20
+
+
+def define_groups(size: int) -> list:
+    """
+    Creates the group classes like importing the modules would.
+    """
+    groups = []
+    for g in range(size // ROUTES_PER_GROUP):
+        namespace = {}
+        for i in range(ROUTES_PER_GROUP):
+            kind = i % 4
+            if kind == 0:
+                url = "/items{}".format(i)
+            elif kind == 1:
+                url = "/items{}/<int:item_id>".format(i)
+            elif kind == 2:
+                url = "/items{}/<name>/detail".format(i)
+            else:
+                url = "/files{}/<path:rest>".format(i)
+
+            async def handler(self, ctx):
+                return b""
+
+            handler.__name__ = "handler_{}".format(i)
+            namespace[handler.__name__] = route(url, ("GET", "POST"))(handler)
+
+        async def not_found(self, environ, e):
+            return b"", 404
+
+        namespace["not_found"] = error_handler(404)(not_found)
+        cls = type("Group{}".format(g), (Group, ), namespace)
+        groups.append(prefix("/api/group{}".format(g))(cls))
+    return groups
+
+
+def register(groups: list, cache_file: str = None) -> Application:
+    app = Application("bench", HTTPToolsBackend, route_cache=cache_file)
+    for cls in groups:
+        app.add_group(cls())
+    return app
+
+
+def timed(fn, *args):
+    gc.collect()
+    start = time.perf_counter()
+    ret = fn(*args)
+    return ret, (time.perf_counter() - start) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = {}
+    print("{:>6} {:>10} {:>11} {:>9} {:>14} {:>10}".format(
+        "routes", "define ms", "register ms", "build ms", "cached build ms",
+        "us/route"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in SIZES:
+            groups, define = timed(define_groups, size)
+            app, reg = timed(register, groups)
+            _, build = timed(app.build)
+
+            cache_file = os.path.join(directory, "routes-{}".format(size))
+            # the first start writes the cache, the second one loads it
+            register(groups, cache_file).build()
+            app = register(groups, cache_file)
+            _, cached = timed(app.build)
+            assert app.mapper.router.loaded, "the route cache wasn't used"
+
+            total = define + reg + build
+            results[str(size)] = {
+                "define_ms": define,
+                "register_ms": reg,
+                "build_ms": build,
+                "cached_build_ms": cached,
+                "us_per_route": total / size * 1e3,
+            }
+            print("{:>6} {:>10.1f} {:>11.1f} {:>9.1f} {:>14.1f} {:>10.1f}".
+                  format(size, define, reg, build, cached,
+                         total / size * 1e3))
+    if args.save:
+        baseline.save(args.save, "startup", results)
+    if args.compare:
+        baseline.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,136 @@
+import gc
+import importlib
+import inspect
+import signal
+import time
 import typing
-from collections import namedtuple
 
 import curio
 import logbook
-from werkzeug.datastructures import MultiDict
-from werkzeug.exceptions import (HTTPException, InternalServerError,
-                                 MethodNotAllowed)
+from curio.network import tcp_server_socket
+from werkzeug.exceptions import (BadRequest, HTTPException,
+                                 InternalServerError, MethodNotAllowed,
+                                 RequestEntityTooLarge)
 from werkzeug.routing import NotFound, RequestRedirect
 from werkzeug.wrappers import Request, Response
 
+from . import engine as engines
 from .backends import Backend
+from .body import RequestBody
+from .cache import ResponseCache
+from .compression import Compressor
 from .handler import Handler
 from .mapper import Mapper
+from .metrics import UNMATCHED, Metrics
+from .middleware import Middleware, check
+from .request import NativeRequest
 from .route import Route
+from .serializers import DEFAULT, JSONSerializer, get_serializer
+from .static import StaticFiles
+from .util import lazyprop
+from .workers import Supervisor
 
-Context = namedtuple("Context", ("request", "params", "environ"))
+
+class Context(object):
+    """
+    What route handlers get called with.
+    ``native`` is always available, ``request`` (werkzeug)
+    and ``environ`` (WSGI) are built the first time they're used.
+    Anything else can be set on it, middleware passing things on
+    to handlers gets a __dict__ only when it does.
+    """
+    __slots__ = ("native", "params", "body", "serializer", "_lazy_json",
+                 "__dict__")
+
+    def __init__(self,
+                 native: NativeRequest,
+                 params: dict,
+                 body: RequestBody = None,
+                 serializer: JSONSerializer = DEFAULT):
+        self.native = native
+        self.params = params
+        self.body = body
+        self.serializer = serializer
+
+    @property
+    def request(self) -> Request:
+        return self.native.wsgi_request
+
+    @property
+    def environ(self) -> dict:
+        return self.native.environ
+
+    @lazyprop
+    def json(self) -> typing.Any:
+        """
+        The buffered body, decoded with the application's serializer.
+        None if there's no body.
+        """
+        data = self.native.data
+        if not data:
+            return None
+        try:
+            return self.serializer.loads(data)
+        except ValueError:
+            raise BadRequest(description="The body isn't valid JSON.")
 
 
 class Application(object):
     def __init__(self,
                  name: str,
                  backend: Backend,
-                 level: int = logbook.WARNING):
+                 level: int = logbook.WARNING,
+                 max_body_size: int = None,
+                 server_header: str = None,
+                 powered_by: str = "responds",
+                 date_header: bool = True,
+                 compressor: Compressor = None,
+                 metrics: Metrics = None,
+                 thread_workers: int = None,
+                 process_workers: int = None,
+                 warn_blocking_ms: float = None,
+                 shutdown_timeout: float = 30,
+                 serializer: typing.Union[str, JSONSerializer] = None,
+                 route_cache: str = None,
+                 **backend_options):
         self.log = logbook.Logger(name, level=level)
-        self.backend = backend(self, level)
+        # routes can override this, None means no limit
+        self.max_body_size = max_body_size
+        # sent with every response, None uses the backend's name
+        # and an empty string leaves the header out
+        self.server_header = server_header
+        self.powered_by = powered_by
+        self.date_header = date_header
+        # None turns compression off
+        self.compressor = compressor
+        # None turns metrics off
+        self.metrics = metrics
+        # pool sizes for executor="thread"/"process",
+        # None keeps the engine's default
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        # debug mode, warns about handlers that block the kernel
+        self.warn_blocking_ms = warn_blocking_ms
+        # for dicts and lists returned by handlers and ctx.json,
+        # None is the stdlib and "auto" the fastest one installed
+        self.serializer = get_serializer(serializer)
+        # a file the compiled route table is kept in between starts,
+        # only writable by the application since it gets unpickled
+        self.route_cache = route_cache
+        # how long open connections get to finish after a stop
+        self.shutdown_timeout = shutdown_timeout
+        # called with the application, from the kernel
+        self.startup_hooks = []
+        self.shutdown_hooks = []
+        # set by stop(), only exists while serving
+        self.stopping = None
+        # exception class -> (status, headers, body) of werkzeug's page
+        self.error_pages = {}
+        self.level = level
+        self.backend_options = backend_options
+        self.backend = backend(self, level, **backend_options)
+        # the event loop, picked by the backend unless run() is told otherwise
+        self.engine = engines.get_engine(backend.ENGINE)
         self.mapper = Mapper(name)
         self.listening_to = (None, None)
 
@@ -31,39 +138,124 @@ class Application(object):
     def root(self):
         return self.mapper
 
-    async def handle_httpexception(self, environ: MultiDict,
+    def error_page(self, e: HTTPException) -> Response:
+        """
+        e's own response. Those with werkzeug's default description
+        and headers are rendered once per exception class,
+        after that the response is built from the stored bytes.
+        """
+        cls = type(e)
+        if e.response is not None or e.description != cls.description or \
+                cls.get_headers is not HTTPException.get_headers:
+            return e.get_response()
+        page = self.error_pages.get(cls)
+        if page is None:
+            res = e.get_response()
+            page = self.error_pages[cls] = (res.status,
+                                            res.headers.to_wsgi_list(),
+                                            res.get_data())
+        status, headers, body = page
+        return Response(body, status=status, headers=headers)
+
+    async def handle_httpexception(self, req: NativeRequest,
                                    e: HTTPException) -> Response:
-        handler = self.mapper.get_error_handler(e)
-        if not handler:
-            self.log.error("no matching error handler for", exc_info=True)
-            return e.get_response(environ)
+        route = req.route
+        if route is not None:
+            mapper = route.mapper
+        else:
+            # didn't match, the group the path is under handles it
+            mapper = self.mapper.mapper_for(req.path)
+        handler = mapper.error_table.get(e.code)
+        if handler is None:
+            # cheap on purpose, a scanner can send thousands of these
+            self.log.debug("no error handler for {}", e.code)
+            return self.error_page(e)
         try:
-            return await handler.invoke(environ, e)
+            # error handlers still get called with an environ
+            return await handler.invoke(req.environ, e)
         except Exception as e:  # fuck you, user
             self.log.error("error handler raised an exception", exc_info=True)
             http_e = InternalServerError(description="handler raised")
-            return http_e.get_response(environ)
+            return http_e.get_response()
 
-    async def on_request(self, environ: MultiDict, req: Request) -> Response:
+    async def prepare_body(self, route: Route, req: NativeRequest
+                           ) -> typing.Optional[RequestBody]:
+        """
+        Applies the body size limit, then either hands
+        the body stream to the route or buffers it for werkzeug.
+        """
+        body = req.body
+        if body is None:
+            return None
+        limit = route.max_body_size
+        if limit is None:
+            limit = self.max_body_size
+        if limit is not None:
+            if req.content_length is not None and req.content_length > limit:
+                # rejected before a 100 Continue is ever sent
+                raise RequestEntityTooLarge()
+            body.set_limit(limit)
+        if route.stream_body:
+            return body
+        req.set_data(await body.read())
+        return None
+
+    async def on_request(self, req: NativeRequest) -> Response:
+        metrics = self.metrics
+        if metrics is None:
+            return await self.respond(req)
+        start = time.perf_counter()
+        metrics.in_flight += 1
+        try:
+            res = await self.respond(req)
+        finally:
+            metrics.in_flight -= 1
+        metrics.observe(req.route or UNMATCHED, res.status_code,
+                        time.perf_counter() - start)
+        return res
+
+    async def respond(self, req: NativeRequest) -> Response:
+        res = await self.handle_request(req)
+        if self.compressor is not None:
+            res = await self.compressor.compress(res, req)
+        return res
+
+    def create_context(self,
+                       req: NativeRequest,
+                       params: dict,
+                       body: RequestBody = None) -> Context:
+        return Context(req, params, body, self.serializer)
+
+    async def handle_request(self, req: NativeRequest) -> Response:
         try:
-            route, params = self.mapper.match(environ)
+            route, params = self.mapper.lookup(req.path, req.method,
+                                               req.query_string)
         except NotFound as e:
             self.log.debug("couldnt match for {}", req.path)
-            return await self.handle_httpexception(environ, e)
+            return await self.handle_httpexception(req, e)
         except MethodNotAllowed as e:
             self.log.debug(
                 "no valid method for {req.method} {req.path}", req=req)
-            return await self.handle_httpexception(environ, e)
+            return await self.handle_httpexception(req, e)
         except RequestRedirect as e:
             self.log.debug("redirecting (missing slash)")
-            return e.get_response(environ)
+            return e.get_response()
 
+        req.route = route
+        if route.websocket is not None:
+            # a websocket route that wasn't (properly) asked to upgrade
+            return Response(
+                "This route only speaks WebSocket.",
+                status=426,
+                headers=[("Upgrade", "websocket"), ("Connection", "Upgrade"),
+                         ("Sec-WebSocket-Version", "13")])
         try:
+            body = await self.prepare_body(route, req)
+            ctx = self.create_context(req, params, body)
             # TODO: OPTIONS method
-            return await route.invoke(
-                Context(request=req, params=params, environ=environ))
+            return await route.pipeline(ctx)
         except HTTPException as e:
-            return await self.handle_httpexception(environ, e)
+            return await self.handle_httpexception(req, e)
         except Exception as e:
             self.log.debug(
                 "handler raised {}, wrapping in InternalServerError",
@@ -71,7 +263,7 @@ class Application(object):
                 exc_info=True)
             http_e = InternalServerError()
             http_e.__cause__ = e
-            return await self.handle_httpexception(environ, http_e)
+            return await self.handle_httpexception(req, http_e)
 
     def add_group(self, group: 'Group'):
         mapper = group.inherit_from(self.root)
@@ -80,18 +272,70 @@ class Application(object):
     def route(self,
               route_url: str,
               methods: typing.Sequence[str] = ("GET", ),
-              strict_slashes: bool = False):
+              strict_slashes: bool = False,
+              max_body_size: int = None,
+              stream: bool = False,
+              cache: ResponseCache = None,
+              executor: str = None,
+              middleware: typing.Sequence[Middleware] = None):
         def __inner(func):
             if not hasattr(func, "_route"):
                 route = Route(func)
                 setattr(func, "_route", route)
                 self.mapper.add_route(route)
             func._route.add_path(route_url, methods, strict_slashes)
+            func._route.configure(max_body_size, stream, cache, executor,
+                                  middleware)
             return func
 
         return __inner
 
+    def websocket(self,
+                  route_url: str,
+                  strict_slashes: bool = False,
+                  **options):
+        """
+        Routes WebSocket connections to the decorated handler,
+        which gets called with the context and the WebSocket.
+        Takes the same options as WebSocket.
+        """
+
+        def __inner(func):
+            self.route(route_url, ("GET", ), strict_slashes)(func)
+            func._route.websocket = options
+            return func
+
+        return __inner
+
+    def static(self, url: str, directory: str, **options) -> StaticFiles:
+        """
+        Serves the files under directory at url.
+        Takes the same options as StaticFiles.
+        """
+        files = StaticFiles(directory, **options).mount(url)
+        self.mapper.add_route(files)
+        return files
+
+    def metrics_route(self, url: str = "/metrics") -> Route:
+        """
+        Serves the application's metrics in the Prometheus text format.
+        """
+        if self.metrics is None:
+            raise Exception("the application has no metrics")
+
+        async def metrics(ctx):
+            return Response(
+                self.metrics.render(), content_type=Metrics.CONTENT_TYPE)
+
+        return self.route(url)(metrics)._route
+
     def error_handler(self, from_code: int, to_code: int = None):
+        """
+        Handles errors with a status in [from_code, to_code),
+        or just from_code. Handlers registered on a group
+        take precedence for its routes and the paths under its prefix.
+        """
+
         def __inner(func):
             handler = Handler(func)
             self.mapper.add_error_handler(handler, from_code, to_code)
@@ -99,11 +343,146 @@ class Application(object):
 
         return __inner
 
+    def use(self, *middleware: Middleware):
+        """
+        Runs the middleware around every route, outside the groups'
+        and routes' own. See responds.middleware.
+        """
+        self.mapper.middleware.extend(check(middleware))
+
+    def on_startup(self, func: typing.Callable):
+        """
+        Registers a hook that runs before the first connection is accepted.
+        Hooks get the application and can be coroutines.
+        """
+        self.startup_hooks.append(func)
+        return func
+
+    def on_shutdown(self, func: typing.Callable):
+        """
+        Registers a hook that runs once every connection is closed.
+        """
+        self.shutdown_hooks.append(func)
+        return func
+
+    async def run_hooks(self, hooks: typing.List[typing.Callable]):
+        for hook in hooks:
+            ret = hook(self)
+            if inspect.isawaitable(ret):
+                await ret
+
+    def stop(self, signum: int = None, frame=None):
+        """
+        Stops accepting connections and drains the open ones.
+        Safe to call from signal handlers and threads.
+        """
+        if self.stopping is not None:
+            self.stopping.set()
+
     def build(self, *args, **kwargs):
-        return self.mapper.build(*args, **kwargs)
+        # everything built here lives as long as the process,
+        # collecting while it grows only rescans it
+        paused = gc.isenabled()
+        gc.disable()
+        try:
+            return self._build(*args, **kwargs)
+        finally:
+            if paused:
+                gc.enable()
+
+    def _build(self, *args, **kwargs):
+        kwargs.setdefault("cache", self.route_cache)
+        router = self.mapper.build(*args, **kwargs)
+        for handler in self.mapper.all_error_handlers:
+            handler.serializer = self.serializer
+        for route in self.mapper.all_routes:
+            route.serializer = self.serializer
+            if self.metrics is not None and route.cache is not None:
+                self.metrics.add_cache(route.cache)
+            if self.warn_blocking_ms is not None:
+                route.watch_blocking(self.warn_blocking_ms / 1000, self.log)
+            # resolved once, a request only pays for what applies to it
+            route.compose(route.mapper.all_middleware())
+        return router
+
+    async def main(self, sock):
+        await self.run_hooks(self.startup_hooks)
+        # whichever ends first cancels the other,
+        # cancelling the accept loop closes the listening socket
+        await self.engine.first_of(self.backend.serve(sock),
+                                   self.stopping.wait())
+        self.log.info("stopped accepting, draining connections")
+        await self.backend.drain(self.shutdown_timeout)
+        await self.run_hooks(self.shutdown_hooks)
+
+    def serve(self, sock):
+        """
+        Serves connections from a listening socket until stop() is called,
+        which SIGTERM, SIGINT and SIGHUP do.
+        Open connections then get shutdown_timeout seconds to finish.
+        """
+        engine = self.engine
+        engine.set_pools(self.thread_workers, self.process_workers)
+        engines.use(engine)
+        # works under either engine, and can be set from a signal handler
+        self.stopping = curio.UniversalEvent()
+        previous = {
+            signum: signal.signal(signum, self.stop)
+            for signum in Supervisor.FORWARD
+        }
+        try:
+            engine.run(self.main, sock)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            self.stopping = None
+
+    def use_engine(self, engine: typing.Union[str, typing.Any]):
+        """
+        Switches the event loop, "curio", "asyncio" or "uvloop".
+        The backend is replaced by the engine's own if it runs on another
+        loop, built with the options the application was created with.
+        Options the new backend doesn't take are dropped with a warning.
+        """
+        engine = engines.get_engine(engine)
+        if self.backend.ENGINE != engine.name:
+            module, _, name = engine.backend.partition(":")
+            backend = getattr(importlib.import_module(module), name)
+            accepted = inspect.signature(backend).parameters
+            options = {}
+            for key, value in self.backend_options.items():
+                if key in accepted:
+                    options[key] = value
+                else:
+                    self.log.warn("{} has no {} option, serving without it",
+                                  name, key)
+            self.backend = backend(self, self.level, **options)
+            if "upgrades" not in accepted and any(
+                    route.websocket is not None
+                    for route in self.mapper.all_routes):
+                self.log.warn("{} can't upgrade connections, WebSocket "
+                              "routes will answer 426", name)
+        self.engine = engine
 
-    def run(self, host: str, port: int):
+    def run(self,
+            host: str,
+            port: int,
+            workers: int = 1,
+            reuse_port: bool = True,
+            engine: typing.Union[str, typing.Any] = None):
+        """
+        Listens on host:port. With more than one worker,
+        the process forks and supervises that many workers,
+        which bind with SO_REUSEPORT unless reuse_port is False,
+        in which case they share the parent's socket.
+        engine picks the event loop, see use_engine.
+        """
+        if engine is not None:
+            self.use_engine(engine)
         self.listening_to = (host, port)
         if not self.mapper._built:
             raise Exception("you need to call application.build() first")
-        curio.run(curio.tcp_server(host, port, self.backend.on_connection))
+        if workers > 1:
+            Supervisor(self, host, port, workers, reuse_port).run()
+            return
+        self.serve(tcp_server_socket(host, port))
@@ -1,11 +1,15 @@
 import abc
 import struct
+import time
 import typing
+from collections import namedtuple
 from socket import SHUT_WR, SO_LINGER, SOL_SOCKET
 
 import curio
-from werkzeug.datastructures import MultiDict
-from werkzeug.wrappers import Request, Response
+from curio.network import run_server
+from werkzeug.wrappers import Response
+
+from ..request import NativeRequest
 
 # TODO: Maybe allow custom values
 MAX_RECV = 2**16
@@ -13,16 +17,49 @@ TIMEOUT = 10
 
 NO_LINGER = struct.pack("ii", 1, 0)
 
+# what a session's deadline is for
+IDLE = "idle"
+HEADER = "header"
+BODY = "body"
+# seconds a connection may keep us waiting,
+# between requests, for a request's headers
+# and between two reads of a request's body
+Timeouts = namedtuple("Timeouts", (IDLE, HEADER, BODY))
+
+
+class ReadTimeout(curio.CancelledError):
+    """
+    Raised in a session's reader once its deadline has passed.
+    """
+
 
 class Session(abc.ABC):
+    # sessions live as long as their connection, subclasses
+    # list their own attributes too so they don't get a __dict__
+    __slots__ = ("sock", "remote_ip", "remote_port", "reader", "waiting",
+                 "deadline", "timer")
+
     def __init__(self, sock, addr: (str, int)):
         self.sock = sock
         self.remote_ip, self.remote_port = addr
+        # the task reading from sock, and whether it's blocked on it
+        self.reader = None
+        self.waiting = False
+        # monotonic time, checked by the backend's deadline sweep
+        self.deadline = None
+        self.timer = None
+
+    def arm(self, timer: str, timeout: float):
+        self.timer = timer
+        self.deadline = time.monotonic() + timeout
+
+    def disarm(self):
+        self.deadline = None
 
     @abc.abstractmethod
-    def create_environ(self) -> MultiDict:
+    def create_request(self) -> NativeRequest:
         """
-        Create a fake wsgi environment.
+        Create a request for the application.
         Will be called by the backend,
         so it's possible to add extra
         arguments.
@@ -30,14 +67,18 @@ class Session(abc.ABC):
 
     @abc.abstractmethod
     def create_response(self, response: Response,
-                        environ: MultiDict) -> typing.Any:
+                        req: NativeRequest) -> typing.Any:
         """
         Create a response usable by
         the backend.
         """
 
     async def shutdown(self):
-        await self.sock.shutdown(SHUT_WR)
+        try:
+            await self.sock.shutdown(SHUT_WR)
+        except OSError:  # the peer is already gone
+            await self.sock.close()
+            return
         try:
             async with curio.timeout_after(TIMEOUT):
                 while True:
@@ -55,22 +96,58 @@ class Session(abc.ABC):
 
 
 class Backend(abc.ABC):
+    # the engine it runs on, see responds.engine
+    ENGINE = "curio"
+
     def __init__(self, app):
         self.app = app
 
+    @abc.abstractmethod
+    async def serve(self, sock):
+        """
+        Accepts connections on a listening socket until cancelled.
+        """
+
+    async def drain(self, timeout: float):
+        """
+        Called once serve has been cancelled,
+        lets open connections finish within timeout seconds.
+        Backends that can't drain have already dropped them.
+        """
+
+
+class CurioBackend(Backend):
+    """
+    A backend that runs a curio task per connection.
+    """
+
     @abc.abstractmethod
     async def on_connection(self, sock, addr: (str, int)):
         """
         Called on every TCP connection.
         """
 
+    async def serve(self, sock):
+        """
+        Accepts connections on a listening socket
+        and runs on_connection for each of them.
+        """
+        await run_server(sock, self.on_connection)
+
 
 class Upgrade(abc.ABC):
     def __init__(self, app):
         self.app = app
 
+    def accepts(self, req: NativeRequest) -> bool:
+        """
+        Checks if the request can be upgraded,
+        requests that can't are served as usual.
+        """
+        return True
+
     @abc.abstractmethod
-    def create_response(self, req: Request) -> typing.Any:
+    def create_response(self, req: NativeRequest) -> Response:
         """
         Creates a response the original
         backend should return.
@@ -79,9 +156,17 @@ class Upgrade(abc.ABC):
         """
 
     @abc.abstractmethod
-    async def on_upgrade(self, req, sock, addr: (str, int)):
+    async def on_upgrade(self, req: NativeRequest, sock, addr: (str, int),
+                         data: bytes = b""):
         """
         Intercepts control of the socket.
         Called when the Upgrade header
-        matches this Upgrade class.
+        matches this Upgrade class,
+        data is whatever the client sent after the request.
+        """
+
+    async def drain(self):
+        """
+        Called when the server stops,
+        long lived connections should start closing.
         """
@@ -0,0 +1,533 @@
+import asyncio
+import socket
+import time
+import typing
+from collections import deque
+
+import httptools
+import logbook
+from werkzeug.exceptions import (ClientDisconnected, HTTPException,
+                                 RequestTimeout)
+from werkzeug.wrappers import Response
+
+from . import BODY, IDLE, TIMEOUT, Backend, Timeouts
+from ..app import Application
+from ..request import NativeRequest
+from .http1 import CommonHeaders, is_streamed, send_streaming
+from .httptools_ import CONTINUE, HTTPToolsBackend, HTTPToolsSession, Message
+
+
+class ProtocolSession(HTTPToolsSession):
+    """
+    An HTTPToolsSession that's fed by a protocol
+    instead of reading from its socket.
+    """
+    __slots__ = ("transport", )
+
+    def __init__(self,
+                 transport: asyncio.Transport,
+                 common_headers: CommonHeaders = None,
+                 timeouts: Timeouts = None):
+        super().__init__(
+            transport.get_extra_info("socket"),
+            transport.get_extra_info("peername")[:2], common_headers, None,
+            timeouts)
+        self.transport = transport
+
+    async def send_continue(self, index: int):
+        await self.wait_written(index)
+        self.transport.write(CONTINUE)
+
+
+class TransportWriter(object):
+    """
+    The part of curio's socket interface send_streaming uses,
+    every send waits until the transport's buffer has drained.
+    """
+    __slots__ = ("protocol", )
+
+    def __init__(self, protocol: 'HTTPProtocol'):
+        self.protocol = protocol
+
+    async def sendall(self, data: bytes, flags: int = 0):
+        self.protocol.transport.write(data)
+        await self.protocol.wait_writable()
+
+    async def sendmsg(self, buffers: typing.List[typing.Any]) -> int:
+        # joined, the views get released and the head buffer reused
+        # while the transport may still hold on to them
+        data = b"".join(buffers)
+        await self.sendall(data)
+        return len(data)
+
+
+class HTTPProtocol(asyncio.Protocol):
+    """
+    One connection. httptools is fed straight from data_received,
+    handlers run as tasks and their responses are written
+    in the order the requests came in.
+    """
+    __slots__ = ("backend", "app", "log", "loop", "transport", "session",
+                 "pending", "writer", "body_waiter", "drained", "closing",
+                 "eof", "shut", "linger", "read_paused", "write_paused")
+
+    def __init__(self, backend: 'AsyncioBackend'):
+        self.backend = backend
+        self.app = backend.app
+        self.log = backend.log
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.session = None
+        # (task, keep_alive), in the order the requests were received
+        self.pending = deque()
+        # the task sending a streamed response
+        self.writer = None
+        # waits for a paused body to be read
+        self.body_waiter = None
+        # set while the transport's write buffer is full
+        self.drained = None
+        # no more requests get read
+        self.closing = False
+        # the client has closed its side
+        self.eof = False
+        self.shut = False
+        self.linger = None
+        self.read_paused = False
+        self.write_paused = False
+
+    # asyncio callbacks
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.session = ProtocolSession(transport, self.backend.common_headers,
+                                       self.backend.timeouts)
+        self.backend.protocols.add(self)
+        if self.app.metrics is not None:
+            self.app.metrics.connection_opened()
+        self.rearm()
+
+    def connection_lost(self, exc: typing.Optional[Exception]):
+        self.closing = True
+        self.session.disarm()
+        self.fail_body(ClientDisconnected())
+        for task, _ in self.pending:
+            task.cancel()
+        self.pending.clear()
+        for task in (self.writer, self.body_waiter):
+            if task is not None:
+                task.cancel()
+        if self.linger is not None:
+            self.linger.cancel()
+        if self.drained is not None and not self.drained.done():
+            self.drained.set_exception(ConnectionResetError())
+        if self.app.metrics is not None:
+            self.app.metrics.connection_closed()
+        self.backend.connection_lost(self)
+
+    def data_received(self, data: bytes):
+        if self.closing:
+            # whatever follows the last request is discarded
+            return
+        session = self.session
+        while True:
+            error = None
+            try:
+                session.parser.feed_data(data)
+            except (httptools.HttpParserError,
+                    httptools.HttpParserUpgrade) as e:
+                error = e
+            # requests parsed before an error still get their responses
+            self.dispatch()
+            self.wake_bodies()
+            if not isinstance(error, httptools.HttpParserUpgrade) or \
+                    session.closing_body is not None:
+                break
+            # there are no upgrades here, the request is answered
+            # as usual and the ones after it are parsed afresh
+            data = data[error.args[0]:]
+            session.reset_parser()
+        if isinstance(error, httptools.HttpParserUpgrade):
+            # nothing after it gets served
+            self.stop_reading()
+        elif error is not None:
+            if self.app.metrics is not None:
+                self.app.metrics.parser_errors += 1
+            self.fail(self.backend.parser_error_to_http(error))
+        else:
+            closing = session.closing_body
+            if closing is not None and \
+                    (closing.complete or closing.error is not None):
+                self.stop_reading()
+        self.flow()
+        self.rearm()
+
+    def eof_received(self) -> bool:
+        self.eof = True
+        if self.shut:
+            return False
+        self.fail_body(ClientDisconnected())
+        self.stop_reading()
+        # keep the transport open for the responses still coming
+        return not self.transport.is_closing()
+
+    def pause_writing(self):
+        self.write_paused = True
+        self.flow()
+
+    def resume_writing(self):
+        self.write_paused = False
+        if self.drained is not None and not self.drained.done():
+            self.drained.set_result(None)
+        self.drained = None
+        self.flow()
+
+    async def wait_writable(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError()
+        if self.write_paused:
+            if self.drained is None:
+                self.drained = self.loop.create_future()
+            await self.drained
+
+    # requests
+    def dispatch(self):
+        session = self.session
+        while session.messages:
+            message = session.messages.popleft()
+            self.log.debug("dispatching {} {}", message.request.method,
+                           message.request.url)
+            session.dispatched += 1
+            if session.dispatched > 1 and self.app.metrics is not None:
+                self.app.metrics.keepalive_reuses += 1
+            if not message.keep_alive:
+                session.closing_body = message.request.body
+            session.outstanding += 1
+            self.queue(self.backend.handle_message(message),
+                       message.keep_alive)
+
+    def queue(self, coro: typing.Coroutine, keep_alive: bool):
+        task = self.loop.create_task(coro)
+        self.pending.append((task, keep_alive))
+        task.add_done_callback(self.flush)
+
+    def wake_bodies(self):
+        session = self.session
+        touched, session.touched = session.touched, []
+        for body in touched:
+            body.wake_nowait()
+
+    def fail_body(self, e: HTTPException) -> bool:
+        """
+        Fails a request body that is still being received,
+        its handler will respond with the error.
+        """
+        body = self.session.body if self.session is not None else None
+        if body is None or body.complete or body.abandoned:
+            return False
+        body.fail(e)
+        body.wake_nowait()
+        return True
+
+    def fail(self, e: HTTPException):
+        """
+        Answers with e and reads nothing after it.
+        """
+        if not self.fail_body(e):
+            self.session.outstanding += 1
+            self.queue(self.backend.handle_error(self.session, e), False)
+        self.stop_reading()
+
+    def stop_reading(self):
+        self.closing = True
+        self.maybe_close()
+
+    def timed_out(self):
+        session = self.session
+        session.disarm()
+        metrics = self.app.metrics
+        if session.timer != IDLE:
+            if metrics is not None:
+                metrics.request_timeouts += 1
+            self.fail(
+                RequestTimeout(description="timed out reading the request " +
+                               session.timer))
+        else:
+            if metrics is not None:
+                metrics.idle_timeouts += 1
+            self.log.debug("timed out on read while serving keep-alive")
+            self.stop_reading()
+
+    # flow control
+    def flow(self):
+        """
+        Stops reading while too many responses are outstanding,
+        the handler is behind on the body or the client on the responses.
+        """
+        body = self.session.body
+        body_paused = body is not None and body.paused
+        pause = self.write_paused or body_paused or \
+            len(self.pending) >= self.backend.pipeline_depth
+        if pause and not self.read_paused:
+            self.read_paused = True
+            self.transport.pause_reading()
+        elif not pause and self.read_paused:
+            self.read_paused = False
+            if not self.transport.is_closing():
+                self.transport.resume_reading()
+            self.rearm()
+        if body_paused and self.body_waiter is None:
+            self.body_waiter = self.loop.create_task(self.wait_drained(body))
+
+    async def wait_drained(self, body):
+        await body.wait_drained()
+        self.body_waiter = None
+        self.flow()
+
+    def rearm(self):
+        session = self.session
+        timeouts = self.backend.timeouts
+        if self.closing or self.read_paused:
+            # waiting on ourselves, not on the client
+            session.disarm()
+        elif session.receiving:
+            if session.timer == BODY or session.deadline is None:
+                # a body only has to keep moving
+                session.arm(session.timer, getattr(timeouts, session.timer))
+        elif session.outstanding == 0:
+            if self.backend.draining:
+                self.stop_reading()
+                return
+            session.arm(IDLE, timeouts.idle)
+        else:
+            session.disarm()
+
+    # responses
+    def flush(self, _=None):
+        """
+        Writes the responses that are done, stopping at the first
+        one that isn't so they go out in order.
+        """
+        session = self.session
+        while self.pending and self.writer is None:
+            task, keep_alive = self.pending[0]
+            if not task.done():
+                return
+            self.pending.popleft()
+            if task.cancelled() or task.exception() is not None:
+                if not task.cancelled():
+                    self.log.error(
+                        "uncaught exception, file an issue",
+                        exc_info=task.exception())
+                self.abort()
+                return
+            res, req = task.result()
+            body = req.body
+            if body is not None and \
+                    (not body.complete or body.error is not None):
+                # the rest of the body is still on the wire
+                keep_alive = False
+            if self.backend.draining and not self.pending and \
+                    not session.receiving:
+                # the last response before the connection closes
+                keep_alive = False
+            if not keep_alive:
+                res.headers["Connection"] = "close"
+            if is_streamed(res):
+                # file responses too, sendfile wants a curio socket
+                self.writer = self.loop.create_task(
+                    self.stream(res, req, keep_alive))
+                return
+            self.transport.write(b"".join(session.create_response(res, req)))
+            self.finish_response(keep_alive)
+
+    async def stream(self, res: Response, req: NativeRequest,
+                     keep_alive: bool):
+        try:
+            reusable = await send_streaming(
+                TransportWriter(self), self.session.serializer, res, req)
+        except OSError:
+            self.abort()
+            return
+        except Exception:
+            self.log.error("uncaught exception, file an issue", exc_info=True)
+            self.abort()
+            return
+        finally:
+            self.writer = None
+        self.finish_response(keep_alive and reusable)
+        self.flush()
+
+    def finish_response(self, keep_alive: bool):
+        session = self.session
+        session.outstanding -= 1
+        session.wrote_response_nowait()
+        if not keep_alive:
+            for task, _ in self.pending:
+                task.cancel()
+            self.pending.clear()
+            self.closing = True
+            self.shutdown()
+            return
+        self.maybe_close()
+        self.flow()
+        self.rearm()
+
+    # closing
+    @property
+    def idle(self) -> bool:
+        return self.session.idle and not self.pending and self.writer is None
+
+    def maybe_close(self):
+        if self.closing and not self.pending and self.writer is None:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Closes our side once everything is written and waits
+        a while for the client to close its side.
+        """
+        if self.shut:
+            return
+        self.shut = True
+        self.session.disarm()
+        transport = self.transport
+        if transport.is_closing():
+            return
+        if self.eof or not transport.can_write_eof():
+            transport.close()
+            return
+        transport.write_eof()
+        if self.read_paused:
+            self.read_paused = False
+            transport.resume_reading()
+        self.linger = self.loop.call_later(TIMEOUT, self.abort)
+
+    def abort(self):
+        self.transport.abort()
+
+
+class AsyncioBackend(Backend):
+    """
+    HTTP/1.1 on asyncio (or uvloop) protocols,
+    httptools is fed from data_received instead of a task
+    looping over recv.
+    Doesn't support upgrades, WebSocket routes answer with a 426.
+    """
+    ENGINE = "asyncio"
+    SERVER = "responds-asyncio"
+    TIMEOUT = TIMEOUT
+    # how often deadlines are checked, so how late they can fire
+    SWEEP_INTERVAL = HTTPToolsBackend.SWEEP_INTERVAL
+    PIPELINE_DEPTH = HTTPToolsBackend.PIPELINE_DEPTH
+
+    def __init__(self,
+                 app: Application,
+                 level: int = logbook.WARNING,
+                 pipeline_depth: int = PIPELINE_DEPTH,
+                 idle_timeout: float = TIMEOUT,
+                 header_timeout: float = TIMEOUT,
+                 body_timeout: float = TIMEOUT):
+        super().__init__(app)
+
+        self.log = logbook.Logger("asyncio-backend", level=level)
+        if pipeline_depth < 1:
+            raise ValueError("pipeline_depth must be at least 1")
+        self.pipeline_depth = pipeline_depth
+        self.timeouts = Timeouts(idle_timeout, header_timeout, body_timeout)
+        self.protocols = set()
+        self.draining = False
+        # set whenever a connection closes, created on the loop
+        self.connection_freed = None
+
+        server = app.server_header
+        if server is None:
+            server = self.SERVER
+        self.common_headers = CommonHeaders(server, app.powered_by,
+                                            app.date_header)
+        self.ticker = None
+        self.sweeper = None
+
+    # they don't touch the connection, shared with the curio backend
+    handle_error = HTTPToolsBackend.handle_error
+    parser_error_to_http = HTTPToolsBackend.parser_error_to_http
+
+    async def handle_message(self, message: Message
+                             ) -> (Response, NativeRequest):
+        req = message.request
+        try:
+            res = await self.app.on_request(req)
+        finally:
+            # unread body data gets discarded from now on
+            await req.body.release()
+        self.log.debug("got response: {}", res)
+        return res, req
+
+    def connection_lost(self, protocol: HTTPProtocol):
+        self.protocols.discard(protocol)
+        if self.connection_freed is not None:
+            self.connection_freed.set()
+
+    async def serve(self, sock):
+        """
+        Accepts connections until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        self.connection_freed = asyncio.Event()
+        self.start_timers(loop)
+        # curio's socket gives its descriptor up to the loop
+        listener = socket.socket(fileno=sock.detach())
+        server = await loop.create_server(
+            lambda: HTTPProtocol(self), sock=listener)
+        try:
+            await loop.create_future()
+        finally:
+            server.close()
+
+    async def drain(self, timeout: float):
+        """
+        Closes idle keep-alive connections, the busy ones
+        get Connection: close on their last response.
+        Whatever is still open after timeout seconds is aborted.
+        """
+        self.draining = True
+        for protocol in list(self.protocols):
+            if protocol.idle:
+                protocol.stop_reading()
+        try:
+            await asyncio.wait_for(self.wait_closed(), timeout)
+        except asyncio.TimeoutError:
+            self.log.warn("aborting {} connections still open after {}s",
+                          len(self.protocols), timeout)
+            for protocol in list(self.protocols):
+                protocol.abort()
+        finally:
+            for handle in (self.ticker, self.sweeper):
+                if handle is not None:
+                    handle.cancel()
+
+    async def wait_closed(self):
+        while self.protocols:
+            self.connection_freed.clear()
+            await self.connection_freed.wait()
+
+    def start_timers(self, loop: asyncio.AbstractEventLoop):
+        if self.common_headers.date:
+            self.tick(loop)
+        self.sweep(loop)
+
+    def tick(self, loop: asyncio.AbstractEventLoop):
+        self.common_headers.refresh()
+        # right after the second changes
+        self.ticker = loop.call_later(1 - time.time() % 1, self.tick, loop)
+
+    def sweep(self, loop: asyncio.AbstractEventLoop):
+        """
+        Times out the connections that have been kept waiting
+        past their deadline, one pass over every connection
+        instead of a timer per read.
+        """
+        now = time.monotonic()
+        for protocol in list(self.protocols):
+            deadline = protocol.session.deadline
+            if deadline is not None and deadline <= now:
+                protocol.timed_out()
+        self.sweeper = loop.call_later(self.SWEEP_INTERVAL, self.sweep, loop)
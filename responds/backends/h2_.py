@@ -0,0 +1,503 @@
+import itertools
+import typing
+
+import curio
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+import h2.settings
+import logbook
+from h2.errors import ErrorCodes
+from h2.settings import SettingCodes
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.wrappers import Response
+
+from . import IDLE, ReadTimeout, Session, Upgrade
+from ..app import Application
+from ..body import RequestBody
+from ..request import NativeRequest
+from ..util import StreamingResponse
+from .http1 import (CommonHeaders, _close_stream, _has_body, _header_environ,
+                    _iter_stream)
+from .httptools_ import HTTPToolsBackend
+
+PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+# connection-specific headers aren't allowed in HTTP/2
+HOP_BY_HOP = frozenset(("connection", "keep-alive", "proxy-connection",
+                        "transfer-encoding", "upgrade"))
+
+
+class H2Stream(object):
+    __slots__ = ("stream_id", "req", "task", "window_open", "reset",
+                 "unacked", "drainer")
+
+    def __init__(self, stream_id: int, req: NativeRequest):
+        self.stream_id = stream_id
+        self.req = req
+        self.task = None
+        # set whenever the peer might have opened the flow control window
+        self.window_open = curio.Event()
+        self.reset = False
+        # received body bytes we haven't returned to the peer's window yet
+        self.unacked = 0
+        self.drainer = None
+
+
+class H2Session(Session):
+    __slots__ = ("conn", "server", "remote_addr", "common_headers", "streams",
+                 "touched", "write_lock", "terminated", "closed")
+
+    def __init__(self,
+                 sock,
+                 addr: (str, int),
+                 common_headers: CommonHeaders = None,
+                 settings: typing.Dict[int, int] = None):
+        super().__init__(sock, addr)
+        config = h2.config.H2Configuration(
+            client_side=False, header_encoding="utf-8")
+        self.conn = h2.connection.H2Connection(config=config)
+        if settings:
+            # sent with the connection preface
+            self.conn.local_settings = h2.settings.Settings(
+                client=False, initial_values=settings)
+        self.server = sock.getsockname()[:2]
+        self.remote_addr = self.remote_ip + ":" + str(self.remote_port)
+        self.common_headers = common_headers
+        self.streams = {}
+        # bodies that got data during the last receive_data
+        self.touched = []
+        # frames have to leave in the order h2 produced them
+        self.write_lock = curio.Lock()
+        self.terminated = False
+        # whether we've sent a GOAWAY
+        self.closed = False
+
+    def create_request(self, headers: typing.List[typing.Tuple[str, str]],
+                       body: RequestBody = None) -> NativeRequest:
+        pseudo = {}
+        fields = []
+        for name, value in headers:
+            if name.startswith(":"):
+                pseudo[name] = value
+            else:
+                fields.append((name, value))
+        authority = pseudo.get(":authority")
+        if authority is not None and \
+                not any(name == "host" for name, _ in fields):
+            fields.append(("host", authority))
+        return NativeRequest(
+            method=pseudo.get(":method", "GET"),
+            url=pseudo.get(":path", "/").encode("utf-8"),
+            headers=fields,
+            body=body,
+            http_version="2",
+            server=self.server,
+            remote_addr=self.remote_addr)
+
+    def create_response(self, response: Response,
+                        req: NativeRequest) -> typing.List[typing.Tuple]:
+        headers = response.get_wsgi_headers(_header_environ(response, req))
+        fields = [(":status", str(response.status_code))]
+        for name, value in headers.to_wsgi_list():
+            name = name.lower()
+            if name not in HOP_BY_HOP:
+                fields.append((name, value))
+        if self.common_headers is not None:
+            fields.extend(self.common_headers.fields)
+        return fields
+
+    def touch(self, body: RequestBody):
+        if not self.touched or self.touched[-1] is not body:
+            self.touched.append(body)
+
+    async def wake_windows(self, stream_id: int = 0):
+        if stream_id:
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                await stream.window_open.set()
+            return
+        for stream in list(self.streams.values()):
+            await stream.window_open.set()
+
+    async def flush(self):
+        async with self.write_lock:
+            data = self.conn.data_to_send()
+            if data:
+                await self.sock.sendall(data)
+
+    async def goaway(self):
+        """
+        Tells the peer no more streams will be served.
+        h2 won't send anything after it, so only call it
+        once every stream is done.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.conn.close_connection()
+        await self.flush()
+
+    async def send_data(self, stream: H2Stream, data: bytes,
+                        end_stream: bool = False):
+        """
+        Sends data as fast as the peer's flow control window allows.
+        """
+        stream_id = stream.stream_id
+        view = memoryview(data)
+        while True:
+            if stream.reset:
+                raise h2.exceptions.StreamClosedError(stream_id)
+            window = self.conn.local_flow_control_window(stream_id)
+            if window <= 0 and len(view):
+                stream.window_open.clear()
+                await stream.window_open.wait()
+                continue
+            size = min(window, len(view), self.conn.max_outbound_frame_size)
+            last = size == len(view)
+            self.conn.send_data(
+                stream_id, bytes(view[:size]), end_stream=end_stream and last)
+            await self.flush()
+            if last:
+                return
+            view = view[size:]
+
+    async def respond(self, stream: H2Stream, response: Response):
+        req = stream.req
+        fields = self.create_response(response, req)
+        stream_id = stream.stream_id
+        if not _has_body(response, req):
+            if isinstance(response, StreamingResponse):
+                await _close_stream(response.stream)
+            response.close()
+            self.conn.send_headers(stream_id, fields, end_stream=True)
+            await self.flush()
+            return
+
+        self.conn.send_headers(stream_id, fields)
+        if isinstance(response, StreamingResponse):
+            try:
+                async for chunk in _iter_stream(response.stream):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode(response.charset)
+                    if chunk:
+                        await self.send_data(stream, chunk)
+            finally:
+                await _close_stream(response.stream)
+                response.close()
+            self.conn.end_stream(stream_id)
+            await self.flush()
+            return
+
+        if response.direct_passthrough:
+            app_iter = response.response
+        else:
+            app_iter = response.iter_encoded()
+        try:
+            chunks = [chunk for chunk in app_iter if chunk]
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+            response.close()
+        if not chunks:
+            self.conn.end_stream(stream_id)
+            await self.flush()
+            return
+        for i, chunk in enumerate(chunks):
+            # the last frame carries END_STREAM
+            await self.send_data(stream, chunk, i == len(chunks) - 1)
+
+
+class H2Upgrade(Upgrade):
+    """
+    Switches HTTP/1.1 connections that ask for
+    ``Upgrade: h2c`` over to the HTTP/2 backend.
+    """
+
+    def __init__(self, app: Application, backend: 'H2Backend'):
+        super().__init__(app)
+        self.backend = backend
+
+    def accepts(self, req: NativeRequest) -> bool:
+        return "HTTP2-Settings" in req.headers
+
+    def create_response(self, req: NativeRequest) -> Response:
+        res = Response(
+            status=101, headers=[("Connection", "Upgrade"),
+                                 ("Upgrade", "h2c")])
+        del res.headers["Content-Type"]
+        return res
+
+    async def on_upgrade(self, req: NativeRequest, sock, addr: (str, int),
+                         data: bytes = b""):
+        await self.backend.serve_h2(sock, addr, data, upgraded=req)
+
+
+class H2Backend(HTTPToolsBackend):
+    """
+    Serves HTTP/2 over cleartext next to HTTP/1.
+    Connections that open with the HTTP/2 preface (prior knowledge)
+    are served directly, HTTP/1.1 connections can switch
+    with ``Upgrade: h2c``, anything else goes to HTTPToolsBackend.
+    Every stream is handled by its own task.
+    """
+    SERVER = "responds-h2"
+    MAX_CONCURRENT_STREAMS = 100
+    INITIAL_WINDOW_SIZE = 2**16 - 1
+    MAX_FRAME_SIZE = 2**14
+    MAX_HEADER_LIST_SIZE = 2**16
+
+    def __init__(self,
+                 app: Application,
+                 level: int = logbook.WARNING,
+                 max_concurrent_streams: int = MAX_CONCURRENT_STREAMS,
+                 initial_window_size: int = INITIAL_WINDOW_SIZE,
+                 max_frame_size: int = MAX_FRAME_SIZE,
+                 max_header_list_size: int = MAX_HEADER_LIST_SIZE,
+                 **options):
+        # the rest configures HTTP/1 and admission control
+        super().__init__(app, level, **options)
+        self.h2_log = logbook.Logger("h2-backend", level=level)
+        if max_concurrent_streams < 1:
+            raise ValueError("max_concurrent_streams must be at least 1")
+        self.settings = {
+            SettingCodes.MAX_CONCURRENT_STREAMS: max_concurrent_streams,
+            SettingCodes.INITIAL_WINDOW_SIZE: initial_window_size,
+            SettingCodes.MAX_FRAME_SIZE: max_frame_size,
+            SettingCodes.MAX_HEADER_LIST_SIZE: max_header_list_size,
+        }
+        self.upgrades.setdefault("h2c", H2Upgrade(app, self))
+        self.h2_sessions = set()
+
+    async def sniff(self, sock) -> (typing.Optional[bool], bytes):
+        """
+        Reads until the first bytes tell HTTP/2 from HTTP/1,
+        they're handed to whichever of them serves the connection.
+        None means the client went away.
+        """
+        data = b""
+        while True:
+            chunk = await sock.recv(HTTPToolsBackend.MAX_RECV)
+            if not chunk:
+                return None, data
+            data += chunk
+            if not PREFACE.startswith(data[:len(PREFACE)]):
+                return False, data
+            # no HTTP/1 request starts with "PRI "
+            if len(data) >= 4:
+                return True, data
+
+    async def serve_connection(self, sock, addr: (str, int)):
+        try:
+            async with curio.timeout_after(self.timeouts.idle):
+                is_h2, data = await self.sniff(sock)
+        except (curio.TaskTimeout, OSError):
+            return
+        if is_h2 is None:
+            return
+        if is_h2:
+            await self.serve_h2(sock, addr, data)
+        else:
+            await super().serve_connection(sock, addr, data)
+
+    async def handle_stream(self, session: H2Session, stream: H2Stream):
+        req = stream.req
+        stream_id = stream.stream_id
+        try:
+            try:
+                res = await self.app.on_request(req)
+            finally:
+                await req.body.release()
+            await session.respond(stream, res)
+            if not req.body.complete and not stream.reset:
+                # we answered without reading everything
+                session.conn.reset_stream(stream_id, ErrorCodes.NO_ERROR)
+                await session.flush()
+        except (h2.exceptions.StreamClosedError,
+                h2.exceptions.ProtocolError):
+            self.h2_log.debug("stream {} went away", stream_id)
+        except OSError:
+            self.h2_log.debug("io error on stream {}", stream_id)
+        except Exception:
+            self.h2_log.error(
+                "uncaught exception, file an issue", exc_info=True)
+        finally:
+            session.streams.pop(stream_id, None)
+            if stream.drainer is not None:
+                await stream.drainer.cancel(blocking=False)
+            if self.draining and not session.streams:
+                await self.close_session(session)
+
+    async def close_session(self, session: H2Session):
+        try:
+            await session.goaway()
+        except (h2.exceptions.ProtocolError, OSError):
+            self.h2_log.debug("couldn't send GOAWAY", exc_info=True)
+
+    async def open_stream(self, session: H2Session, stream_id: int,
+                          req: NativeRequest):
+        stream = H2Stream(stream_id, req)
+        session.streams[stream_id] = stream
+        self.h2_log.debug("stream {}: {} {}", stream_id, req.method, req.url)
+        stream.task = await curio.spawn(
+            self.handle_stream(session, stream), daemon=True)
+
+    def acknowledge(self, session: H2Session, stream: H2Stream):
+        unacked, stream.unacked = stream.unacked, 0
+        if unacked:
+            session.conn.acknowledge_received_data(unacked, stream.stream_id)
+
+    async def ack_when_drained(self, session: H2Session, stream: H2Stream):
+        """
+        Holds back the peer's window until the handler
+        has read what's buffered.
+        """
+        await stream.req.body.wait_drained()
+        stream.drainer = None
+        if stream.stream_id in session.streams:
+            self.acknowledge(session, stream)
+            await session.flush()
+
+    async def handle_event(self, session: H2Session, event):
+        if isinstance(event, h2.events.RequestReceived):
+            if self.draining:
+                # the client can safely retry it elsewhere
+                session.conn.reset_stream(event.stream_id,
+                                          ErrorCodes.REFUSED_STREAM)
+                return
+            body = RequestBody()
+            req = session.create_request(event.headers, body)
+            await self.open_stream(session, event.stream_id, req)
+        elif isinstance(event, h2.events.DataReceived):
+            stream = session.streams.get(event.stream_id)
+            if stream is None:
+                # the handler is done, only the connection window matters
+                session.conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id)
+                return
+            body = stream.req.body
+            body.feed(event.data)
+            session.touch(body)
+            stream.unacked += event.flow_controlled_length
+            if not body.paused:
+                self.acknowledge(session, stream)
+            elif stream.drainer is None:
+                stream.drainer = await curio.spawn(
+                    self.ack_when_drained(session, stream), daemon=True)
+        elif isinstance(event, h2.events.StreamEnded):
+            stream = session.streams.get(event.stream_id)
+            if stream is not None:
+                stream.req.body.feed_eof()
+                session.touch(stream.req.body)
+        elif isinstance(event, h2.events.StreamReset):
+            stream = session.streams.get(event.stream_id)
+            if stream is not None:
+                stream.reset = True
+                body = stream.req.body
+                if not body.complete:
+                    body.fail(ClientDisconnected())
+                    session.touch(body)
+                await stream.window_open.set()
+        elif isinstance(event, h2.events.WindowUpdated):
+            await session.wake_windows(event.stream_id)
+        elif isinstance(event, h2.events.RemoteSettingsChanged):
+            if SettingCodes.INITIAL_WINDOW_SIZE in event.changed_settings:
+                await session.wake_windows()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            self.h2_log.debug("peer sent GOAWAY: {}", event.error_code)
+            session.terminated = True
+
+    async def drain(self, timeout: float):
+        """
+        Sends GOAWAY to idle HTTP/2 connections, busy ones
+        refuse new streams and get it once their last stream is done.
+        """
+        self.draining = True
+        for session in list(self.h2_sessions):
+            if not session.streams:
+                await self.close_session(session)
+        await super().drain(timeout)
+
+    def timed_sessions(self) -> typing.Iterable[Session]:
+        return itertools.chain(self.sessions, self.h2_sessions)
+
+    async def read_frames(self, session: H2Session, data: bytes = b""):
+        sock = session.sock
+        while not session.terminated:
+            if not data:
+                if session.streams:
+                    session.disarm()
+                else:
+                    session.arm(IDLE, self.timeouts.idle)
+                try:
+                    session.waiting = True
+                    data = await sock.recv(HTTPToolsBackend.MAX_RECV)
+                except ReadTimeout:
+                    self.h2_log.debug("idle connection timed out")
+                    if self.app.metrics is not None:
+                        self.app.metrics.idle_timeouts += 1
+                    await session.goaway()
+                    return True
+                finally:
+                    session.waiting = False
+                if not data:
+                    self.h2_log.debug("got empty buffer, assume close")
+                    for stream in session.streams.values():
+                        stream.req.body.fail(ClientDisconnected())
+                        await stream.req.body.wake()
+                    return False
+            try:
+                events = session.conn.receive_data(data)
+            except h2.exceptions.ProtocolError:
+                self.h2_log.debug("protocol error", exc_info=True)
+                if self.app.metrics is not None:
+                    self.app.metrics.parser_errors += 1
+                # h2 has queued a GOAWAY
+                await session.flush()
+                return True
+            data = b""
+            for event in events:
+                await self.handle_event(session, event)
+            touched, session.touched = session.touched, []
+            for body in touched:
+                await body.wake()
+            await session.flush()
+        return True
+
+    async def serve_h2(self,
+                       sock,
+                       addr: (str, int),
+                       data: bytes = b"",
+                       upgraded: NativeRequest = None):
+        await self.start_timers()
+        session = H2Session(sock, addr, self.common_headers, self.settings)
+        session.reader = await curio.current_task()
+        graceful = False
+        self.h2_sessions.add(session)
+        try:
+            if upgraded is not None:
+                session.conn.initiate_upgrade_connection(
+                    upgraded.headers["HTTP2-Settings"])
+                # the upgrading request becomes stream 1
+                await self.open_stream(session, 1, upgraded)
+            else:
+                session.conn.initiate_connection()
+            await session.flush()
+            graceful = await self.read_frames(session, data)
+            if session.terminated:
+                # the peer won't open new streams but wants these answered
+                for stream in list(session.streams.values()):
+                    await stream.task.join()
+        except OSError:
+            self.h2_log.error("io error", exc_info=True)
+            return
+        except Exception:
+            self.h2_log.error(
+                "uncaught exception, file an issue", exc_info=True)
+            return
+        finally:
+            self.h2_sessions.discard(session)
+            for stream in list(session.streams.values()):
+                await stream.task.cancel()
+        if graceful:
+            await session.shutdown()
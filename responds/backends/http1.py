@@ -0,0 +1,335 @@
+import errno
+import os
+import socket
+import ssl
+import sys
+import time
+import typing
+from wsgiref.handlers import format_date_time
+
+import curio
+from werkzeug.wrappers import Response
+
+from ..request import NativeRequest
+from ..static import FileResponse, _iter_mapped
+from ..util import StreamingResponse
+
+try:
+    # curio has no public way to wait until a socket is writable,
+    # files are streamed instead of sent with sendfile if this goes away
+    from curio.traps import _write_wait
+except ImportError:
+    _write_wait = None
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+# sendfile can't do more than this in one call on linux
+SENDFILE_MAX = 2**30
+# errors that mean sendfile doesn't work for this file or socket
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+                        errno.EOPNOTSUPP)
+# holds the head back so it leaves with the first bytes of the file
+MSG_MORE = getattr(socket, "MSG_MORE", 0)
+# raw methods and header names -> the str every request shares,
+# bounded so made up names can't grow it forever
+TOKENS = {}
+MAX_TOKENS = 256
+
+
+def token(raw: bytes) -> str:
+    name = TOKENS.get(raw)
+    if name is None:
+        name = raw.decode("ascii")
+        if len(TOKENS) < MAX_TOKENS:
+            TOKENS[raw] = name = sys.intern(name)
+    return name
+
+
+class CommonHeaders(object):
+    """
+    Server, X-Powered-By and Date, pre-encoded
+    so they can be spliced into every response head.
+    ``fields`` holds the same headers as lowercase pairs
+    for backends that don't speak HTTP/1.
+    The Date is refreshed by ``tick`` once a second.
+    """
+
+    def __init__(self,
+                 server: typing.Optional[str],
+                 powered_by: typing.Optional[str],
+                 date: bool = True):
+        static = b""
+        static_fields = []
+        if server:
+            static += b"Server: " + server.encode("latin-1") + b"\r\n"
+            static_fields.append(("server", server))
+        if powered_by:
+            static += b"X-Powered-By: " + powered_by.encode("latin-1") + \
+                b"\r\n"
+            static_fields.append(("x-powered-by", powered_by))
+        self.static = static
+        self.static_fields = static_fields
+        self.date = date
+        self.value = static
+        self.fields = static_fields
+        self.refresh()
+
+    def refresh(self):
+        if self.date:
+            date = format_date_time(None)
+            self.value = self.static + b"Date: " + \
+                date.encode("ascii") + b"\r\n"
+            self.fields = self.static_fields + [("date", date)]
+
+    async def tick(self):
+        while True:
+            # wake up right after the second changes
+            await curio.sleep(1 - time.time() % 1)
+            self.refresh()
+
+
+class ResponseSerializer(object):
+    """
+    Serializes responses into HTTP/1.1 wire buffers.
+    The head is written into a single bytearray
+    that is reused for every response on a connection,
+    body chunks are passed through untouched.
+    """
+
+    __slots__ = ("head", "common_headers")
+
+    def __init__(self, common_headers: CommonHeaders = None):
+        self.head = bytearray()
+        self.common_headers = common_headers
+
+    def write_head(self, status: str,
+                   headers: typing.Iterable[typing.Tuple[str, str]]):
+        head = self.head
+        del head[:]
+        head += b"HTTP/1.1 "
+        head += status.encode("latin-1")
+        head += b"\r\n"
+        for name, value in headers:
+            head += name.encode("latin-1")
+            head += b": "
+            head += value.encode("latin-1")
+            head += b"\r\n"
+        if self.common_headers is not None:
+            head += self.common_headers.value
+        head += b"\r\n"
+        return head
+
+    def serialize(self, response: Response,
+                  req: NativeRequest) -> typing.List[typing.Any]:
+        headers = response.get_wsgi_headers(_header_environ(response, req))
+        buffers = [self.write_head(response.status, headers.to_wsgi_list())]
+        if not _has_body(response, req):
+            response.close()
+            return buffers
+        if response.direct_passthrough:
+            app_iter = response.response
+        else:
+            app_iter = response.iter_encoded()
+        try:
+            # iterating doesn't copy, werkzeug yields the bytes it holds
+            buffers.extend(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+            response.close()
+        return buffers
+
+
+async def sendall_vectored(sock, buffers: typing.List[typing.Any]):
+    """
+    Sends every buffer with as few sendmsg calls as possible,
+    without joining them first.
+    """
+    views = [memoryview(buf) for buf in buffers if len(buf)]
+    try:
+        start = 0
+        while start < len(views):
+            sent = await sock.sendmsg(views[start:start + IOV_MAX])
+            while sent:
+                size = views[start].nbytes
+                if sent < size:
+                    views[start] = views[start][sent:]
+                    break
+                sent -= size
+                start += 1
+    finally:
+        # the head buffer gets resized by the next serialize
+        for view in views:
+            view.release()
+
+
+def _header_environ(response: Response, req: NativeRequest) -> dict:
+    # werkzeug only looks at the environ to make Location absolute
+    if response.autocorrect_location_header and "Location" in response.headers:
+        return req.environ
+    return None
+
+
+def _has_body(response: Response, req: NativeRequest) -> bool:
+    status = response.status_code
+    return not (req.method == "HEAD" or 100 <= status < 200
+                or status in (204, 304))
+
+
+def is_streamed(response: Response) -> bool:
+    """
+    Checks if a response has to be sent with send_streaming,
+    which frames its body, because its length isn't known
+    until it has been iterated.
+    StreamingResponses and werkzeug Responses wrapping an iterator are.
+    """
+    return isinstance(response, StreamingResponse) or \
+        not response.is_sequence
+
+
+async def _close_stream(stream):
+    if hasattr(stream, "aclose"):
+        await stream.aclose()
+    elif hasattr(stream, "close"):
+        stream.close()
+
+
+async def _iter_stream(stream):
+    if hasattr(stream, "__aiter__"):
+        async for chunk in stream:
+            yield chunk
+    else:
+        for chunk in stream:
+            yield chunk
+
+
+async def send_streaming(sock, serializer: ResponseSerializer,
+                         response: StreamingResponse,
+                         req: NativeRequest) -> bool:
+    """
+    Sends a StreamingResponse, or a Response wrapping an iterator,
+    as its chunks are produced.
+    Every send waits for the socket to drain,
+    so a slow client slows the producer down.
+    Returns False if the connection can't be reused.
+    """
+    headers = response.get_wsgi_headers(_header_environ(response, req))
+    has_body = _has_body(response, req)
+    length = headers.get("Content-Length", type=int)
+    keep_alive = True
+    chunked = False
+    if length is None and has_body:
+        if req.http_version == "1.0":
+            # no chunked encoding, the end of the body is the end of the socket
+            keep_alive = False
+            headers["Connection"] = "close"
+        else:
+            chunked = True
+            headers["Transfer-Encoding"] = "chunked"
+    head = serializer.write_head(response.status, headers.to_wsgi_list())
+
+    if isinstance(response, StreamingResponse):
+        stream = response.stream
+    elif response.direct_passthrough:
+        stream = response.response
+    else:
+        stream = response.iter_encoded()
+    if not has_body:
+        await _close_stream(stream)
+        response.close()
+        await sendall_vectored(sock, [head])
+        return keep_alive
+
+    await sendall_vectored(sock, [head])
+    sent = 0
+    try:
+        async for chunk in _iter_stream(stream):
+            if isinstance(chunk, str):
+                chunk = chunk.encode(response.charset)
+            if not chunk:
+                # an empty chunk would end the body
+                continue
+            sent += len(chunk)
+            if chunked:
+                await sendall_vectored(
+                    sock, [b"%x\r\n" % len(chunk), chunk, b"\r\n"])
+            else:
+                await sock.sendall(chunk)
+    finally:
+        await _close_stream(stream)
+        response.close()
+    if chunked:
+        await sock.sendall(b"0\r\n\r\n")
+    elif length is not None and sent != length:
+        # the client can't tell where the next response starts
+        keep_alive = False
+    return keep_alive
+
+
+def _can_sendfile(sock) -> bool:
+    # sendfile would skip the encryption
+    return hasattr(os, "sendfile") and _write_wait is not None and \
+        not isinstance(getattr(sock, "_socket", None), ssl.SSLSocket)
+
+
+async def _wait_writable(sock):
+    """
+    Waits until a curio socket can take more data.
+    Only called when _can_sendfile said yes.
+    """
+    await _write_wait(sock.fileno())
+
+
+async def _sendfile(sock, fd: int, offset: int, count: int) -> int:
+    fileno = sock.fileno()
+    total = 0
+    while count:
+        try:
+            sent = os.sendfile(fileno, fd, offset, min(count, SENDFILE_MAX))
+        except BlockingIOError:
+            await _wait_writable(sock)
+            continue
+        if not sent:
+            break
+        total += sent
+        offset += sent
+        count -= sent
+    return total
+
+
+async def send_file(sock, serializer: ResponseSerializer,
+                    response: FileResponse, req: NativeRequest) -> bool:
+    """
+    Sends a FileResponse with os.sendfile,
+    so the file never gets copied through Python.
+    Falls back to sending it from a memory map
+    if sendfile isn't available for this file or socket.
+    Returns False if the connection can't be reused.
+    """
+    if not _can_sendfile(sock):
+        return await send_streaming(sock, serializer, response, req)
+    await _close_stream(response.stream)
+    headers = response.get_wsgi_headers(_header_environ(response, req))
+    head = serializer.write_head(response.status, headers.to_wsgi_list())
+    try:
+        if not _has_body(response, req) or not response.count:
+            await sendall_vectored(sock, [head])
+            return True
+        await sock.sendall(head, MSG_MORE)
+        offset, count = response.offset, response.count
+        try:
+            sent = await _sendfile(sock, response.file.fd, offset, count)
+        except OSError as e:
+            if e.errno not in SENDFILE_UNSUPPORTED:
+                raise
+            sent = 0
+            for chunk in _iter_mapped(response.file, offset, count):
+                await sock.sendall(chunk)
+                sent += len(chunk)
+        # a file that shrunk while it was sent leaves the body short
+        return sent == count
+    finally:
+        response.close()
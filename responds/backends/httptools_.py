@@ -1,24 +1,80 @@
-from io import BytesIO
-from wsgiref.handlers import format_date_time
+import functools
+import sys
+import time
+import typing
+from collections import deque, namedtuple
+from socket import SHUT_WR
 
 import curio
 import httptools
 import logbook
-from werkzeug.datastructures import MultiDict
-from werkzeug.exceptions import (BadRequest, InternalServerError,
+from werkzeug.exceptions import (BadRequest, ClientDisconnected,
+                                 HTTPException, InternalServerError,
                                  MethodNotAllowed, RequestTimeout)
-from werkzeug.wrappers import Request, Response
+from werkzeug.wrappers import Response
 
-from . import Backend, Session
+from . import (BODY, HEADER, IDLE, CurioBackend, ReadTimeout, Session,
+               Timeouts, Upgrade)
+from .. import engine
 from ..app import Application
-from ..fakewsgi import SaneWSGIWrapper, to_wsgi_environment
+from ..body import RequestBody
+from ..request import NativeRequest
+from ..static import FileResponse
+from ..websocket import WebSocketUpgrade
+from .http1 import (CommonHeaders, ResponseSerializer, is_streamed,
+                    send_file, send_streaming, sendall_vectored, token)
+
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+# a request whose headers have been parsed, waiting to be dispatched
+Message = namedtuple("Message", ("request", "keep_alive", "upgrade"))
 
 
 class HTTPToolsSession(Session):
-    def __init__(self, sock, addr: (str, int)):
+    __slots__ = ("timeouts", "parser", "server", "remote_addr", "serializer",
+                 "messages", "dispatched", "touched", "graceful",
+                 "outstanding", "receiving", "closing_body", "upgrades",
+                 "upgrade", "leftover", "parsed", "written", "written_event",
+                 "message_complete", "body", "url", "headers")
+
+    def __init__(self,
+                 sock,
+                 addr: (str, int),
+                 common_headers: CommonHeaders = None,
+                 upgrades: typing.Dict[str, Upgrade] = None,
+                 timeouts: Timeouts = None):
         super().__init__(sock, addr)
+        self.timeouts = timeouts
 
         self.parser = httptools.HttpRequestParser(self)
+        # these don't change for the lifetime of the connection
+        self.server = sock.getsockname()[:2]
+        self.remote_addr = self.remote_ip + ":" + str(self.remote_port)
+        self.serializer = ResponseSerializer(common_headers)
+        # messages, in the order they were received
+        self.messages = deque()
+        # how many have been dispatched
+        self.dispatched = 0
+        # bodies that got data during the last feed_data
+        self.touched = []
+
+        # whether to shut the connection down gracefully once done
+        self.graceful = False
+        # responses dispatched but not yet written
+        self.outstanding = 0
+        # between the first byte of a request and its last
+        self.receiving = False
+        # body of the request that closes the connection
+        self.closing_body = None
+        # protocols the connection can be upgraded to
+        self.upgrades = upgrades or {}
+        # the message that switches protocols, and what came after it
+        self.upgrade = None
+        self.leftover = b""
+        # requests queued for a response, and final responses written,
+        # a 100 Continue waits for the ones ahead of its request
+        self.parsed = 0
+        self.written = 0
+        self.written_event = None
 
         # request props
         self.message_complete = False
@@ -26,65 +82,129 @@ class HTTPToolsSession(Session):
         self.url = b""
         self.headers = []
 
-    def create_environ(self, fake: bool = False):
+    def create_request(self, body: RequestBody = None) -> NativeRequest:
         # we don't process Content-Encoding
         # https://en.wikipedia.org/wiki/Zip_bomb
         # TODO: Maybe send a 400?
-        ip, port = self.sock.getsockname()
-        remote_addr = self.remote_ip + ":" + str(self.remote_port)
-        if fake:
-            # fake environ for a parser error handler
-            return to_wsgi_environment(
-                headers=self.headers,
-                method=self.parser.get_method().decode("ascii"),
-                path=self.url.decode("utf-8"),
-                body=self.body,
-                server_name=ip,
-                server_port=str(port),
-                remote_addr=remote_addr)
-        return to_wsgi_environment(
+        # without a body this is a fake request for a parser error handler
+        return NativeRequest(
+            method=token(self.parser.get_method()),
+            url=self.url,
             headers=self.headers,
-            method=self.parser.get_method().decode("ascii"),
-            path=self.url.decode("utf-8"),
-            body=self.body,
-            server_name=ip,
-            server_port=str(port),
-            remote_addr=remote_addr)
-
-    def create_response(self, response: Response, environ: MultiDict) -> bytes:
-        # TODO: Compress response based on Accept-Encoding
-        wrapper = SaneWSGIWrapper()
-        wrapper.unfuck_iterable(response(environ, wrapper.start_response))
-        res = "HTTP/1.1 " + wrapper.status + "\r\n"
-        for name, value in wrapper.headers:
-            res += name + ": " + value + "\r\n"
-        res += "\r\n"
-        res = res.encode("utf-8")
-        res += wrapper.real_body
-        return res
+            body=body,
+            http_version=sys.intern(self.parser.get_http_version()),
+            server=self.server,
+            remote_addr=self.remote_addr)
+
+    def create_response(self, response: Response,
+                        req: NativeRequest) -> list:
+        # compression is the application's job, see Application.compressor
+        return self.serializer.serialize(response, req)
+
+    async def wait_written(self, count: int):
+        while self.written < count:
+            if self.written_event is None:
+                self.written_event = engine.event()
+            self.written_event.clear()
+            await self.written_event.wait()
+
+    async def wrote_response(self):
+        self.written += 1
+        if self.written_event is not None:
+            await self.written_event.set()
+
+    def wrote_response_nowait(self):
+        """
+        wrote_response for callback based backends,
+        outside of a coroutine.
+        """
+        self.written += 1
+        if self.written_event is not None:
+            self.written_event.set_nowait()
+
+    async def send_continue(self, index: int):
+        # pipelined responses ahead of the request go out first,
+        # the interim response can't cut in before or between them
+        await self.wait_written(index)
+        await self.sock.sendall(CONTINUE)
+
+    @property
+    def idle(self) -> bool:
+        # nothing half received and nothing left to answer
+        return not self.receiving and self.outstanding == 0
+
+    def find_upgrade(self, req: NativeRequest) -> typing.Optional[Upgrade]:
+        if not self.upgrades or not self.parser.should_upgrade():
+            return None
+        if req.content_length or "Transfer-Encoding" in req.headers:
+            # the body would have to be read before switching
+            return None
+        for protocol in req.headers.get("Upgrade", "").split(","):
+            upgrade = self.upgrades.get(protocol.strip().lower())
+            if upgrade is not None and upgrade.accepts(req):
+                return upgrade
+        return None
+
+    def reset_parser(self):
+        # a parser doesn't go on after an upgrade nobody took
+        self.parser = httptools.HttpRequestParser(self)
+
+    def touch(self):
+        if not self.touched or self.touched[-1] is not self.body:
+            self.touched.append(self.body)
 
     # httptools callbacks
-    # TODO: Might want to optimize constructors here
     def on_message_begin(self):
+        if self.timeouts is not None:
+            # not pushed back by later reads, that's what slowloris needs
+            self.arm(HEADER, self.timeouts.header)
+        self.receiving = True
         self.message_complete = False
-        self.body = BytesIO()
+        self.body = None
         self.url = b""
         self.headers = []
 
     def on_url(self, url: bytes):
-        self.url = url
+        self.url += url
 
     def on_header(self, name: bytes, value: bytes):
-        self.headers.append((name.decode("ascii"), value.decode("ascii")))
+        self.headers.append((token(name), value.decode("ascii")))
 
     def on_headers_complete(self):
-        pass
+        send_continue = None
+        if self.parser.get_http_version() == "1.1":
+            for name, value in self.headers:
+                if name.lower() == "expect" and \
+                        value.lower() == "100-continue":
+                    send_continue = functools.partial(
+                        self.send_continue, self.parsed)
+        self.body = RequestBody(send_continue=send_continue)
+        if self.timeouts is not None:
+            self.arm(BODY, self.timeouts.body)
+        if self.closing_body is not None:
+            # nothing after a Connection: close request gets served
+            return
+        req = self.create_request(self.body)
+        keep_alive = self.parser.should_keep_alive()
+        upgrade = self.find_upgrade(req)
+        if upgrade is None and self.parser.should_upgrade() and \
+                (req.content_length or "Transfer-Encoding" in req.headers):
+            # the parser stops after the headers of an upgrade,
+            # so nothing tells where the body ends
+            keep_alive = False
+        self.parsed += 1
+        self.messages.append(
+            Message(request=req, keep_alive=keep_alive, upgrade=upgrade))
 
     def on_body(self, body: bytes):
-        self.body.write(body)
+        self.body.feed(body)
+        self.touch()
 
     def on_message_complete(self):
+        self.receiving = False
         self.message_complete = True
+        self.body.feed_eof()
+        self.touch()
 
     def on_chunk_header(self):
         pass
@@ -93,91 +213,506 @@ class HTTPToolsSession(Session):
         pass
 
 
-class HTTPToolsBackend(Backend):
+class HTTPToolsBackend(CurioBackend):
+    SERVER = "responds-httptools"
     TIMEOUT = 10
+    # how often deadlines are checked, so how late they can fire
+    SWEEP_INTERVAL = 0.5
     MAX_RECV = 2**16
+    # how many pipelined requests can be in flight
+    # before we stop reading from the socket
+    PIPELINE_DEPTH = 16
+    # what to do when a limit is hit
+    OVERLOAD_WAIT = "wait"
+    OVERLOAD_REJECT = "reject"
 
-    def __init__(self, app: Application, level: int = logbook.WARNING):
+    def __init__(self,
+                 app: Application,
+                 level: int = logbook.WARNING,
+                 pipeline_depth: int = PIPELINE_DEPTH,
+                 upgrades: typing.Dict[str, Upgrade] = None,
+                 max_connections: int = None,
+                 max_in_flight: int = None,
+                 max_requests_per_connection: int = None,
+                 overload: str = OVERLOAD_WAIT,
+                 retry_after: int = 1,
+                 idle_timeout: float = TIMEOUT,
+                 header_timeout: float = TIMEOUT,
+                 body_timeout: float = TIMEOUT):
         super().__init__(app)
 
         self.log = logbook.Logger("httptools-backend", level=level)
+        if pipeline_depth < 1:
+            raise ValueError("pipeline_depth must be at least 1")
+        self.pipeline_depth = pipeline_depth
+        self.timeouts = Timeouts(idle_timeout, header_timeout, body_timeout)
+        # keyed by the lowercased Upgrade header token
+        self.upgrades = dict(upgrades or {})
+        self.upgrades.setdefault("websocket", WebSocketUpgrade(app, level))
 
-    def add_common_headers(self, res: Response):
-        res.headers["Server"] = b"responds-httptools"
-        res.headers["X-Powered-By"] = b"responds"
-        res.headers["Date"] = format_date_time(None).encode("ascii")
+        # admission control, None means no limit
+        if overload not in (self.OVERLOAD_WAIT, self.OVERLOAD_REJECT):
+            raise ValueError("overload must be 'wait' or 'reject'")
+        self.max_connections = max_connections
+        self.max_in_flight = max_in_flight
+        self.max_requests_per_connection = max_requests_per_connection
+        self.overload = overload
+        self.open_connections = 0
+        # connection tasks and sessions, for draining
+        self.connections = set()
+        self.sessions = set()
+        self.draining = False
+        # handler tasks that haven't finished
+        self.active = set()
+        self.connection_freed = curio.Event()
+        self.request_freed = curio.Event()
+        # sent as is when shedding, before anything is parsed
+        self.overloaded = b"HTTP/1.1 503 Service Unavailable\r\n" \
+            b"Content-Length: 0\r\nConnection: close\r\n" \
+            b"Retry-After: %d\r\n\r\n" % retry_after
 
-    async def handle_parser_error(self, session: HTTPToolsSession,
-                                  e: httptools.HttpParserError):
-        sock = session.sock
+        server = app.server_header
+        if server is None:
+            server = self.SERVER
+        self.common_headers = CommonHeaders(server, app.powered_by,
+                                            app.date_header)
+        self.ticker = None
+        self.sweeper = None
+
+    async def handle_message(self, session: HTTPToolsSession,
+                             message: Message) -> (Response, NativeRequest):
+        req = message.request
+        try:
+            res = await self.app.on_request(req)
+        finally:
+            # unread body data gets discarded from now on
+            await req.body.release()
+            await self.finish_request(await curio.current_task())
+        self.log.debug("got response: {}", res)
+        return res, req
+
+    async def handle_error(self, session: HTTPToolsSession,
+                           e: HTTPException) -> (Response, NativeRequest):
+        req = session.create_request()
+        res = await self.app.handle_httpexception(req, e)
+        return res, req
+
+    def parser_error_to_http(self, e: Exception) -> HTTPException:
         if isinstance(e, httptools.HttpParserInvalidMethodError):
             http_e = MethodNotAllowed()
         elif isinstance(e, httptools.HttpParserError):
             http_e = BadRequest()
-        elif isinstance(e, httptools.HttpParserUpgrade):
-            http_e = BadRequest(description="Invalid upgrade header.")
         else:
             http_e = InternalServerError()
             http_e.__cause__ = e
-        environ = session.create_environ(fake=True)
-        res = await self.app.handle_httpexception(environ, http_e)
-        self.add_common_headers(res)
-        await sock.sendall(session.create_response(res, environ))
-        await session.shutdown()
+        return http_e
 
-    async def on_connection(self, sock, addr: (str, int)):
-        session = HTTPToolsSession(sock, addr)
-        while True:
-            try:
-                async with curio.timeout_after(HTTPToolsBackend.TIMEOUT):
-                    self.log.debug("waiting for data")
-                    data = await sock.recv(HTTPToolsBackend.MAX_RECV)
-                    self.log.debug("got data")
+    async def dispatch(self, session: HTTPToolsSession,
+                       pending: curio.Queue):
+        """
+        Spawns a handler for every message
+        as soon as its headers are parsed.
+        """
+        while session.messages:
+            message = session.messages.popleft()
+            if message.upgrade is not None:
+                # served by the upgrade once the responses before it are out
+                session.upgrade = message
+                session.messages.clear()
+                return
+            if not await self.admit_request():
+                # answered with a 503, nothing after it gets served
+                session.closing_body = message.request.body
+                session.messages.clear()
+                await pending.put((None, False))
+                return
+            self.log.debug("dispatching {} {}", message.request.method,
+                           message.request.url)
+            task = await curio.spawn(self.handle_message(session, message))
+            self.active.add(task)
+            session.dispatched += 1
+            if session.dispatched > 1 and self.app.metrics is not None:
+                self.app.metrics.keepalive_reuses += 1
+            keep_alive = message.keep_alive
+            limit = self.max_requests_per_connection
+            if limit is not None and session.dispatched >= limit:
+                keep_alive = False
+            if not keep_alive:
+                session.closing_body = message.request.body
+            session.outstanding += 1
+            # blocks while pipeline_depth responses are outstanding
+            await pending.put((task, keep_alive))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.active)
+
+    async def finish_request(self, task: curio.Task):
+        if task in self.active:
+            self.active.remove(task)
+            await self.request_freed.set()
+
+    async def admit_request(self) -> bool:
+        """
+        Applies max_in_flight, either by waiting for
+        a request to finish or by refusing this one.
+        """
+        limit = self.max_in_flight
+        if limit is None or self.in_flight < limit:
+            return True
+        metrics = self.app.metrics
+        if self.overload == self.OVERLOAD_REJECT:
+            if metrics is not None:
+                metrics.requests_shed += 1
+            return False
+        if metrics is not None:
+            metrics.requests_queued += 1
+        try:
+            while self.in_flight >= limit:
+                self.request_freed.clear()
+                await self.request_freed.wait()
+        finally:
+            if metrics is not None:
+                metrics.requests_queued -= 1
+        return True
+
+    async def wake_bodies(self, session: HTTPToolsSession):
+        touched, session.touched = session.touched, []
+        for body in touched:
+            await body.wake()
+
+    async def fail_body(self, session: HTTPToolsSession,
+                        e: HTTPException) -> bool:
+        """
+        Fails a request body that is still being received,
+        its handler will respond with the error.
+        """
+        body = session.body
+        if body is None or body.complete or body.abandoned:
+            return False
+        body.fail(e)
+        await body.wake()
+        return True
+
+    async def read_requests(self, session: HTTPToolsSession,
+                            pending: curio.Queue, data: bytes = b""):
+        sock = session.sock
+        try:
+            while True:
+                if session.receiving:
+                    if session.timer == BODY:
+                        # a body only has to keep moving
+                        session.arm(BODY, self.timeouts.body)
+                elif session.outstanding == 0:
+                    if self.draining:
+                        session.graceful = True
+                        return
+                    session.arm(IDLE, self.timeouts.idle)
+                else:
+                    # waiting on our own handlers, not on the client
+                    session.disarm()
+                try:
+                    session.waiting = True
+                    if not data:
+                        self.log.debug("waiting for data")
+                        data = await sock.recv(HTTPToolsBackend.MAX_RECV)
+                        self.log.debug("got data")
+                except ReadTimeout as e:
+                    metrics = self.app.metrics
+                    if session.timer != IDLE:
+                        if metrics is not None:
+                            metrics.request_timeouts += 1
+                        http_e = RequestTimeout(
+                            description="timed out reading the request " +
+                            session.timer)
+                        http_e.__cause__ = e
+                        if not await self.fail_body(session, http_e):
+                            task = await curio.spawn(
+                                self.handle_error(session, http_e))
+                            await pending.put((task, False))
+                    else:
+                        if metrics is not None:
+                            metrics.idle_timeouts += 1
+                        self.log.debug(
+                            "timed out on read while serving keep-alive")
+                    session.graceful = True
+                    return
+                finally:
+                    session.waiting = False
                 if not data:
                     self.log.debug("got empty buffer, assume close")
+                    await self.fail_body(session, ClientDisconnected())
                     return
-                session.parser.feed_data(data)
-                if session.message_complete:
-                    body_len = session.body.tell()
-                    if body_len:
-                        self.log.debug("got body of len {}", body_len)
-                        session.body.seek(0)
-                    environ = session.create_environ()
-                    res = await self.app.on_request(environ, Request(environ))
-                    self.add_common_headers(res)
-                    self.log.debug("got response: {}", res)
-                    await sock.sendall(session.create_response(res, environ))
-                if not session.parser.should_keep_alive():
-                    await session.shutdown()
+                while True:
+                    error = None
+                    try:
+                        session.parser.feed_data(data)
+                    except (httptools.HttpParserError,
+                            httptools.HttpParserUpgrade) as e:
+                        error = e
+                    # requests parsed before an error
+                    # still get their responses
+                    await self.dispatch(session, pending)
+                    await self.wake_bodies(session)
+                    if not isinstance(error, httptools.HttpParserUpgrade):
+                        break
+                    data = data[error.args[0]:]
+                    if session.upgrade is not None:
+                        session.leftover = data
+                        return
+                    if session.closing_body is not None:
+                        session.graceful = True
+                        return
+                    # nobody took the upgrade, the request is answered
+                    # as usual and the ones after it are parsed afresh
+                    session.reset_parser()
+                data = b""
+                if session.upgrade is not None:
                     return
-            except curio.TaskTimeout as e:
-                if not session.message_complete:
-                    http_e = RequestTimeout(description="timed out on read")
-                    http_e.__cause__ = e
-                    fake_env = session.create_environ(True)
-                    res = await self.app.handle_httpexception(fake_env, http_e)
-                    self.add_common_headers(res)
-                    data = session.create_response(res, fake_env)
-                    await sock.sendall(data)
-                elif not session.parser.should_keep_alive():
-                    # we already sent a response
-                    self.log.warn("timed out on read", exc_info=True)
-                else:
-                    # TODO: review
-                    # we've reached a keep-alive timeout
-                    # there's no point in doing anything
-                    # lets just log something & shutdown
-                    self.log.debug(
-                        "timed out on read while serving keep-alive")
-                await session.shutdown()
+                if error is not None:
+                    if self.app.metrics is not None:
+                        self.app.metrics.parser_errors += 1
+                    http_e = self.parser_error_to_http(error)
+                    if not await self.fail_body(session, http_e):
+                        task = await curio.spawn(
+                            self.handle_error(session, http_e))
+                        await pending.put((task, False))
+                    session.graceful = True
+                    return
+                closing = session.closing_body
+                if closing is not None and \
+                        (closing.complete or closing.error is not None):
+                    session.graceful = True
+                    return
+                if session.body is not None:
+                    # stop reading until the handler catches up
+                    await session.body.wait_drained()
+        except OSError:
+            self.log.error("io error", exc_info=True)
+        except Exception:
+            self.log.error("uncaught exception, file an issue", exc_info=True)
+        finally:
+            await pending.put(None)
+
+    async def write_responses(self, session: HTTPToolsSession,
+                              pending: curio.Queue):
+        """
+        Writes responses back in the order
+        their requests were received.
+        """
+        while True:
+            item = await pending.get()
+            if item is None:
                 return
-            except httptools.HttpParserError as e:
-                return await self.handle_parser_error(session, e)
-            except OSError:
-                self.log.error("io error", exc_info=True)
+            task, keep_alive = item
+            if task is None:
+                # shed by admit_request
+                await session.sock.sendall(self.overloaded)
+                session.graceful = True
                 return
-            except Exception:
-                # something really bad happened
-                self.log.error(
-                    "uncaught exception, file an issue", exc_info=True)
+            res, req = await task.join()
+            body = req.body
+            if body is not None and \
+                    (not body.complete or body.error is not None):
+                # the rest of the body is still on the wire
+                keep_alive = False
+                session.graceful = True
+            if self.draining and pending.empty() and \
+                    not session.receiving and not session.messages:
+                # the last response before the connection closes
+                keep_alive = False
+                session.graceful = True
+            if not keep_alive:
+                res.headers["Connection"] = "close"
+            if isinstance(res, FileResponse):
+                if not await send_file(session.sock, session.serializer, res,
+                                       req):
+                    session.graceful = True
+                    return
+            elif is_streamed(res):
+                if not await send_streaming(session.sock, session.serializer,
+                                            res, req):
+                    session.graceful = True
+                    return
+            else:
+                await sendall_vectored(session.sock,
+                                       session.create_response(res, req))
+            session.outstanding -= 1
+            await session.wrote_response()
+            if not keep_alive:
                 return
+            if session.waiting and session.idle:
+                session.arm(IDLE, self.timeouts.idle)
+
+    async def serve(self, sock):
+        """
+        Accepts connections until the kernel exits.
+        Past max_connections the loop either stops accepting
+        (new connections wait in the listen backlog)
+        or answers them with a 503 right away.
+        """
+        async with sock:
+            while True:
+                if self.overload == self.OVERLOAD_WAIT:
+                    await self.wait_for_connection_slot()
+                client, addr = await sock.accept()
+                limit = self.max_connections
+                if limit is not None and self.open_connections >= limit:
+                    if self.app.metrics is not None:
+                        self.app.metrics.connections_shed += 1
+                    await curio.spawn(self.reject(client), daemon=True)
+                    continue
+                self.open_connections += 1
+                self.connections.add(await curio.spawn(
+                    self.run_connection(client, addr), daemon=True))
+
+    async def wait_for_connection_slot(self):
+        limit = self.max_connections
+        if limit is None or self.open_connections < limit:
+            return
+        metrics = self.app.metrics
+        if metrics is not None:
+            metrics.accept_paused = 1
+        try:
+            while self.open_connections >= limit:
+                self.connection_freed.clear()
+                await self.connection_freed.wait()
+        finally:
+            if metrics is not None:
+                metrics.accept_paused = 0
+
+    async def run_connection(self, sock, addr: (str, int)):
+        try:
+            async with sock:
+                await self.on_connection(sock, addr)
+        finally:
+            self.open_connections -= 1
+            self.connections.discard(await curio.current_task())
+            await self.connection_freed.set()
+
+    async def drain(self, timeout: float):
+        """
+        Closes idle keep-alive connections, the busy ones
+        get Connection: close on their last response.
+        Whatever is still open after timeout seconds is cancelled.
+        """
+        self.draining = True
+        for upgrade in self.upgrades.values():
+            await upgrade.drain()
+        for session in list(self.sessions):
+            if session.waiting and session.idle:
+                session.graceful = True
+                await session.reader.cancel()
+        try:
+            async with curio.timeout_after(timeout):
+                while self.connections:
+                    self.connection_freed.clear()
+                    await self.connection_freed.wait()
+        except curio.TaskTimeout:
+            self.log.warn("cancelling {} connections still open after {}s",
+                          len(self.connections), timeout)
+            for task in list(self.connections):
+                await task.cancel()
+
+    async def reject(self, sock):
+        async with sock:
+            try:
+                await sock.sendall(self.overloaded)
+                await sock.shutdown(SHUT_WR)
+                # give the client a moment to read it before the close
+                async with curio.ignore_after(1):
+                    while await sock.recv(HTTPToolsBackend.MAX_RECV):
+                        pass
+            except OSError:
+                pass
+
+    async def on_connection(self, sock, addr: (str, int)):
+        metrics = self.app.metrics
+        if metrics is None:
+            await self.serve_connection(sock, addr)
+            return
+        metrics.connection_opened()
+        try:
+            await self.serve_connection(sock, addr)
+        finally:
+            metrics.connection_closed()
+
+    def timed_sessions(self) -> typing.Iterable[Session]:
+        return self.sessions
+
+    async def sweep(self):
+        """
+        Cancels the readers that have been kept waiting past their
+        deadline, one pass over every session instead of
+        a kernel timeout around every read.
+        """
+        while True:
+            await curio.sleep(self.SWEEP_INTERVAL)
+            now = time.monotonic()
+            expired = [
+                session for session in self.timed_sessions()
+                if session.waiting and session.deadline is not None
+                and session.deadline <= now
+            ]
+            for session in expired:
+                session.disarm()
+                await session.reader.cancel(exc=ReadTimeout, blocking=False)
+
+    async def start_timers(self):
+        if self.ticker is None and self.common_headers.date:
+            self.ticker = await curio.spawn(
+                self.common_headers.tick, daemon=True)
+        if self.sweeper is None:
+            self.sweeper = await curio.spawn(self.sweep, daemon=True)
+
+    async def serve_connection(self, sock, addr: (str, int),
+                               data: bytes = b""):
+        """
+        Serves HTTP/1 on a connection,
+        data is what was already read from it.
+        """
+        await self.start_timers()
+        session = HTTPToolsSession(sock, addr, self.common_headers,
+                                   self.upgrades, self.timeouts)
+        pending = curio.Queue(maxsize=self.pipeline_depth)
+        reader = session.reader = await curio.spawn(
+            self.read_requests(session, pending, data))
+        self.sessions.add(session)
+        try:
+            await self.write_responses(session, pending)
+        except OSError:
+            self.log.error("io error", exc_info=True)
+            return
+        except Exception:
+            # something really bad happened
+            self.log.error("uncaught exception, file an issue", exc_info=True)
+            return
+        finally:
+            self.sessions.discard(session)
+            await reader.cancel()
+            while not pending.empty():
+                item = await pending.get()
+                if item is not None and item[0] is not None:
+                    # a task cancelled before it started never gets to finish
+                    await item[0].cancel()
+                    await self.finish_request(item[0])
+        if session.upgrade is not None:
+            await self.switch_protocols(session, addr)
+        elif session.graceful:
+            await session.shutdown()
+
+    async def switch_protocols(self, session: HTTPToolsSession,
+                               addr: (str, int)):
+        req = session.upgrade.request
+        upgrade = session.upgrade.upgrade
+        self.log.debug("switching protocols for {}", req.url)
+        try:
+            res = upgrade.create_response(req)
+            await sendall_vectored(session.sock,
+                                   session.create_response(res, req))
+            await upgrade.on_upgrade(req, session.sock, addr,
+                                     session.leftover)
+        except OSError:
+            self.log.error("io error", exc_info=True)
+        except Exception:
+            self.log.error("uncaught exception, file an issue", exc_info=True)
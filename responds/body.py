@@ -0,0 +1,137 @@
+import typing
+from collections import deque
+
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+
+from . import engine
+
+
+class RequestBody(object):
+    """
+    A request body that's consumed while it's being received.
+    The backend feeds it from its parser callbacks,
+    handlers read it with ``async for chunk in ctx.body``
+    or ``await ctx.body.read()``.
+    """
+    __slots__ = ("limit", "send_continue", "chunks", "buffered", "received",
+                 "complete", "abandoned", "error", "_readable", "_drained")
+    # how much can be buffered before the backend stops reading
+    HIGH_WATER = 2**18
+
+    def __init__(self,
+                 limit: int = None,
+                 send_continue: typing.Callable = None):
+        self.limit = limit
+        # sends a 100 Continue before the first read, if the client asked
+        self.send_continue = send_continue
+        self.chunks = deque()
+        self.buffered = 0
+        self.received = 0
+        self.complete = False
+        self.abandoned = False
+        self.error = None
+        # created by the first wait, most bodies are never waited on
+        self._readable = None
+        self._drained = None
+
+    # producer side, called by the backend
+    def feed(self, data: bytes):
+        if self.abandoned or self.error is not None:
+            return
+        self.received += len(data)
+        if self.limit is not None and self.received > self.limit:
+            self.fail(RequestEntityTooLarge())
+            return
+        self.chunks.append(data)
+        self.buffered += len(data)
+
+    def feed_eof(self):
+        self.complete = True
+
+    def set_limit(self, limit: typing.Optional[int]):
+        self.limit = limit
+        if limit is not None and self.received > limit:
+            self.fail(RequestEntityTooLarge())
+
+    def fail(self, e: HTTPException):
+        self.error = e
+        self.chunks.clear()
+        self.buffered = 0
+
+    @property
+    def paused(self) -> bool:
+        return self.buffered >= self.HIGH_WATER and not self.abandoned
+
+    async def wake(self):
+        """
+        Wakes up the consumer after the backend fed data.
+        """
+        if self._readable is not None and \
+                (self.chunks or self.complete or self.error is not None):
+            await self._readable.set()
+
+    def wake_nowait(self):
+        """
+        wake for callback based backends,
+        outside of a coroutine.
+        """
+        if self._readable is not None and \
+                (self.chunks or self.complete or self.error is not None):
+            self._readable.set_nowait()
+
+    async def wait_drained(self):
+        while self.paused:
+            if self._drained is None:
+                self._drained = engine.event()
+            self._drained.clear()
+            await self._drained.wait()
+
+    def abandon(self):
+        """
+        Called once the handler is done,
+        anything still arriving is discarded.
+        """
+        self.abandoned = True
+        self.chunks.clear()
+        self.buffered = 0
+
+    async def release(self):
+        self.abandon()
+        if self._drained is not None:
+            await self._drained.set()
+
+    # consumer side
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        while True:
+            if self.error is not None:
+                raise self.error
+            if self.chunks:
+                break
+            if self.complete or self.abandoned:
+                raise StopAsyncIteration
+            if self.send_continue is not None:
+                send_continue, self.send_continue = self.send_continue, None
+                await send_continue()
+                # data may have come in while it was being sent
+                continue
+            if self._readable is None:
+                self._readable = engine.event()
+            self._readable.clear()
+            await self._readable.wait()
+        chunk = self.chunks.popleft()
+        self.buffered -= len(chunk)
+        if self._drained is not None and self.buffered < self.HIGH_WATER:
+            await self._drained.set()
+        return chunk
+
+    async def read(self) -> bytes:
+        """
+        Reads the whole body.
+        """
+        chunks = []
+        async for chunk in self:
+            chunks.append(chunk)
+        return b"".join(chunks)
@@ -0,0 +1,149 @@
+import time
+import typing
+from collections import OrderedDict
+
+from werkzeug.wrappers import Response
+
+from . import engine
+from .request import NativeRequest
+from .util import StreamingResponse
+
+# roughly what an entry costs besides its body and headers
+ENTRY_OVERHEAD = 256
+CACHEABLE_METHODS = ("GET", "HEAD")
+
+
+class CachedResponse(object):
+    def __init__(self, status: int, headers: typing.List[typing.Tuple],
+                 body: bytes, expires: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored = time.monotonic()
+        self.expires = expires
+        self.size = len(body) + ENTRY_OVERHEAD + sum(
+            len(name) + len(value) for name, value in headers)
+
+    def response(self) -> Response:
+        res = Response(self.body, status=self.status, headers=self.headers)
+        res.headers["Age"] = str(int(time.monotonic() - self.stored))
+        return res
+
+
+def _cacheable(response: Response) -> bool:
+    if response.status_code != 200 or \
+            isinstance(response, StreamingResponse) or \
+            "Set-Cookie" in response.headers:
+        return False
+    cache_control = response.cache_control
+    return not (cache_control.no_store or cache_control.private)
+
+
+class ResponseCache(object):
+    """
+    Caches whole responses of GET (and HEAD) requests for ``ttl`` seconds,
+    keyed by path, query string and the request headers listed in ``vary``.
+    Entries are evicted least recently used first
+    once they take up more than ``max_bytes``.
+    Concurrent misses for the same key are coalesced,
+    only the first one runs the handler.
+    """
+
+    def __init__(self,
+                 ttl: float = 1.0,
+                 max_bytes: int = 2**26,
+                 vary: typing.Sequence[str] = (),
+                 name: str = "default"):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.vary = tuple(vary)
+        self.name = name
+        self.entries = OrderedDict()
+        self.size = 0
+        # key -> Event, set once the handler is done
+        self.flights = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, req: NativeRequest) -> tuple:
+        if not self.vary:
+            return req.path, req.query_string
+        headers = req.headers
+        return (req.path, req.query_string) + tuple(
+            headers.get(name) for name in self.vary)
+
+    def get(self, key: tuple) -> typing.Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def remove(self, key: tuple):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+    def store(self, key: tuple,
+              response: Response) -> typing.Optional[CachedResponse]:
+        if not _cacheable(response):
+            return None
+        entry = CachedResponse(response.status_code,
+                               response.headers.to_wsgi_list(),
+                               response.get_data(),
+                               time.monotonic() + self.ttl)
+        if entry.size > self.max_bytes:
+            return None
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    async def fetch(self, req: NativeRequest,
+                    produce: typing.Callable[[], typing.Awaitable[Response]]
+                    ) -> Response:
+        """
+        Returns the cached response for the request,
+        or runs produce and caches what it returns.
+        """
+        if req.method not in CACHEABLE_METHODS:
+            return await produce()
+        key = self.key(req)
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry.response()
+
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            await flight.wait()
+            entry = self.get(key)
+            if entry is not None:
+                return entry.response()
+            # the first request failed or wasn't cacheable
+            return await produce()
+
+        self.misses += 1
+        flight = self.flights[key] = engine.event()
+        try:
+            response = await produce()
+            self.store(key, response)
+            return response
+        finally:
+            del self.flights[key]
+            await flight.set()
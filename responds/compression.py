@@ -0,0 +1,115 @@
+import typing
+import zlib
+from collections import OrderedDict
+
+from werkzeug.http import parse_accept_header
+from werkzeug.wrappers import Response
+
+from . import engine
+from .request import NativeRequest
+from .util import StreamingResponse
+
+DEFAULT_CONTENT_TYPES = ("text/", "application/json", "application/javascript",
+                         "application/xml", "application/xhtml+xml",
+                         "image/svg+xml")
+
+# zlib window bits for each content-coding
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+class Compressor(object):
+    """
+    Compresses responses based on Accept-Encoding.
+    Bodies of at least ``thread_size`` bytes are compressed
+    in the engine's thread pool so they don't stall the kernel.
+    Responses with an ETag are treated as static,
+    their compressed variants are kept in a small LRU cache.
+    """
+
+    def __init__(self,
+                 level: int = 6,
+                 min_size: int = 1024,
+                 content_types: typing.Sequence[str] = DEFAULT_CONTENT_TYPES,
+                 thread_size: int = 2**17,
+                 cache_size: int = 128):
+        self.level = level
+        self.min_size = min_size
+        # entries ending in a slash match every subtype
+        self.content_types = tuple(content_types)
+        self.thread_size = thread_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def compressible(self, response: Response) -> bool:
+        mimetype = response.mimetype or ""
+        for content_type in self.content_types:
+            if content_type.endswith("/"):
+                if mimetype.startswith(content_type):
+                    return True
+            elif mimetype == content_type:
+                return True
+        return False
+
+    def negotiate(self, accept_encoding: str) -> typing.Optional[str]:
+        if not accept_encoding:
+            return None
+        accept = parse_accept_header(accept_encoding)
+        gzip_q = accept.quality("gzip")
+        deflate_q = accept.quality("deflate")
+        if not gzip_q and not deflate_q:
+            return None
+        return "gzip" if gzip_q >= deflate_q else "deflate"
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      _WBITS[encoding])
+        return compressor.compress(data) + compressor.flush()
+
+    def _cache_get(self, key: tuple) -> typing.Optional[bytes]:
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+        return data
+
+    def _cache_put(self, key: tuple, data: bytes):
+        self.cache[key] = data
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def compress(self, response: Response,
+                       req: NativeRequest) -> Response:
+        status = response.status_code
+        # HEAD is negotiated like GET, so both get the same headers,
+        # the backend drops the body
+        if isinstance(response, StreamingResponse) or status < 200 or \
+                status in (204, 206, 304) or \
+                "Content-Encoding" in response.headers or \
+                not self.compressible(response):
+            return response
+        # caches must not hand a compressed body to other clients
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate(req.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (etag, encoding)
+        compressed = self._cache_get(key) if etag else None
+        if compressed is None:
+            if len(data) >= self.thread_size:
+                compressed = await engine.run_in_thread(
+                    self._compress, data, encoding)
+            else:
+                compressed = self._compress(data, encoding)
+            if etag:
+                self._cache_put(key, compressed)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            # the compressed body is a different representation
+            response.set_etag(etag + "-" + encoding, weak)
+        return response
@@ -0,0 +1,188 @@
+import asyncio
+import functools
+import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import curio
+import curio.workers
+
+
+class CurioEngine(object):
+    """
+    The event loop an application runs on.
+    Everything outside the backends that needs the loop
+    (events, thread and process pools) goes through ``current``,
+    which Application.serve sets before the loop starts.
+    """
+    name = "curio"
+    # what Application.run switches to when asked for this engine
+    backend = "responds.backends.httptools_:HTTPToolsBackend"
+
+    def event(self) -> curio.Event:
+        return curio.Event()
+
+    def set_pools(self, threads: typing.Optional[int],
+                  processes: typing.Optional[int]):
+        # curio sizes its pools when they're first used
+        if threads is not None:
+            curio.workers.MAX_WORKER_THREADS = threads
+        if processes is not None:
+            curio.workers.MAX_WORKER_PROCESSES = processes
+
+    async def run_in_thread(self, func: typing.Callable, *args):
+        return await curio.run_in_thread(func, *args)
+
+    async def run_in_process(self, func: typing.Callable, *args):
+        return await curio.run_in_process(func, *args)
+
+    async def first_of(self, *coros):
+        """
+        Runs the coroutines until one of them returns,
+        the others get cancelled.
+        """
+        async with curio.TaskGroup(wait=any) as group:
+            for coro in coros:
+                await group.spawn(coro)
+        if group.exception is not None:
+            raise group.exception
+
+    def run(self, main: typing.Callable, *args):
+        return curio.run(main, *args)
+
+
+class AsyncioEvent(object):
+    """
+    An asyncio.Event with curio's interface, set is awaited.
+    """
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def set(self):
+        self._event.set()
+
+    def set_nowait(self):
+        self._event.set()
+
+    async def wait(self):
+        await self._event.wait()
+
+
+class AsyncioEngine(object):
+    """
+    Runs on uvloop if it's installed, unless use_uvloop is False.
+    """
+    name = "asyncio"
+    backend = "responds.backends.asyncio_:AsyncioBackend"
+
+    def __init__(self, use_uvloop: bool = None):
+        # None uses it if it can be imported
+        self.use_uvloop = use_uvloop
+        self.threads = None
+        self.processes = None
+        self.thread_pool = None
+        self.process_pool = None
+
+    def event(self) -> AsyncioEvent:
+        return AsyncioEvent()
+
+    def set_pools(self, threads: typing.Optional[int],
+                  processes: typing.Optional[int]):
+        self.threads = threads
+        self.processes = processes
+
+    async def run_in_thread(self, func: typing.Callable, *args):
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(self.threads)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.thread_pool, functools.partial(func, *args))
+
+    async def run_in_process(self, func: typing.Callable, *args):
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(self.processes)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.process_pool, functools.partial(func, *args))
+
+    async def first_of(self, *coros):
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            done, _ = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def policy(self) -> typing.Optional[asyncio.AbstractEventLoopPolicy]:
+        if self.use_uvloop is False:
+            return None
+        try:
+            import uvloop
+        except ImportError:
+            if self.use_uvloop:
+                raise Exception("use_uvloop needs uvloop installed")
+            return None
+        return uvloop.EventLoopPolicy()
+
+    @property
+    def loop_name(self) -> str:
+        return "uvloop" if self.policy() is not None else "asyncio"
+
+    def run(self, main: typing.Callable, *args):
+        previous = asyncio.get_event_loop_policy()
+        policy = self.policy()
+        if policy is not None:
+            asyncio.set_event_loop_policy(policy)
+        try:
+            return asyncio.run(main(*args))
+        finally:
+            asyncio.set_event_loop_policy(previous)
+            for pool in (self.thread_pool, self.process_pool):
+                if pool is not None:
+                    pool.shutdown()
+            self.thread_pool = self.process_pool = None
+
+
+ENGINES = {engine.name: engine for engine in (CurioEngine, AsyncioEngine)}
+# the engine of the application that's serving
+current = CurioEngine()
+
+
+def get_engine(engine: typing.Union[str, CurioEngine, AsyncioEngine]):
+    """
+    Looks an engine up by name, "uvloop" is asyncio
+    that insists on uvloop.
+    """
+    if not isinstance(engine, str):
+        return engine
+    if engine == "uvloop":
+        return AsyncioEngine(use_uvloop=True)
+    if engine not in ENGINES:
+        raise ValueError("unknown engine {!r}".format(engine))
+    return ENGINES[engine]()
+
+
+def use(engine):
+    global current
+    current = engine
+
+
+def event():
+    return current.event()
+
+
+async def run_in_thread(func: typing.Callable, *args):
+    return await current.run_in_thread(func, *args)
+
+
+async def run_in_process(func: typing.Callable, *args):
+    return await current.run_in_process(func, *args)
@@ -7,11 +7,16 @@ from urllib.parse import urlsplit
 
 from werkzeug.datastructures import MultiDict
 
+# header name -> its environ key, bounded like http1.TOKENS
+ENVIRON_NAMES = {}
+MAX_ENVIRON_NAMES = 256
+
 
 class SaneWSGIWrapper(object):
     """
     Forces a WSGI object to be in-line.
     """
+    __slots__ = ("headers", "real_body", "status", "reason")
 
     def __init__(self):
         self.headers = []
@@ -34,8 +39,7 @@ class SaneWSGIWrapper(object):
         """
         Unfucks the WSGI iterable into a single body.
         """
-        for part in i:
-            self.real_body += part
+        self.real_body = b"".join(i)
 
     def __str__(self):
         """
@@ -44,13 +48,27 @@ class SaneWSGIWrapper(object):
         return self.format()
 
 
+def environ_name(header: typing.Union[str, bytes]) -> str:
+    name = ENVIRON_NAMES.get(header)
+    if name is not None:
+        return name
+    name = (header if type(header) is str else header.decode(
+        "ascii")).upper().replace("-", "_")
+    if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+        name = "HTTP_{}".format(name)
+    if len(ENVIRON_NAMES) < MAX_ENVIRON_NAMES:
+        ENVIRON_NAMES[header] = name
+    return name
+
+
 def to_wsgi_environment(headers: list,
                         method: str,
                         path: str,
                         body: BytesIO = None,
                         server_name: str = "responds",
                         server_port: str = "8080",
-                        remote_addr: str = "127.0.0.1:2000") -> MultiDict:
+                        remote_addr: str = "127.0.0.1:2000",
+                        protocol: str = "HTTP/1.1") -> MultiDict:
     if isinstance(headers, dict):
         headers = headers.items()
 
@@ -64,7 +82,7 @@ def to_wsgi_environment(headers: list,
         # Basic items
         "PATH_INFO": sp_path.path,
         "QUERY_STRING": sp_path.query,
-        "SERVER_PROTOCOL": "HTTP/1.1",
+        "SERVER_PROTOCOL": protocol,
         "REQUEST_METHOD": method,
         "SERVER_NAME": server_name,
         "SERVER_PORT": server_port,
@@ -82,12 +100,8 @@ def to_wsgi_environment(headers: list,
     environ["wsgi.version"] = (1, 0)
 
     for header, value in headers:
-        name = (header if type(header) is str else header.decode(
-            "ascii")).upper().replace("-", "_")
-        if header not in ("Content-Type", "Content-Length"):
-            name = "HTTP_{}".format(name)
-
-        environ.add(name, value
-                    if type(value) is str else value.decode("ascii"))
+        environ.add(
+            environ_name(header), value
+            if type(value) is str else value.decode("ascii"))
 
     return environ
@@ -1,22 +1,57 @@
 import inspect
 import typing
 
+from .cache import ResponseCache
+from .handler import Handler
 from .mapper import Mapper
+from .middleware import Middleware, check
 from .route import Route
+from .static import StaticFiles
 
 
 def route(route_rule: str,
           methods: typing.Sequence[str] = ("GET", ),
-          strict_slashes: bool = False):
+          strict_slashes: bool = False,
+          max_body_size: int = None,
+          stream: bool = False,
+          cache: ResponseCache = None,
+          executor: str = None,
+          middleware: typing.Sequence[Middleware] = None):
     def __inner(func):
         if not hasattr(func, "_route"):
             setattr(func, "_route", Route(func))
         func._route.add_path(route_rule, methods, strict_slashes)
+        func._route.configure(max_body_size, stream, cache, executor,
+                              middleware)
         return func
 
     return __inner
 
 
+def websocket(route_rule: str, strict_slashes: bool = False, **options):
+    """
+    Routes WebSocket connections to the method,
+    which gets called with the context and the WebSocket.
+    Takes the same options as WebSocket.
+    """
+
+    def __inner(func):
+        route(route_rule, ("GET", ), strict_slashes)(func)
+        func._route.websocket = options
+        return func
+
+    return __inner
+
+
+def static(url: str, directory: str, **options) -> StaticFiles:
+    """
+    Serves the files under directory at url,
+    relative to the group's prefix.
+    Assign it to a class attribute.
+    """
+    return StaticFiles(directory, **options).mount(url)
+
+
 def error_handler(from_code: int, to_code: int = None):
     def __inner(func):
         setattr(func, "_from_to", (from_code, to_code))
@@ -33,17 +68,77 @@ def prefix(prefix: str = ""):
     return __inner
 
 
+def cached(cache: ResponseCache):
+    """
+    Caches the responses of every route in the group
+    that doesn't have a cache of its own.
+    """
+
+    def __inner(cls):
+        setattr(cls, "_cache", cache)
+        return cls
+
+    return __inner
+
+
+def middleware(*items: Middleware):
+    """
+    Runs the middleware around every route in the group,
+    inside the application's and outside the routes' own.
+    """
+
+    def __inner(cls):
+        setattr(cls, "_middleware", check(items))
+        return cls
+
+    return __inner
+
+
 class Group(object):
+    @classmethod
+    def members(cls) -> typing.Tuple[list, list, list]:
+        """
+        The names of the class's routes, error handlers and static files,
+        in the order inspect.getmembers would list them.
+        Looked up once per class, not once per instance.
+        """
+        members = cls.__dict__.get("_members")
+        if members is None:
+            namespace = {}
+            for klass in reversed(cls.__mro__):
+                namespace.update(vars(klass))
+            routes, handlers, files = [], [], []
+            for name in sorted(namespace):
+                value = namespace[name]
+                if isinstance(value, StaticFiles):
+                    files.append(name)
+                elif not inspect.isfunction(value):
+                    continue
+                elif hasattr(value, "_route"):
+                    routes.append(name)
+                elif hasattr(value, "_from_to"):
+                    handlers.append(name)
+            members = (routes, handlers, files)
+            setattr(cls, "_members", members)
+        return members
+
     def inherit_from(self, parent: Mapper) -> Mapper:
-        prefix = getattr(self.__class__, "_prefix", "")
-        mapper = Mapper(self.__class__.__name__, parent, prefix)
-        methods = inspect.getmembers(self, predicate=inspect.ismethod)
-        for _, method in methods:
-            if hasattr(method, "_route"):
-                method._route.func = method._route.func.__get__(
-                    self, self.__class__)
-                mapper.add_route(method._route)
-            elif hasattr(method, "_from_to"):
-                (from_code, to_code) = method._from_to
-                mapper.add_error_handler(method, from_code, to_code)
+        cls = self.__class__
+        prefix = getattr(cls, "_prefix", "")
+        cache = getattr(cls, "_cache", None)
+        mapper = Mapper(cls.__name__, parent, prefix)
+        mapper.middleware = list(getattr(cls, "_middleware", ()))
+        routes, handlers, files = cls.members()
+        for name in routes:
+            method = getattr(self, name)
+            method._route.func = method._route.func.__get__(self, cls)
+            if method._route.cache is None:
+                method._route.cache = cache
+            mapper.add_route(method._route)
+        for name in handlers:
+            method = getattr(self, name)
+            (from_code, to_code) = method._from_to
+            mapper.add_error_handler(Handler(method), from_code, to_code)
+        for name in files:
+            mapper.add_route(getattr(cls, name))
         return mapper
@@ -1,19 +1,94 @@
+import functools
 import inspect
+import time
+import types
 import typing
 
 from werkzeug.wrappers import Response
 
+from . import engine
 from .util import wrap_response
 
+# where a plain def handler can be run instead of on the kernel
+EXECUTORS = ("thread", "process")
+
+
+@types.coroutine
+def _watch(coro, handler: 'Handler'):
+    # drives the coroutine one step at a time,
+    # timing how long each step holds the kernel
+    clock = time.perf_counter
+    send, throw = coro.send, coro.throw
+    value, error = None, None
+    while True:
+        start = clock()
+        try:
+            if error is not None:
+                trap = throw(error)
+            else:
+                trap = send(value)
+        except StopIteration as e:
+            handler.check_blocking(clock() - start)
+            return e.value
+        handler.check_blocking(clock() - start)
+        try:
+            value, error = (yield trap), None
+        except BaseException as e:
+            value, error = None, e
+
 
 class Handler(object):
     def __init__(self, func: typing.Callable):
         if not callable(func):
             raise Exception("func must be a callable")
         self.func = func
+        # None runs the handler on the kernel
+        self.executor = None
+        # set by Application.build in debug mode
+        self.block_threshold = None
+        self.log = None
+        # for dicts and lists, set by Application.build
+        self.serializer = None
+
+    def set_executor(self, executor: str):
+        if executor not in EXECUTORS:
+            raise ValueError("executor must be one of {}".format(EXECUTORS))
+        if inspect.iscoroutinefunction(self.func):
+            raise Exception("only plain def handlers can use an executor")
+        self.executor = executor
+
+    def watch_blocking(self, threshold: float, log):
+        """
+        Logs a warning whenever the handler
+        holds the kernel for longer than threshold seconds.
+        """
+        self.block_threshold = threshold
+        self.log = log
+
+    def check_blocking(self, elapsed: float):
+        if elapsed > self.block_threshold:
+            self.log.warn("{} blocked the loop for {:.1f} ms",
+                          getattr(self.func, "__qualname__", self.func),
+                          elapsed * 1000)
 
     async def invoke(self, *args, **kwargs) -> Response:
-        ret = self.func(*args, **kwargs)
-        if inspect.isawaitable(ret):
-            ret = await ret
-        return wrap_response(ret)
+        if self.executor == "thread":
+            ret = await engine.run_in_thread(
+                functools.partial(self.func, *args, **kwargs))
+        elif self.executor == "process":
+            # everything passed in and returned gets pickled
+            ret = await engine.run_in_process(
+                functools.partial(self.func, *args, **kwargs))
+        elif self.block_threshold is None:
+            ret = self.func(*args, **kwargs)
+            if inspect.isawaitable(ret):
+                ret = await ret
+        else:
+            start = time.perf_counter()
+            ret = self.func(*args, **kwargs)
+            self.check_blocking(time.perf_counter() - start)
+            if inspect.iscoroutine(ret):
+                ret = await _watch(ret, self)
+            elif inspect.isawaitable(ret):
+                ret = await ret
+        return wrap_response(ret, self.serializer)
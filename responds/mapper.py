@@ -1,10 +1,19 @@
 import typing
 
 from werkzeug.exceptions import HTTPException
-from werkzeug.routing import Map, Submount
 
 from .handler import Handler
 from .route import Route
+from .router import Router
+
+
+class _PrefixNode(object):
+    def __init__(self):
+        # the mapper whose prefix ends at this segment,
+        # and the one whose prefix ends in a slash after it
+        self.mapper = None
+        self.deeper = None
+        self.children = {}
 
 
 class Mapper(object):
@@ -14,19 +23,19 @@ class Mapper(object):
         self.prefix = prefix
         self.children = []
         self.routes = []
-        self.route_map = None
-        self.error_handlers = {}
+        self.router = None
+        # (from_code, to_code, handler), in the order they were added
+        self.error_handlers = []
+        # status code -> handler, this mapper's and its parents',
+        # filled in by build
+        self.error_table = {}
+        # every mapper by the path segments of its full prefix,
+        # filled in by build
+        self.error_prefixes = _PrefixNode()
+        # applies to every route under the mapper
+        self.middleware = []
         self._built = False
 
-    @property
-    def submount(self):
-        rules = []
-        for child in self.children:
-            rules.append(child.submount)
-        for route in self.routes:
-            rules.append(route.submount)
-        return Submount(self.prefix, rules)
-
     @property
     def all_routes(self):
         yield from iter(self.routes)
@@ -34,6 +43,14 @@ class Mapper(object):
         for child in self.children:
             yield from child.all_routes
 
+    def iter_rules(self, prefix: str = ""):
+        prefix = prefix + self.prefix
+        for child in self.children:
+            yield from child.iter_rules(prefix)
+        for route in self.routes:
+            for route_url, methods, strict_slashes in route.paths:
+                yield prefix + route_url, methods, strict_slashes, route
+
     def add_route(self, route: Route):
         route.mapper = self
         self.routes.append(route)
@@ -42,35 +59,126 @@ class Mapper(object):
                           handler: Handler,
                           from_code: int,
                           to_code: int = None):
-        if not to_code:
-            codes = [from_code]
-        else:
-            codes = range(from_code, to_code)
-        for code in codes:
-            # TODO: check for overlapping handlers
-            self.error_handlers[code] = handler
+        # TODO: check for overlapping handlers
+        self.error_handlers.append((from_code, to_code or from_code + 1,
+                                    handler))
+
+    @property
+    def all_error_handlers(self) -> typing.Iterator[Handler]:
+        for _, _, handler in self.error_handlers:
+            yield handler
+        for child in self.children:
+            yield from child.all_error_handlers
+
+    def build_error_tables(self, parent_table: dict = None, prefix: str = ""
+                           ) -> typing.Iterator[typing.Tuple[str, 'Mapper']]:
+        """
+        Expands the handlers into a table per mapper,
+        starting from a copy of the parent's so lookups never fall back.
+        """
+        prefix = prefix + self.prefix
+        table = dict(parent_table or {})
+        for from_code, to_code, handler in self.error_handlers:
+            for code in range(from_code, to_code):
+                table[code] = handler
+        self.error_table = table
+        yield prefix, self
+        for child in self.children:
+            yield from child.build_error_tables(table, prefix)
+
+    def all_middleware(self) -> list:
+        """
+        The middleware of the mapper and its parents, outermost first.
+        """
+        if self.parent is None:
+            return list(self.middleware)
+        return self.parent.all_middleware() + self.middleware
 
     def add_child(self, mapper: 'Mapper'):
         self.children.append(mapper)
 
-    def build(self) -> Map:
+    @property
+    def endpoints(self) -> typing.Dict[str, Route]:
+        return self.router.endpoints
+
+    def build(self, cache: str = None) -> Router:
+        """
+        Compiles the routes. With a cache file the compiled table
+        is loaded from it when the rules are the same as last time,
+        and written to it when they aren't.
+        """
         if self._built:
             raise Exception('already built')
         self._built = True
-        self.route_map = Map([self.submount])
-        return self.route_map
+        self.router = Router()
+        rules = list(self.iter_rules())
+        key = routes = None
+        if cache is not None:
+            routes = {}
+            for _, _, _, route in rules:
+                if routes.setdefault(route.endpoint, route) is not route:
+                    # endpoints can't be mapped back to routes
+                    cache = None
+                    break
+        if cache is not None:
+            key = Router.fingerprint(rules)
+        if cache is None or not self.router.load(cache, key, routes):
+            for rule, methods, strict_slashes, route in rules:
+                self.router.add(rule, methods, strict_slashes, route)
+            self.router.finish()
+            if cache is not None:
+                try:
+                    self.router.dump(cache, key)
+                except OSError:
+                    # the next start builds it again
+                    pass
+        for prefix, mapper in self.build_error_tables():
+            deeper = prefix.endswith("/")
+            if deeper:
+                prefix = prefix[:-1]
+            node = self.error_prefixes
+            for segment in prefix.split("/")[1:]:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _PrefixNode()
+                node = child
+            # the first mapper with a prefix keeps it
+            if deeper:
+                if node.deeper is None:
+                    node.deeper = mapper
+            elif node.mapper is None:
+                node.mapper = mapper
+        return self.router
+
+    def lookup(self, path: str, method: str, query_string: str = ""
+               ) -> (Route, typing.Container[typing.Any]):
+        return self.router.lookup(path, method, query_string)
 
     def match(self, environ: dict) -> (Route, typing.Container[typing.Any]):
-        adapter = self.route_map.bind_to_environ(environ)
-        rule, params = adapter.match(return_rule=True)
-        for route in self.all_routes:
-            if route.endpoint == rule.endpoint:
-                return route, params
-        # it should never reach this path
-        raise Exception('route not found?')
+        return self.lookup(environ["PATH_INFO"], environ["REQUEST_METHOD"],
+                           environ.get("QUERY_STRING", ""))
 
     def get_error_handler(self, e: HTTPException):
-        try:
-            return self.error_handlers[e.code]
-        except KeyError:
-            return None
+        return self.error_table.get(e.code)
+
+    def mapper_for(self, path: str) -> 'Mapper':
+        """
+        The innermost mapper whose prefix the path is under,
+        for errors raised before a route matched.
+        Walks the prefixes one path segment at a time,
+        however many groups there are.
+        """
+        node = self.error_prefixes
+        found = node.mapper or self
+        segments = path.split("/")
+        if segments[0]:
+            return found
+        for index in range(1, len(segments)):
+            if node.deeper is not None:
+                found = node.deeper
+            node = node.children.get(segments[index])
+            if node is None:
+                return found
+            if node.mapper is not None:
+                found = node.mapper
+        return found
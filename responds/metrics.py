@@ -0,0 +1,190 @@
+import typing
+from bisect import bisect_left
+
+# seconds, the last bucket is +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# requests that didn't match a route
+UNMATCHED = "<unmatched>"
+
+
+class EndpointMetrics(object):
+    """
+    Responses by status and a fixed-bucket latency histogram.
+    """
+
+    def __init__(self, buckets: typing.Sequence[float]):
+        self.buckets = buckets
+        # one more for +Inf, not cumulative until rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        # status code -> responses
+        self.statuses = {}
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def cumulative(self) -> typing.Iterator[typing.Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield repr(bound), total
+        yield "+Inf", total + self.counts[-1]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace(
+        "\n", "\\n")
+
+
+class Metrics(object):
+    """
+    Request metrics per endpoint and connection metrics per backend.
+    Everything is a plain attribute or dict update
+    so collecting stays cheap, ``render`` formats it
+    in the Prometheus text format.
+    """
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self,
+                 prefix: str = "responds",
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self.endpoints = {}
+        self.in_flight = 0
+        # updated by the backend
+        self.connections_open = 0
+        self.connections_total = 0
+        self.keepalive_reuses = 0
+        self.parser_errors = 0
+        self.request_timeouts = 0
+        self.idle_timeouts = 0
+        # admission control
+        self.connections_shed = 0
+        self.requests_shed = 0
+        self.requests_queued = 0
+        self.accept_paused = 0
+        # ResponseCaches, rendered by name
+        self.caches = []
+
+    def observe(self, route: typing.Any, status: int, elapsed: float):
+        """
+        Records a response. Keyed by the Route object itself
+        (or UNMATCHED), it's labeled with its endpoint when rendered.
+        """
+        # runs for every request, so everything is inlined
+        metrics = self.endpoints.get(route)
+        if metrics is None:
+            metrics = self.endpoints[route] = EndpointMetrics(self.buckets)
+        metrics.counts[bisect_left(self.buckets, elapsed)] += 1
+        metrics.sum += elapsed
+        statuses = metrics.statuses
+        statuses[status] = statuses.get(status, 0) + 1
+
+    def add_cache(self, cache: 'ResponseCache'):
+        if cache not in self.caches:
+            self.caches.append(cache)
+
+    def connection_opened(self):
+        self.connections_open += 1
+        self.connections_total += 1
+
+    def connection_closed(self):
+        self.connections_open -= 1
+
+    def _metric(self, lines: list, name: str, kind: str, doc: str):
+        lines.append("# HELP {}_{} {}".format(self.prefix, name, doc))
+        lines.append("# TYPE {}_{} {}".format(self.prefix, name, kind))
+
+    def _sample(self, lines: list, name: str, value, **labels):
+        if labels:
+            label_str = ",".join('{}="{}"'.format(key, _escape(str(val)))
+                                 for key, val in labels.items())
+            lines.append("{}_{}{{{}}} {}".format(self.prefix, name, label_str,
+                                                 value))
+        else:
+            lines.append("{}_{} {}".format(self.prefix, name, value))
+
+    def render(self) -> str:
+        lines = []
+        endpoints = sorted(
+            ((getattr(route, "endpoint", route), metrics)
+             for route, metrics in self.endpoints.items()),
+            key=lambda item: item[0])
+
+        self._metric(lines, "requests_total", "counter",
+                     "Responses sent, by endpoint and status.")
+        for endpoint, metrics in endpoints:
+            for status, count in sorted(metrics.statuses.items()):
+                self._sample(lines, "requests_total", count,
+                             endpoint=endpoint, status=status)
+
+        self._metric(lines, "request_duration_seconds", "histogram",
+                     "Time spent handling requests, by endpoint.")
+        for endpoint, metrics in endpoints:
+            for bound, count in metrics.cumulative():
+                self._sample(lines, "request_duration_seconds_bucket", count,
+                             endpoint=endpoint, le=bound)
+            self._sample(lines, "request_duration_seconds_sum",
+                         repr(metrics.sum), endpoint=endpoint)
+            self._sample(lines, "request_duration_seconds_count",
+                         metrics.count, endpoint=endpoint)
+
+        for name, kind, doc, value in (
+            ("requests_in_flight", "gauge",
+             "Requests being handled right now.", self.in_flight),
+            ("connections_open", "gauge", "Open client connections.",
+             self.connections_open),
+            ("connections_total", "counter", "Accepted client connections.",
+             self.connections_total),
+            ("keepalive_reuses_total", "counter",
+             "Requests served on an already used connection.",
+             self.keepalive_reuses),
+            ("parser_errors_total", "counter",
+             "Connections closed because of malformed requests.",
+             self.parser_errors),
+            ("request_timeouts_total", "counter",
+             "Requests that timed out while being received.",
+             self.request_timeouts),
+            ("idle_timeouts_total", "counter",
+             "Keep-alive connections closed for being idle.",
+             self.idle_timeouts),
+            ("connections_shed_total", "counter",
+             "Connections answered with a 503 for being over the limit.",
+             self.connections_shed),
+            ("requests_shed_total", "counter",
+             "Requests answered with a 503 for being over the limit.",
+             self.requests_shed),
+            ("requests_queued", "gauge",
+             "Requests waiting for an in-flight slot.",
+             self.requests_queued),
+            ("accept_paused", "gauge",
+             "1 while new connections wait in the listen backlog.",
+             self.accept_paused),
+        ):
+            self._metric(lines, name, kind, doc)
+            self._sample(lines, name, value)
+
+        for name, attr, kind, doc in (
+            ("cache_hits_total", "hits", "counter",
+             "Responses served from a cache."),
+            ("cache_misses_total", "misses", "counter",
+             "Requests that ran the handler to fill a cache."),
+            ("cache_coalesced_total", "coalesced", "counter",
+             "Requests that waited for another request's handler."),
+            ("cache_evictions_total", "evictions", "counter",
+             "Entries evicted to stay under the byte limit."),
+            ("cache_expirations_total", "expirations", "counter",
+             "Entries dropped after their TTL."),
+            ("cache_bytes", "size", "gauge", "Bytes held by a cache."),
+        ):
+            if not self.caches:
+                break
+            self._metric(lines, name, kind, doc)
+            for cache in self.caches:
+                self._sample(lines, name, getattr(cache, attr),
+                             cache=cache.name)
+        lines.append("")
+        return "\n".join(lines)
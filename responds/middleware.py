@@ -0,0 +1,133 @@
+import inspect
+import typing
+
+from werkzeug.wrappers import Response
+
+from .serializers import JSONSerializer
+from .util import wrap_response
+
+# what a precomposed pipeline looks like, ctx in and a response out
+Call = typing.Callable[['Context'], typing.Awaitable[Response]]
+
+
+class Middleware(object):
+    """
+    A hook that runs around route handlers,
+    registered on the application, a group or a route.
+    ``before`` hooks get the context and can return a response
+    to skip everything after them, ``after`` hooks get the context
+    and the response and can return a replacement,
+    ``around`` hooks get the context and a ``call_next``
+    coroutine function and return the response.
+    Exceptions go through the pipeline untouched,
+    only ``around`` hooks see them before they become error responses.
+    Hooks can be plain functions or coroutines.
+    WebSocket handlers are called without it.
+    """
+    BEFORE = "before"
+    AFTER = "after"
+    AROUND = "around"
+
+    def __init__(self, kind: str, func: typing.Callable):
+        if kind not in (self.BEFORE, self.AFTER, self.AROUND):
+            raise ValueError("kind must be before, after or around")
+        if not callable(func):
+            raise Exception("func must be a callable")
+        self.kind = kind
+        self.func = func
+
+    def __repr__(self):
+        return "<Middleware {} {}>".format(
+            self.kind, getattr(self.func, "__qualname__", self.func))
+
+    def wrap(self, call: Call, serializer: JSONSerializer) -> Call:
+        """
+        Returns call wrapped in the hook. Whether the hook
+        is a coroutine is settled here, not on every request.
+        """
+        func = self.func
+        is_async = inspect.iscoroutinefunction(func)
+        if self.kind == self.BEFORE:
+            if is_async:
+
+                async def before(ctx):
+                    ret = await func(ctx)
+                    if ret is not None:
+                        return wrap_response(ret, serializer)
+                    return await call(ctx)
+            else:
+
+                async def before(ctx):
+                    ret = func(ctx)
+                    if ret is not None:
+                        return wrap_response(ret, serializer)
+                    return await call(ctx)
+
+            return before
+
+        if self.kind == self.AFTER:
+            if is_async:
+
+                async def after(ctx):
+                    res = await call(ctx)
+                    ret = await func(ctx, res)
+                    return res if ret is None else wrap_response(
+                        ret, serializer)
+            else:
+
+                async def after(ctx):
+                    res = await call(ctx)
+                    ret = func(ctx, res)
+                    return res if ret is None else wrap_response(
+                        ret, serializer)
+
+            return after
+
+        if is_async:
+
+            async def around(ctx):
+                ret = await func(ctx, lambda: call(ctx))
+                return wrap_response(ret, serializer)
+        else:
+
+            async def around(ctx):
+                # returning call_next() hands back its awaitable
+                ret = func(ctx, lambda: call(ctx))
+                if inspect.isawaitable(ret):
+                    ret = await ret
+                return wrap_response(ret, serializer)
+
+        return around
+
+
+def before(func: typing.Callable) -> Middleware:
+    return Middleware(Middleware.BEFORE, func)
+
+
+def after(func: typing.Callable) -> Middleware:
+    return Middleware(Middleware.AFTER, func)
+
+
+def around(func: typing.Callable) -> Middleware:
+    return Middleware(Middleware.AROUND, func)
+
+
+def check(middleware: typing.Iterable[Middleware]) -> typing.List[Middleware]:
+    middleware = list(middleware)
+    for item in middleware:
+        if not isinstance(item, Middleware):
+            raise Exception(
+                "{!r} isn't middleware, wrap it with before, after or around"
+                .format(item))
+    return middleware
+
+
+def compose(middleware: typing.Sequence[Middleware], call: Call,
+            serializer: JSONSerializer) -> Call:
+    """
+    Folds the middleware around call, the first one is outermost.
+    Without middleware call is returned as is.
+    """
+    for item in reversed(middleware):
+        call = item.wrap(call, serializer)
+    return call
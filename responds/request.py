@@ -0,0 +1,124 @@
+import typing
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import parse_cookie
+from werkzeug.urls import url_decode
+from werkzeug.wrappers import Request
+
+from .body import RequestBody
+from .fakewsgi import to_wsgi_environment
+from .util import lazyprop
+
+
+class NativeRequest(object):
+    """
+    A request built straight from the parser callbacks.
+    Everything past the request line is parsed on first access,
+    the WSGI environ and werkzeug Request only exist if asked for.
+    """
+    # the _lazy_ slots hold what the lazyprops computed
+    __slots__ = ("method", "url", "raw_headers", "body", "http_version",
+                 "server", "remote_addr", "data", "route", "_lazy__split_url",
+                 "_lazy_headers", "_lazy_args", "_lazy_cookies",
+                 "_lazy_content_length", "_lazy_environ", "_lazy_wsgi_request")
+
+    def __init__(self,
+                 method: str,
+                 url: bytes,
+                 headers: typing.List[typing.Tuple[str, str]],
+                 body: RequestBody = None,
+                 http_version: str = "1.1",
+                 server: (str, int) = ("responds", 8080),
+                 remote_addr: str = "127.0.0.1:2000"):
+        self.method = method
+        self.url = url
+        self.raw_headers = headers
+        self.body = body
+        self.http_version = http_version
+        self.server = server
+        self.remote_addr = remote_addr
+        # the buffered body, for routes that don't stream
+        self.data = None
+        # the route that matched, set by the application
+        self.route = None
+
+    @lazyprop
+    def _split_url(self) -> (str, str):
+        url = self.url.decode("utf-8")
+        if url.startswith("/") and "#" not in url:
+            path, _, query = url.partition("?")
+            return path, query
+        # absolute-form or anything unusual
+        sp_url = urlsplit(url)
+        return sp_url.path, sp_url.query
+
+    @property
+    def path(self) -> str:
+        return self._split_url[0]
+
+    @property
+    def query_string(self) -> str:
+        return self._split_url[1]
+
+    @lazyprop
+    def headers(self) -> Headers:
+        return Headers(self.raw_headers)
+
+    @lazyprop
+    def args(self) -> MultiDict:
+        return url_decode(self.query_string)
+
+    @lazyprop
+    def cookies(self) -> MultiDict:
+        return parse_cookie(self.headers.get("Cookie", ""))
+
+    @lazyprop
+    def content_length(self) -> typing.Optional[int]:
+        try:
+            return int(self.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return None
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get("Content-Type", "")
+
+    @lazyprop
+    def environ(self) -> MultiDict:
+        environ = to_wsgi_environment(
+            headers=self.raw_headers,
+            method=self.method,
+            path=self.url.decode("utf-8"),
+            body=BytesIO(self.data) if self.data is not None else None,
+            server_name=self.server[0],
+            server_port=str(self.server[1]),
+            remote_addr=self.remote_addr,
+            protocol="HTTP/" + self.http_version)
+        environ["responds.body"] = self.body
+        return environ
+
+    @lazyprop
+    def wsgi_request(self) -> Request:
+        return Request(self.environ)
+
+    def __getstate__(self) -> dict:
+        # for handlers running in a process pool:
+        # the body stream and route stay behind, lazy values get rebuilt
+        state = {
+            key: getattr(self, key)
+            for key in self.__slots__ if not key.startswith("_lazy_")
+        }
+        state["body"] = None
+        state["route"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def set_data(self, data: bytes):
+        self.data = data
+        if hasattr(self, "_lazy_environ"):
+            self.environ["wsgi.input"] = BytesIO(data)
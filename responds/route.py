@@ -1,8 +1,7 @@
 import typing
 
-from werkzeug.routing import Rule, Submount
-
 from .handler import Handler
+from .middleware import check, compose
 from .util import lazyprop
 
 
@@ -11,6 +10,18 @@ class Route(Handler):
         super().__init__(func)
         self.paths = []
         self.mapper = None
+        # None falls back to the application's max_body_size
+        self.max_body_size = None
+        # hand the body to the handler as ctx.body instead of buffering it
+        self.stream_body = False
+        # a ResponseCache, or None
+        self.cache = None
+        # WebSocket options for websocket routes, None for plain HTTP ones
+        self.websocket = None
+        # the route's own middleware, innermost
+        self.middleware = []
+        # what a request goes through, composed by Application.build
+        self.pipeline = None
 
     @lazyprop
     def endpoint(self):
@@ -20,14 +31,39 @@ class Route(Handler):
                  strict_slashes: bool):
         self.paths.append((route_url, methods, strict_slashes))
 
-    @property
-    def submount(self):
-        rules = []
-        for route_url, methods, strict_slashes in self.paths:
-            rules.append(
-                Rule(
-                    route_url,
-                    methods=methods,
-                    endpoint=self.endpoint,
-                    strict_slashes=strict_slashes))
-        return Submount("", rules)
+    def configure(self,
+                  max_body_size: int = None,
+                  stream: bool = False,
+                  cache: 'ResponseCache' = None,
+                  executor: str = None,
+                  middleware: typing.Sequence['Middleware'] = None):
+        if max_body_size is not None:
+            self.max_body_size = max_body_size
+        if stream:
+            self.stream_body = True
+        if cache is not None:
+            self.cache = cache
+        if executor is not None:
+            self.set_executor(executor)
+        if middleware:
+            self.middleware.extend(check(middleware))
+        if self.stream_body and self.executor == "process":
+            raise Exception("a streamed body can't be sent to a process")
+
+    def compose(self, middleware: typing.Sequence['Middleware']):
+        """
+        Builds the pipeline from the application's and groups'
+        middleware, outermost first, then the route's own,
+        around the cache and the handler.
+        """
+        cache = self.cache
+        if cache is None:
+            call = self.invoke
+        else:
+            invoke = self.invoke
+
+            async def call(ctx):
+                return await cache.fetch(ctx.native, lambda: invoke(ctx))
+
+        self.pipeline = compose(
+            list(middleware) + self.middleware, call, self.serializer)
@@ -0,0 +1,450 @@
+import hashlib
+import os
+import pickle
+import platform
+import re
+import typing
+
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import (Map, PathConverter, RequestRedirect,
+                              UnicodeConverter, ValidationError,
+                              parse_converter_args, parse_rule)
+
+from . import __version__
+
+# returned by the walker when a strict rule wants a trailing slash
+_REDIRECT = object()
+# bumped whenever what Router.dump writes changes
+CACHE_FORMAT = 1
+
+
+class _Segment(object):
+    """
+    Matches a single dynamic path segment,
+    or the remaining path for tail segments.
+    """
+
+    def __init__(self, parts: list, tail: bool, key: tuple = None):
+        # what Router.segment built it from, for the route cache
+        self.key = key
+        self.tail = tail
+        self.converters = {}
+        self.weight = 0
+        self.static_len = 0
+        regex = ""
+        for converter, name in parts:
+            if converter is None:
+                regex += re.escape(name)
+                self.static_len += len(name)
+                continue
+            self.converters[name] = converter
+            self.weight += converter.weight
+            regex += "(?P<{}>{})".format(name, converter.regex)
+        self.regex = re.compile("^" + regex + "$")
+        # a lone default converter matches any non-empty segment
+        self.name = None
+        if not tail and len(parts) == 1:
+            converter, name = parts[0]
+            if type(converter) is UnicodeConverter and \
+                    converter.regex == "[^/]+":
+                self.name = name
+
+    @property
+    def sort_key(self):
+        return (self.weight, -self.static_len)
+
+    def match(self, text: str) -> typing.Optional[dict]:
+        if self.name is not None:
+            return {self.name: text} if text else None
+        m = self.regex.match(text)
+        if m is None:
+            return None
+        params = {}
+        try:
+            for name, value in m.groupdict().items():
+                params[name] = self.converters[name].to_python(value)
+        except ValidationError:
+            return None
+        return params
+
+
+class _Node(object):
+    def __init__(self):
+        self.static = {}
+        self.dynamic = []
+        self.tails = []
+        self.entries = []
+        # allowed methods, indexed by whether the path had a trailing slash
+        self.methods = [set(), set()]
+
+    def add_entry(self, entry: tuple):
+        self.entries.append(entry)
+        _, methods, strict_slashes, is_leaf = entry
+        for slash in (False, True):
+            if slash and strict_slashes and is_leaf:
+                continue
+            if methods is None:
+                self.methods[slash] = None
+            elif self.methods[slash] is not None:
+                self.methods[slash].update(methods)
+
+
+class Router(object):
+    """
+    Compiled route table.
+    Static segments are resolved with dict lookups,
+    so lookup cost depends on the path depth
+    instead of the number of routes.
+    """
+
+    def __init__(self, converters: dict = None):
+        # only used to host werkzeug's converters
+        self.map = Map(converters=converters)
+        self.root = _Node()
+        self.endpoints = {}
+        # built once and shared by every rule that uses them,
+        # converters don't keep any state
+        self.converters = {}
+        self.segments = {}
+        # the dynamic end of a rule -> its parsed segments,
+        # groups tend to repeat the same urls under different prefixes
+        self.parsed = {}
+        # whether the table came from a cache file
+        self.loaded = False
+
+    def converter(self, key: tuple):
+        converter = self.converters.get(key)
+        if converter is None:
+            name, arguments = key
+            if name not in self.map.converters:
+                raise LookupError(
+                    "the converter {!r} does not exist".format(name))
+            if arguments:
+                c_args, c_kwargs = parse_converter_args(arguments)
+            else:
+                c_args, c_kwargs = (), {}
+            converter = self.converters[key] = self.map.converters[name](
+                self.map, *c_args, **c_kwargs)
+        return converter
+
+    def segment(self, parts: tuple, tail: bool) -> _Segment:
+        key = (parts, tail)
+        segment = self.segments.get(key)
+        if segment is None:
+            segment = self.segments[key] = _Segment(
+                [(None if c is None else self.converter(c), text)
+                 for c, text in parts], tail, key)
+        return segment
+
+    def _parse(self, rule: str) -> list:
+        segments = [[]]
+        for converter, arguments, variable in parse_rule(rule):
+            if converter is None:
+                pieces = variable.split("/")
+                if pieces[0]:
+                    segments[-1].append((None, pieces[0]))
+                for piece in pieces[1:]:
+                    segments.append([(None, piece)] if piece else [])
+                continue
+            segments[-1].append(((converter, arguments), variable))
+        # the rule always starts with a slash
+        return [
+            tuple(parts) if any(c is not None for c, _ in parts) else
+            "".join(text for _, text in parts) for parts in segments[1:]
+        ]
+
+    def _split(self, rule: str) -> list:
+        """
+        A rule's segments, static ones as their text
+        and dynamic ones as (converter key or None, text) parts.
+        """
+        # only the part from the first converter on goes through werkzeug
+        cut = rule.find("<")
+        if cut == -1:
+            cut = len(rule)
+        else:
+            cut = rule.rfind("/", 0, cut)
+        segments = rule[:cut].split("/")[1:]
+        if cut < len(rule):
+            rest = rule[cut:]
+            parsed = self.parsed.get(rest)
+            if parsed is None:
+                parsed = self.parsed[rest] = self._parse(rest)
+            segments.extend(parsed)
+        return segments
+
+    def _is_tail(self, parts: tuple) -> bool:
+        return any(
+            c is not None and isinstance(self.converter(c), PathConverter)
+            for c, _ in parts)
+
+    def add(self,
+            rule: str,
+            methods: typing.Optional[typing.Iterable[str]],
+            strict_slashes: bool,
+            route: 'Route'):
+        if not rule.startswith("/"):
+            raise ValueError("urls must start with a leading slash")
+        is_leaf = not rule.endswith("/")
+        if methods is not None:
+            methods = set(m.upper() for m in methods)
+            if "GET" in methods:
+                methods.add("HEAD")
+            methods = frozenset(methods)
+        entry = (route, methods, strict_slashes, is_leaf)
+        self.endpoints.setdefault(route.endpoint, route)
+
+        segments = self._split(rule)
+        if not is_leaf:
+            segments.pop()
+        node = self.root
+        for i, parts in enumerate(segments):
+            if parts.__class__ is str:
+                child = node.static.get(parts)
+                if child is None:
+                    child = node.static[parts] = _Node()
+                node = child
+                continue
+            if self._is_tail(parts):
+                # the remaining path is matched as one regex
+                rest = []
+                for j, tail_parts in enumerate(segments[i:]):
+                    if j:
+                        rest.append((None, "/"))
+                    if tail_parts.__class__ is not str:
+                        rest.extend(tail_parts)
+                    elif tail_parts:
+                        rest.append((None, tail_parts))
+                leaf = _Node()
+                leaf.add_entry(entry)
+                node.tails.append((self.segment(tuple(rest), True), leaf))
+                return
+            segment = self.segment(parts, False)
+            for other, child in node.dynamic:
+                if other is segment:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.dynamic.append((segment, child))
+                node = child
+        node.add_entry(entry)
+
+    def finish(self):
+        """
+        Orders every node's dynamic segments and tails,
+        the most specific first. Called once after the last add,
+        sorting is stable so it's the same as sorting after each one.
+        """
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            node.dynamic.sort(key=lambda d: d[0].sort_key)
+            node.tails.sort(key=lambda t: t[0].sort_key)
+            nodes.extend(node.static.values())
+            nodes.extend(child for _, child in node.dynamic)
+
+    @staticmethod
+    def fingerprint(rules: typing.Iterable[tuple],
+                    converters: dict = None) -> str:
+        """
+        Identifies a route table by its rules, in order,
+        and whatever else the compiled table depends on.
+        """
+        digest = hashlib.sha1()
+        digest.update(
+            repr((CACHE_FORMAT, __version__, platform.python_version(),
+                  sorted((name, cls.__module__, cls.__qualname__)
+                         for name, cls in Map(
+                             converters=converters).converters.items())
+                  )).encode("utf-8"))
+        for rule, methods, strict_slashes, route in rules:
+            digest.update(
+                repr((rule, sorted(methods) if methods is not None else None,
+                      strict_slashes, route.endpoint)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def dump(self, path: str, key: str):
+        """
+        Writes the compiled table to path, routes are stored
+        by endpoint and segments by what they were built from.
+        """
+        routes = {id(route) for route in self.endpoints.values()}
+
+        def persistent_id(obj) -> typing.Optional[tuple]:
+            if isinstance(obj, _Segment):
+                return ("segment", obj.key)
+            if id(obj) in routes:
+                return ("route", obj.endpoint)
+            return None
+
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, "wb") as f:
+            pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            pickler.dump(self.root)
+        # whoever reads it sees a whole file or none
+        os.replace(temp, path)
+
+    def load(self, path: str, key: str,
+             routes: typing.Dict[str, 'Route']) -> bool:
+        """
+        Loads a table written by dump if it was written for key,
+        routes maps endpoints back to the current Route objects.
+        The file is unpickled, it must only be writable by the application.
+        """
+
+        def persistent_load(pid: tuple):
+            kind, value = pid
+            if kind == "route":
+                return routes[value]
+            parts, tail = value
+            return self.segment(parts, tail)
+
+        try:
+            with open(path, "rb") as f:
+                if pickle.load(f) != key:
+                    return False
+                unpickler = pickle.Unpickler(f)
+                unpickler.persistent_load = persistent_load
+                root = unpickler.load()
+        except Exception:
+            # a missing or unreadable cache is just a miss,
+            # the next dump replaces it
+            return False
+        self.root = root
+        self.endpoints = dict(routes)
+        self.loaded = True
+        return True
+
+    def _pick(self, entries: list, methods, params: dict, state: list):
+        method, slash, allowed = state[0], state[1], state[2]
+        methods = methods[slash]
+        if methods is not None and method not in methods:
+            allowed.update(methods)
+            return None
+        for route, rule_methods, strict_slashes, is_leaf in entries:
+            if strict_slashes:
+                if is_leaf and slash:
+                    continue
+                if not is_leaf and not slash:
+                    if rule_methods is None or method in rule_methods:
+                        return _REDIRECT
+                    continue
+            if rule_methods is None or method in rule_methods:
+                return route, params
+            allowed.update(rule_methods)
+        return None
+
+    def _walk(self, node: _Node, segs: list, index: int, params: dict,
+              state: list):
+        # state is [method, trailing slash, allowed methods,
+        # merging slashes, (index, text, slash) of the tail that matched]
+        if index == len(segs):
+            if node.entries:
+                found = self._pick(node.entries, node.methods, params, state)
+                if found is not None:
+                    state[4] = None
+                return found
+            return None
+        seg = segs[index]
+        if not seg and state[3]:
+            # werkzeug matches the slashes between static parts as /+
+            return self._walk(node, segs, index + 1, params, state)
+        child = node.static.get(seg)
+        if child is not None:
+            found = self._walk(child, segs, index + 1, params, state)
+            if found is not None:
+                return found
+        for segment, child in node.dynamic:
+            values = segment.match(seg)
+            if values is None:
+                continue
+            if params:
+                values.update(params)
+            found = self._walk(child, segs, index + 1, values, state)
+            if found is not None:
+                return found
+        if node.tails:
+            rest = "/".join(segs[index:])
+            for segment, leaf in node.tails:
+                # every tail leaf has a single rule
+                _, _, strict_slashes, is_leaf = leaf.entries[0]
+                tail_state = state
+                if not (strict_slashes and is_leaf):
+                    # werkzeug's suffix takes every trailing slash,
+                    # more than one of them is merged into one
+                    text = rest.rstrip("/")
+                    if text != rest and not state[3]:
+                        continue
+                elif state[1]:
+                    # while a strict rule's path takes it
+                    text = rest + "/"
+                    tail_state = [state[0], False, state[2]]
+                else:
+                    text = rest
+                values = segment.match(text)
+                if values is None:
+                    continue
+                if params:
+                    values.update(params)
+                found = self._pick(leaf.entries, leaf.methods, values,
+                                   tail_state)
+                if found is not None or state[4] is None:
+                    # a rule ending in a slash is built with it
+                    slash = not is_leaf or tail_state is state and state[1]
+                    state[4] = (index, text, slash)
+                if found is not None:
+                    return found
+        return None
+
+    def _find(self, path: str, method: str, merge: bool) -> tuple:
+        slash = path.endswith("/")
+        base = path[:-1] if slash else path
+        segs = base.split("/")[1:]
+        state = [method, slash, set(), merge, None]
+        return self._walk(self.root, segs, 0, {}, state), state, segs
+
+    def lookup(self, path: str, method: str,
+               query_string: str = "") -> ('Route', dict):
+        """
+        Resolves a path to a route and its params.
+        Raises the same exceptions as werkzeug's MapAdapter,
+        which merges repeated slashes (outside of a path converter's value)
+        by redirecting when a rule matches the path with them merged.
+        """
+        path = "/" + path.lstrip("/")
+        found, state, _ = self._find(path, method, False)
+        url = None
+        if found is _REDIRECT:
+            url = path + "/"
+        elif found is None and not state[2] and "//" in path:
+            merged, merged_state, segs = self._find(path, method, True)
+            if merged is not None or merged_state[2]:
+                tail = merged_state[4]
+                if tail is None:
+                    url = "/" + "/".join(seg for seg in segs if seg)
+                    if merged_state[1] or merged is _REDIRECT:
+                        url += "/"
+                else:
+                    index, text, slash = tail
+                    url = "/" + "/".join(
+                        [seg for seg in segs[:index] if seg] + [text])
+                    if slash:
+                        url += "/"
+                if (merged is not _REDIRECT
+                        and url.count("/") >= path.count("/")):
+                    # the rule's own slashes are the only ones merged
+                    url = None
+                    state[2] = merged_state[2]
+        if url is not None:
+            if query_string:
+                url += "?" + query_string
+            raise RequestRedirect(url)
+        if found is not None:
+            return found
+        if state[2]:
+            raise MethodNotAllowed(valid_methods=sorted(state[2]))
+        raise NotFound()
+
@@ -0,0 +1,79 @@
+import json
+import typing
+
+
+class JSONSerializer(object):
+    """
+    Turns dicts and lists returned by handlers into response bodies
+    and request bodies back into objects, with the stdlib json module.
+    The encoder is built once, json.dumps builds a new one
+    whenever it gets options.
+    """
+    name = "json"
+    content_type = "application/json"
+
+    def __init__(self):
+        self.encode = json.JSONEncoder(
+            ensure_ascii=False, separators=(",", ":")).encode
+        self.decode = json.loads
+
+    def dumps(self, obj: typing.Any) -> bytes:
+        return self.encode(obj).encode("utf-8")
+
+    def loads(self, data: bytes) -> typing.Any:
+        return self.decode(data)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Uses orjson, which encodes straight to bytes.
+    """
+    name = "orjson"
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise Exception("the orjson serializer needs orjson installed")
+        self.dumps = orjson.dumps
+        self.loads = orjson.loads
+
+
+class UjsonSerializer(JSONSerializer):
+    name = "ujson"
+
+    def __init__(self):
+        try:
+            import ujson
+        except ImportError:
+            raise Exception("the ujson serializer needs ujson installed")
+        self.encode = ujson.dumps
+        self.decode = ujson.loads
+
+
+# fastest first
+SERIALIZERS = (OrjsonSerializer, UjsonSerializer, JSONSerializer)
+# what handlers get when nothing is configured
+DEFAULT = JSONSerializer()
+
+
+def get_serializer(serializer: typing.Union[str, JSONSerializer, None]
+                   ) -> JSONSerializer:
+    """
+    Looks a serializer up by name,
+    "auto" picks the fastest one that's installed.
+    """
+    if serializer is None:
+        return DEFAULT
+    if isinstance(serializer, JSONSerializer):
+        return serializer
+    if serializer == "auto":
+        for cls in SERIALIZERS:
+            try:
+                return cls()
+            except Exception:
+                continue
+    for cls in SERIALIZERS:
+        if cls.name == serializer:
+            return cls()
+    raise ValueError("unknown serializer {!r}".format(serializer))
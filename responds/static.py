@@ -0,0 +1,378 @@
+import mimetypes
+import mmap
+import os
+import stat
+import time
+import typing
+from collections import OrderedDict
+from email.utils import formatdate
+
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.http import (parse_accept_header, parse_date, parse_etags,
+                           parse_range_header)
+from werkzeug.wrappers import Response
+
+from .route import Route
+from .util import StreamingResponse, lazyprop
+
+# on-disk variants that are sent instead of the file, best first
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+# how much of a file is mapped and sent at a time by the fallback
+CHUNK_SIZE = 2**18
+# more ranges than this in one request get the whole file,
+# lots of tiny ones cost more than they save
+MAX_RANGES = 16
+
+
+class OpenFile(object):
+    """
+    A file descriptor and what was learned about it when it was opened.
+    Responses hold a reference while they're being sent,
+    so an evicted file is only closed once nobody is using it.
+    """
+
+    def __init__(self, path: str, fd: int, st: os.stat_result):
+        self.path = path
+        self.fd = fd
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        self.etag = "{:x}-{:x}".format(st.st_mtime_ns, st.st_size)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.refs = 0
+        self.closed = False
+        self.evicted = False
+
+    def acquire(self):
+        self.refs += 1
+
+    def release(self):
+        self.refs -= 1
+        if self.evicted and self.refs <= 0:
+            self.close()
+
+    def evict(self):
+        self.evicted = True
+        if self.refs <= 0:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self.fd)
+
+
+class CachedEntry(object):
+    def __init__(self, file: OpenFile, mimetype: str,
+                 variants: typing.Dict[str, OpenFile]):
+        self.file = file
+        self.mimetype = mimetype
+        self.variants = variants
+        self.checked = time.monotonic()
+
+    def files(self):
+        yield self.file
+        yield from self.variants.values()
+
+
+def _iter_mapped(file: OpenFile, offset: int, count: int):
+    if count <= 0:
+        return
+    file.acquire()
+    try:
+        with mmap.mmap(file.fd, 0, access=mmap.ACCESS_READ) as mapped:
+            end = min(offset + count, len(mapped))
+            while offset < end:
+                # copied out, the map is gone once the generator closes
+                yield mapped[offset:min(offset + CHUNK_SIZE, end)]
+                offset += CHUNK_SIZE
+    finally:
+        file.release()
+
+
+class FileResponse(StreamingResponse):
+    """
+    A region of an open file.
+    The HTTP/1 backend hands it to ``os.sendfile``,
+    anything else streams it from a memory map.
+    """
+
+    def __init__(self, file: OpenFile, offset: int, count: int, *args,
+                 **kwargs):
+        super().__init__(_iter_mapped(file, offset, count), *args, **kwargs)
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.headers["Content-Length"] = str(count)
+        file.acquire()
+        self.call_on_close(file.release)
+
+
+def _iter_parts(file: OpenFile, parts: list, boundary: bytes):
+    for head, start, stop in parts:
+        yield head
+        yield from _iter_mapped(file, start, stop - start)
+        yield b"\r\n"
+    yield b"--" + boundary + b"--\r\n"
+
+
+class MultipartFileResponse(StreamingResponse):
+    """
+    Several regions of an open file as multipart/byteranges.
+    Always streamed from a memory map.
+    """
+
+    def __init__(self, file: OpenFile, ranges: list, mimetype: str, *args,
+                 **kwargs):
+        boundary = os.urandom(12).hex()
+        parts = []
+        length = len(boundary) + 6
+        for start, stop in ranges:
+            head = ("--{}\r\nContent-Type: {}\r\n"
+                    "Content-Range: bytes {}-{}/{}\r\n\r\n").format(
+                        boundary, mimetype, start, stop - 1,
+                        file.size).encode("latin-1")
+            parts.append((head, start, stop))
+            length += len(head) + stop - start + 2
+        super().__init__(
+            _iter_parts(file, parts, boundary.encode("ascii")),
+            *args,
+            mimetype="multipart/byteranges; boundary=" + boundary,
+            **kwargs)
+        self.headers["Content-Length"] = str(length)
+        file.acquire()
+        self.call_on_close(file.release)
+
+
+class StaticFiles(Route):
+    """
+    Serves the files under ``directory``.
+    Open descriptors and stat results are kept in an LRU cache,
+    entries are re-validated against the filesystem
+    once they're older than ``revalidate`` seconds.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 cache_size: int = 256,
+                 revalidate: float = 1.0,
+                 max_age: int = None,
+                 index: str = "index.html",
+                 precompressed: bool = True):
+        super().__init__(self.serve)
+        self.directory = os.path.realpath(directory)
+        self.cache_size = cache_size
+        self.revalidate = revalidate
+        self.max_age = max_age
+        self.index = index
+        self.precompressed = precompressed
+        # filename -> CachedEntry, least recently used first
+        self.entries = OrderedDict()
+
+    @lazyprop
+    def endpoint(self):
+        return "_{}_static_{}".format(self.mapper.name, self.directory)
+
+    def mount(self, url: str):
+        self.add_path(url.rstrip("/") + "/<path:filename>", ("GET", ), False)
+        if self.index:
+            self.add_path(url.rstrip("/") + "/", ("GET", ), False)
+        return self
+
+    def contained(self, path: str) -> typing.Optional[str]:
+        path = os.path.realpath(path)
+        if path != self.directory and \
+                not path.startswith(self.directory + os.sep):
+            # .. or a symlink pointing out of the directory
+            return None
+        return path
+
+    def resolve(self, filename: str) -> typing.Optional[str]:
+        if "\x00" in filename:
+            return None
+        return self.contained(os.path.join(self.directory, filename))
+
+    def _open(self, path: str) -> typing.Optional[OpenFile]:
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        except OSError:
+            return None
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            os.close(fd)
+            return None
+        return OpenFile(path, fd, st)
+
+    def _load(self, filename: str) -> typing.Optional[CachedEntry]:
+        path = self.resolve(filename)
+        if path is None:
+            return None
+        if os.path.isdir(path):
+            if not self.index:
+                return None
+            path = self.contained(os.path.join(path, self.index))
+            if path is None:
+                return None
+        file = self._open(path)
+        if file is None:
+            return None
+        variants = {}
+        if self.precompressed:
+            for encoding, suffix in PRECOMPRESSED:
+                variant_path = self.contained(path + suffix)
+                if variant_path is None:
+                    continue
+                variant = self._open(variant_path)
+                if variant is not None:
+                    variants[encoding] = variant
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return CachedEntry(file, mimetype, variants)
+
+    def _stale(self, entry: CachedEntry) -> bool:
+        for file in entry.files():
+            try:
+                st = os.stat(file.path)
+            except OSError:
+                return True
+            if file.identity != (st.st_dev, st.st_ino, st.st_size,
+                                 st.st_mtime_ns):
+                return True
+        if self.precompressed:
+            for encoding, suffix in PRECOMPRESSED:
+                if encoding in entry.variants:
+                    continue
+                # a variant added since the file was opened
+                path = self.contained(entry.file.path + suffix)
+                if path is not None and os.path.isfile(path):
+                    return True
+        return False
+
+    def _evict(self, entry: CachedEntry):
+        for file in entry.files():
+            file.evict()
+
+    def lookup(self, filename: str) -> typing.Optional[CachedEntry]:
+        entry = self.entries.get(filename)
+        if entry is not None:
+            now = time.monotonic()
+            if now - entry.checked < self.revalidate:
+                self.entries.move_to_end(filename)
+                return entry
+            if not self._stale(entry):
+                entry.checked = now
+                self.entries.move_to_end(filename)
+                return entry
+            del self.entries[filename]
+            self._evict(entry)
+        entry = self._load(filename)
+        if entry is None:
+            return None
+        self.entries[filename] = entry
+        if len(self.entries) > self.cache_size:
+            _, evicted = self.entries.popitem(last=False)
+            self._evict(evicted)
+        return entry
+
+    def clear(self):
+        for entry in self.entries.values():
+            self._evict(entry)
+        self.entries.clear()
+
+    def negotiate(self, entry: CachedEntry, accept_encoding: str
+                  ) -> (typing.Optional[str], OpenFile):
+        if not entry.variants or not accept_encoding:
+            return None, entry.file
+        accept = parse_accept_header(accept_encoding)
+        best, best_q = None, 0
+        for encoding, _ in PRECOMPRESSED:
+            q = accept.quality(encoding)
+            if encoding in entry.variants and q > best_q:
+                best, best_q = encoding, q
+        if best is None:
+            return None, entry.file
+        return best, entry.variants[best]
+
+    def not_modified(self, headers, etag: str, file: OpenFile) -> bool:
+        if_none_match = headers.get("If-None-Match")
+        if if_none_match is not None:
+            return parse_etags(if_none_match).contains_weak(etag)
+        since = parse_date(headers.get("If-Modified-Since"))
+        if since is not None:
+            return file.mtime <= since.timestamp()
+        return False
+
+    def byte_ranges(self, headers, etag: str, file: OpenFile
+                    ) -> typing.Optional[typing.List[typing.Tuple[int, int]]]:
+        ranges = parse_range_header(headers.get("Range"))
+        if ranges is None or ranges.units != "bytes":
+            return None
+        if_range = headers.get("If-Range")
+        if if_range is not None:
+            date = parse_date(if_range)
+            if date is not None:
+                if file.mtime > date.timestamp():
+                    return None
+            elif if_range.strip('"') != etag:
+                return None
+        if len(ranges.ranges) > MAX_RANGES:
+            return None
+        byte_ranges = []
+        for start, stop in ranges.ranges:
+            if start < 0:
+                start = max(file.size + start, 0)
+                stop = file.size
+            else:
+                stop = file.size if stop is None else min(stop, file.size)
+            # ranges past the end are left out, not failed
+            if start < stop:
+                byte_ranges.append((start, stop))
+        if not byte_ranges:
+            raise RequestedRangeNotSatisfiable(length=file.size)
+        return byte_ranges
+
+    async def serve(self, ctx) -> Response:
+        entry = self.lookup(ctx.params.get("filename", ""))
+        if entry is None:
+            raise NotFound()
+        headers = ctx.native.headers
+        encoding, file = self.negotiate(entry,
+                                        headers.get("Accept-Encoding"))
+        etag = file.etag
+        if encoding is not None:
+            etag += "-" + encoding
+
+        common = [("ETag", '"{}"'.format(etag)),
+                  ("Last-Modified", file.last_modified),
+                  ("Accept-Ranges", "bytes")]
+        if entry.variants:
+            common.append(("Vary", "Accept-Encoding"))
+        if self.max_age is not None:
+            common.append(("Cache-Control",
+                           "public, max-age={}".format(self.max_age)))
+
+        if self.not_modified(headers, etag, file):
+            return Response(status=304, headers=common)
+
+        byte_ranges = self.byte_ranges(headers, etag, file)
+        if byte_ranges is None:
+            start, stop, status = 0, file.size, 200
+        elif len(byte_ranges) > 1:
+            if encoding is not None:
+                common.append(("Content-Encoding", encoding))
+            return MultipartFileResponse(
+                file, byte_ranges, entry.mimetype, status=206,
+                headers=common)
+        else:
+            start, stop = byte_ranges[0]
+            status = 206
+            common.append(("Content-Range", "bytes {}-{}/{}".format(
+                start, stop - 1, file.size)))
+        if encoding is not None:
+            common.append(("Content-Encoding", encoding))
+        return FileResponse(
+            file,
+            start,
+            stop - start,
+            status=status,
+            headers=common,
+            mimetype=entry.mimetype)
@@ -1,27 +1,100 @@
 from json import dumps
 
+from werkzeug.datastructures import Headers
 from werkzeug.wrappers import Response
 
+from .serializers import DEFAULT, JSONSerializer
+
 # Stolen from Kyoukai
 # https://github.com/SunDwarf/Kyoukai/blob/master/kyoukai/util.py
 
 _JSON_HEADER = [("Content-Type", "application/json")]
 
 
+class JSONBody(object):
+    """
+    An object for wrap_response to encode
+    with the application's serializer.
+    """
+    __slots__ = ("obj", )
+
+    def __init__(self, obj):
+        self.obj = obj
+
+
 def json(obj, status=200, headers=None, *args, **kwargs):
-    headers = headers or []
-    headers = headers + _JSON_HEADER
-    return dumps(obj, *args, **kwargs), status, headers
+    # handlers can also return the dict or list itself,
+    # both go through Application's serializer
+    if not args and not kwargs:
+        return JSONBody(obj), status, headers
+    # options only the json module knows about
+    if headers:
+        headers = list(headers) + _JSON_HEADER
+    else:
+        headers = _JSON_HEADER
+    # bytes, so werkzeug doesn't encode it again
+    return dumps(obj, *args, **kwargs).encode("utf-8"), status, headers
+
+
+class StreamingResponse(Response):
+    """
+    A response whose body is produced while it's being sent.
+    The stream can be an async iterator or a sync iterator,
+    backends send it chunked unless a Content-Length is set.
+    """
+    # there's nothing to measure until the stream is consumed
+    automatically_set_content_length = False
+
+    def __init__(self, stream, *args, **kwargs):
+        kwargs.setdefault("direct_passthrough", True)
+        super().__init__(None, *args, **kwargs)
+        self.stream = stream
 
 
-def wrap_response(args) -> Response:
+def is_stream(body) -> bool:
+    """
+    Checks if a view returned something
+    that should be streamed.
+    """
+    if isinstance(body, (str, bytes, bytearray, list, tuple, dict)):
+        return False
+    return hasattr(body, "__aiter__") or hasattr(body, "__next__")
+
+
+def _serialized(body, status: int, headers,
+                serializer: JSONSerializer) -> Response:
+    data = serializer.dumps(body)
+    if headers is None:
+        return Response(
+            data, status=status, content_type=serializer.content_type)
+    headers = Headers(headers)
+    # a Content-Type the handler set wins
+    if "Content-Type" not in headers:
+        headers["Content-Type"] = serializer.content_type
+    return Response(data, status=status, headers=headers)
+
+
+def _response(body, status=200, headers=None,
+              serializer: JSONSerializer = None) -> Response:
+    if isinstance(body, (dict, list)):
+        return _serialized(body, status, headers, serializer or DEFAULT)
+    if isinstance(body, JSONBody):
+        return _serialized(body.obj, status, headers, serializer or DEFAULT)
+    if is_stream(body):
+        return StreamingResponse(body, status=status, headers=headers)
+    return Response(body, status=status, headers=headers)
+
+
+def wrap_response(args, serializer: JSONSerializer = None) -> Response:
     """
     Wrap up a response, if applicable.
     This allows Flask-like `return "whatever"`.
+    Iterators and async iterators are streamed,
+    dicts and lists are serialized with serializer.
     :param args: The arguments that are being wrapped.
     """
 
-    if not args:
+    if not args and not isinstance(args, (dict, list)):
         # Return a 204 NO CONTENT.
         return Response("", status=204)
 
@@ -29,22 +102,27 @@ def wrap_response(args) -> Response:
         # We enforce ``tuple`` here instead of any iterable.
         if len(args) == 1:
             # Only body, use 200 for the response code.
-            return Response(args[0], status=200)
+            return _response(args[0], status=200, serializer=serializer)
 
         if len(args) == 2:
             # Body and status code.
-            return Response(args[0], status=args[1])
+            return _response(
+                args[0], status=args[1], serializer=serializer)
 
         if len(args) == 3:
             # Body, status code, and headers.
-            return Response(args[0], status=args[1], headers=args[2])
+            return _response(
+                args[0],
+                status=args[1],
+                headers=args[2],
+                serializer=serializer)
 
         raise TypeError("Cannot return more than 3 arguments from a view")
 
     if isinstance(args, Response):
         return args
 
-    return Response(args)
+    return _response(args, serializer=serializer)
 
 
 # https://stackoverflow.com/questions/3012421/python-memoising-deferred-lookup-property-decorator
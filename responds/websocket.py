@@ -0,0 +1,514 @@
+import base64
+import hashlib
+import struct
+import typing
+from collections import deque
+
+import curio
+import logbook
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Response
+
+from .backends import Upgrade
+from .backends.http1 import sendall_vectored
+from .request import NativeRequest
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+VERSION = "13"
+MAX_RECV = 2**16
+
+# opcodes
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+# close codes
+NORMAL = 1000
+GOING_AWAY = 1001
+PROTOCOL_ERROR = 1002
+INVALID_DATA = 1007
+POLICY_VIOLATION = 1008
+TOO_BIG = 1009
+INTERNAL_ERROR = 1011
+# codes a peer isn't allowed to send
+RESERVED_CODES = frozenset((1004, 1005, 1006, 1015))
+
+# a table per mask byte, unmasking translates every fourth byte at once
+_XOR_TABLES = [bytes(a ^ b for a in range(256)) for b in range(256)]
+
+
+class WebSocketError(Exception):
+    def __init__(self, code: int, reason: str = ""):
+        super().__init__(code, reason)
+        self.code = code
+        self.reason = reason
+
+
+def accept_key(key: str) -> str:
+    digest = hashlib.sha1(key.encode("ascii") + GUID).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def unmask(payload: bytearray, mask: bytes):
+    for i, key in enumerate(mask):
+        payload[i::4] = payload[i::4].translate(_XOR_TABLES[key])
+
+
+def frame_header(opcode: int, length: int, fin: bool = True) -> bytes:
+    # server frames are never masked
+    first = opcode | 0x80 if fin else opcode
+    if length < 126:
+        return struct.pack("!BB", first, length)
+    if length < 2**16:
+        return struct.pack("!BBH", first, 126, length)
+    return struct.pack("!BBQ", first, 127, length)
+
+
+def encode_message(message: typing.Union[str, bytes]) -> typing.List[bytes]:
+    if isinstance(message, str):
+        payload = message.encode("utf-8")
+        opcode = TEXT
+    else:
+        payload = bytes(message)
+        opcode = BINARY
+    return [frame_header(opcode, len(payload)), payload]
+
+
+def encode_close(code: int, reason: str = "") -> typing.List[bytes]:
+    # control frames carry at most 125 bytes
+    reason = reason.encode("utf-8")[:123].decode("utf-8", "ignore")
+    payload = struct.pack("!H", code) + reason.encode("utf-8")
+    return [frame_header(CLOSE, len(payload)), payload]
+
+
+def parse_frame(buffer: bytearray, max_size: int
+                ) -> typing.Optional[typing.Tuple[bool, int, bytearray]]:
+    """
+    Takes a frame off the front of buffer,
+    None if it hasn't been received completely.
+    """
+    available = len(buffer)
+    if available < 2:
+        return None
+    first, second = buffer[0], buffer[1]
+    if first & 0x70:
+        raise WebSocketError(PROTOCOL_ERROR, "reserved bits set")
+    if not second & 0x80:
+        raise WebSocketError(PROTOCOL_ERROR, "client frames must be masked")
+    fin = bool(first & 0x80)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    start = 2
+    if length == 126:
+        if available < 4:
+            return None
+        length = struct.unpack_from("!H", buffer, 2)[0]
+        start = 4
+    elif length == 127:
+        if available < 10:
+            return None
+        length = struct.unpack_from("!Q", buffer, 2)[0]
+        start = 10
+    if opcode >= CLOSE:
+        if not fin or length > 125:
+            raise WebSocketError(PROTOCOL_ERROR, "invalid control frame")
+    elif length > max_size:
+        raise WebSocketError(TOO_BIG, "message too big")
+    end = start + 4 + length
+    if available < end:
+        return None
+    mask = bytes(buffer[start:start + 4])
+    payload = buffer[start + 4:end]
+    del buffer[:end]
+    unmask(payload, mask)
+    return fin, opcode, payload
+
+
+class WebSocket(object):
+    """
+    A server side WebSocket connection.
+    A reader task parses frames into a bounded queue of messages,
+    once it's full the socket isn't read until the handler catches up.
+    A writer task sends whatever was queued since its last write
+    in one vectored write and pings the peer when there's nothing to send.
+    ``send`` waits while more than ``write_limit`` bytes are queued.
+    """
+
+    def __init__(self,
+                 sock,
+                 data: bytes = b"",
+                 max_message_size: int = 2**20,
+                 queue_size: int = 16,
+                 write_limit: int = 2**20,
+                 ping_interval: float = 20,
+                 close_timeout: float = 5):
+        self.sock = sock
+        self.buffer = bytearray(data)
+        self.max_message_size = max_message_size
+        self.queue_size = queue_size
+        self.write_limit = write_limit
+        self.ping_interval = ping_interval
+        self.close_timeout = close_timeout
+
+        self.messages = curio.Queue()
+        self.consumed = curio.Event()
+        # frames waiting for the writer, as lists of chunks
+        self.outbox = deque()
+        self.queued = 0
+        self.wakeup = curio.Event()
+        self.drained = curio.Event()
+        self.awaiting_pong = False
+        # a Broadcast found us too slow
+        self.overflowed = False
+        self.broadcasts = set()
+
+        self.close_sent = False
+        self.close_code = None
+        self.close_reason = ""
+        # the reader is done, the peer closed or went away
+        self.gone = curio.Event()
+        self.reader = None
+        self.writer = None
+
+    async def start(self):
+        self.reader = await curio.spawn(self.read_frames, daemon=True)
+        self.writer = await curio.spawn(self.write_frames, daemon=True)
+
+    @property
+    def closed(self) -> bool:
+        return self.close_sent or self.gone.is_set()
+
+    async def receive(self) -> typing.Optional[typing.Union[str, bytes]]:
+        """
+        The next message, str for text and bytes for binary ones.
+        None once the connection is closed.
+        """
+        message = await self.messages.get()
+        await self.consumed.set()
+        if message is None:
+            # for anyone else receiving
+            await self.messages.put(None)
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    def enqueue(self, chunks: typing.List[bytes], size: int) -> bool:
+        """
+        Queues an encoded frame without waiting,
+        False if it would go past write_limit.
+        """
+        if self.close_sent or self.overflowed:
+            return False
+        if self.queued and self.queued + size > self.write_limit:
+            return False
+        self.outbox.append(chunks)
+        self.queued += size
+        return True
+
+    async def wake_writer(self):
+        if not self.wakeup.is_set():
+            await self.wakeup.set()
+
+    async def send_frame(self, chunks: typing.List[bytes]):
+        if self.closed:
+            raise ConnectionError("the websocket is closed")
+        size = sum(len(chunk) for chunk in chunks)
+        while not self.enqueue(chunks, size):
+            if self.closed or self.overflowed:
+                raise ConnectionError("the websocket is closed")
+            self.drained.clear()
+            await self.wake_writer()
+            await self.drained.wait()
+        await self.wake_writer()
+
+    async def send(self, message: typing.Union[str, bytes]):
+        await self.send_frame(encode_message(message))
+
+    async def ping(self, data: bytes = b""):
+        await self.send_frame([frame_header(PING, len(data)), data])
+
+    async def close(self, code: int = NORMAL, reason: str = ""):
+        """
+        Starts the closing handshake and waits
+        for the peer's answer, at most close_timeout seconds.
+        """
+        await self.send_close(code, reason)
+        async with curio.ignore_after(self.close_timeout):
+            await self.gone.wait()
+
+    async def send_close(self, code: int, reason: str = ""):
+        if not self.close_sent:
+            self.outbox.append(encode_close(code, reason))
+            self.close_sent = True
+            await self.wake_writer()
+
+    async def overflow(self):
+        """
+        Gives up on a peer that doesn't read fast enough.
+        """
+        self.overflowed = True
+        await self.wakeup.set()
+
+    async def finish(self):
+        await self.close(GOING_AWAY if self.overflowed else NORMAL)
+        for broadcast in list(self.broadcasts):
+            broadcast.unsubscribe(self)
+        for task in (self.reader, self.writer):
+            if task is not None:
+                await task.cancel()
+
+    async def put_message(self, message: typing.Union[str, bytes]):
+        while self.messages.qsize() >= self.queue_size:
+            self.consumed.clear()
+            await self.consumed.wait()
+        await self.messages.put(message)
+
+    async def on_control(self, opcode: int, payload: bytearray) -> bool:
+        """
+        Handles a control frame, False once the peer has closed.
+        """
+        if opcode == PING:
+            if not self.close_sent:
+                self.enqueue([frame_header(PONG, len(payload)),
+                              bytes(payload)], len(payload) + 2)
+                await self.wake_writer()
+            return True
+        if opcode == PONG:
+            self.awaiting_pong = False
+            return True
+        if opcode != CLOSE:
+            raise WebSocketError(PROTOCOL_ERROR, "unknown opcode")
+        code, reason = NORMAL, ""
+        if len(payload) == 1:
+            raise WebSocketError(PROTOCOL_ERROR, "invalid close frame")
+        if len(payload) >= 2:
+            code = struct.unpack_from("!H", payload)[0]
+            if code < 1000 or code in RESERVED_CODES or 1015 < code < 3000:
+                raise WebSocketError(PROTOCOL_ERROR, "invalid close code")
+            try:
+                reason = payload[2:].decode("utf-8")
+            except UnicodeDecodeError:
+                raise WebSocketError(INVALID_DATA, "invalid close reason")
+        self.close_code, self.close_reason = code, reason
+        await self.send_close(code)
+        return False
+
+    async def read_frames(self):
+        fragments = []
+        opcode = None
+        size = 0
+        try:
+            while True:
+                frame = parse_frame(self.buffer, self.max_message_size)
+                if frame is None:
+                    data = await self.sock.recv(MAX_RECV)
+                    if not data:
+                        return
+                    self.buffer += data
+                    continue
+                fin, frame_opcode, payload = frame
+                if frame_opcode >= CLOSE:
+                    if not await self.on_control(frame_opcode, payload):
+                        return
+                    continue
+                if frame_opcode == CONTINUATION:
+                    if opcode is None:
+                        raise WebSocketError(PROTOCOL_ERROR,
+                                             "nothing to continue")
+                elif frame_opcode in (TEXT, BINARY):
+                    if opcode is not None:
+                        raise WebSocketError(PROTOCOL_ERROR,
+                                             "expected a continuation")
+                    opcode = frame_opcode
+                else:
+                    raise WebSocketError(PROTOCOL_ERROR, "unknown opcode")
+                size += len(payload)
+                if size > self.max_message_size:
+                    raise WebSocketError(TOO_BIG, "message too big")
+                if self.close_sent:
+                    # we're only waiting for the peer's close frame
+                    fragments, opcode, size = [], None, 0
+                    continue
+                fragments.append(payload)
+                if not fin:
+                    continue
+                data = fragments[0] if len(fragments) == 1 else \
+                    b"".join(fragments)
+                if opcode == TEXT:
+                    try:
+                        message = data.decode("utf-8")
+                    except UnicodeDecodeError:
+                        raise WebSocketError(INVALID_DATA, "invalid utf-8")
+                else:
+                    message = bytes(data)
+                fragments, opcode, size = [], None, 0
+                await self.put_message(message)
+        except WebSocketError as e:
+            self.close_code, self.close_reason = e.code, e.reason
+            await self.send_close(e.code, e.reason)
+        except OSError:
+            pass
+        finally:
+            await self.messages.put(None)
+            await self.gone.set()
+
+    async def wait_for_frames(self):
+        if self.ping_interval is None:
+            await self.wakeup.wait()
+            return
+        try:
+            async with curio.timeout_after(self.ping_interval):
+                await self.wakeup.wait()
+        except curio.TaskTimeout:
+            if self.awaiting_pong:
+                raise ConnectionAbortedError("no pong within the interval")
+            self.awaiting_pong = True
+            self.enqueue([frame_header(PING, 0)], 2)
+
+    async def write_frames(self):
+        try:
+            while True:
+                if self.overflowed:
+                    self.outbox.clear()
+                    self.queued = 0
+                    if not self.close_sent:
+                        self.outbox.append(
+                            encode_close(POLICY_VIOLATION, "too slow"))
+                        self.close_sent = True
+                if not self.outbox:
+                    self.wakeup.clear()
+                    await self.wait_for_frames()
+                    continue
+                chunks = []
+                for frame in self.outbox:
+                    chunks.extend(frame)
+                self.outbox.clear()
+                self.queued = 0
+                await sendall_vectored(self.sock, chunks)
+                await self.drained.set()
+                if self.close_sent and not self.outbox:
+                    # the close frame is always the last one
+                    return
+        except OSError:
+            # the peer is gone or stopped answering pings
+            if self.reader is not None:
+                await self.reader.cancel(blocking=False)
+        finally:
+            await self.drained.set()
+
+
+class Broadcast(object):
+    """
+    Sends the same messages to every subscribed WebSocket.
+    A message is framed once and the same bytes are queued everywhere.
+    A subscriber that falls more than its write_limit behind
+    is closed instead of holding the others up.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.dropped = 0
+
+    def subscribe(self, ws: WebSocket):
+        self.subscribers.add(ws)
+        ws.broadcasts.add(self)
+
+    def unsubscribe(self, ws: WebSocket):
+        self.subscribers.discard(ws)
+        ws.broadcasts.discard(self)
+
+    async def publish(self, message: typing.Union[str, bytes]) -> int:
+        """
+        Queues message for every subscriber without waiting for any of them,
+        returns how many got it.
+        """
+        chunks = encode_message(message)
+        size = len(chunks[0]) + len(chunks[1])
+        sent = 0
+        for ws in list(self.subscribers):
+            if ws.enqueue(chunks, size):
+                await ws.wake_writer()
+                sent += 1
+            elif not ws.closed:
+                self.dropped += 1
+                self.unsubscribe(ws)
+                await ws.overflow()
+            else:
+                self.unsubscribe(ws)
+        return sent
+
+
+class WebSocketUpgrade(Upgrade):
+    """
+    Hands ``Upgrade: websocket`` requests for routes registered
+    with ``websocket`` over to their handler,
+    which gets called with the context and the WebSocket.
+    """
+
+    def __init__(self, app: 'Application', level: int = logbook.WARNING):
+        super().__init__(app)
+        self.log = logbook.Logger("websocket", level=level)
+        # open connections, closed with 1001 when the server stops
+        self.sockets = set()
+
+    def find_route(self, req: NativeRequest):
+        try:
+            route, params = self.app.mapper.lookup(req.path, req.method,
+                                                   req.query_string)
+        except HTTPException:
+            return None, None
+        if route.websocket is None:
+            return None, None
+        return route, params
+
+    def accepts(self, req: NativeRequest) -> bool:
+        headers = req.headers
+        if req.method != "GET" or \
+                headers.get("Sec-WebSocket-Version") != VERSION or \
+                "Sec-WebSocket-Key" not in headers:
+            return False
+        return self.find_route(req)[0] is not None
+
+    def create_response(self, req: NativeRequest) -> Response:
+        res = Response(
+            status=101,
+            headers=[("Upgrade", "websocket"), ("Connection", "Upgrade"),
+                     ("Sec-WebSocket-Accept",
+                      accept_key(req.headers["Sec-WebSocket-Key"]))])
+        del res.headers["Content-Type"]
+        return res
+
+    async def on_upgrade(self, req: NativeRequest, sock, addr: (str, int),
+                         data: bytes = b""):
+        route, params = self.find_route(req)
+        req.route = route
+        ws = WebSocket(sock, data, **route.websocket)
+        ctx = self.app.create_context(req, params)
+        self.sockets.add(ws)
+        await ws.start()
+        try:
+            # whichever ends first cancels the other
+            async with curio.TaskGroup(wait=any) as group:
+                await group.spawn(route.invoke, ctx, ws)
+                await group.spawn(ws.gone.wait)
+            if group.exception is not None:
+                raise group.exception
+        except Exception:
+            self.log.error("websocket handler raised", exc_info=True)
+            await ws.send_close(INTERNAL_ERROR)
+        finally:
+            self.sockets.discard(ws)
+            await ws.finish()
+
+    async def drain(self):
+        for ws in list(self.sockets):
+            await ws.send_close(GOING_AWAY, "server shutting down")
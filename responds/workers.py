@@ -0,0 +1,236 @@
+import os
+import signal
+import time
+import typing
+
+import logbook
+from curio.network import tcp_server_socket
+
+
+def _describe_exit(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return "killed by signal {}".format(os.WTERMSIG(status))
+    return "exited with {}".format(os.WEXITSTATUS(status))
+
+
+class Worker(object):
+    def __init__(self, index: int):
+        self.index = index
+        self.pid = None
+        self.started = None
+        self.restarts = 0
+        self.last_exit = None
+        # exits in a row that came before MIN_UPTIME,
+        # and when the worker is started again after one
+        self.fast_exits = 0
+        self.respawn_at = None
+
+    @property
+    def uptime(self) -> float:
+        if self.started is None:
+            return 0.0
+        return time.monotonic() - self.started
+
+    def __str__(self):
+        return "worker {} pid {} up {:.0f}s restarts {} last exit: {}".format(
+            self.index, self.pid, self.uptime, self.restarts,
+            self.last_exit or "-")
+
+
+class Supervisor(object):
+    """
+    Pre-forks worker processes that each run
+    their own kernel on a shared port.
+    With reuse_port every worker binds its own socket
+    and the kernel balances connections between them,
+    otherwise they all inherit the parent's socket.
+    SIGTERM/SIGINT make the workers drain their connections and exit,
+    SIGHUP starts fresh workers and then drains the old ones
+    and SIGUSR1 logs their status.
+    """
+    # workers that die faster than this are respawned with a delay
+    # that doubles every time, up to MAX_BACKOFF
+    MIN_UPTIME = 1.0
+    MAX_BACKOFF = 30.0
+    # this many fast exits in a row stop the supervisor,
+    # the worker can't start (the port is taken, the app is broken...)
+    MAX_FAST_EXITS = 5
+    POLL_INTERVAL = 0.2
+    # signals that are passed on to the workers
+    FORWARD = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+    def __init__(self,
+                 app: 'Application',
+                 host: str,
+                 port: int,
+                 workers: int,
+                 reuse_port: bool = True):
+        if not hasattr(os, "fork"):
+            raise Exception("multiple workers need os.fork")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.app = app
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.workers = [Worker(i) for i in range(workers)]
+        self.sock = None
+        self.stopping = False
+        # pids of replaced workers that are still draining
+        self.retiring = set()
+        self.restart_requested = False
+        self.failed = False
+        self.log = logbook.Logger("supervisor", level=app.log.level)
+
+    def status(self) -> typing.List[str]:
+        return [str(worker) for worker in self.workers]
+
+    def report(self):
+        for line in self.status():
+            self.log.info(line)
+
+    def spawn(self, worker: Worker):
+        pid = os.fork()
+        if pid:
+            worker.pid = pid
+            worker.started = time.monotonic()
+            self.log.info("spawned worker {} as pid {}", worker.index, pid)
+            return
+        # child
+        for signum in self.FORWARD + (signal.SIGUSR1, ):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        code = 0
+        try:
+            sock = self.sock
+            if sock is None:
+                sock = tcp_server_socket(
+                    self.host, self.port, reuse_port=True)
+            self.app.serve(sock)
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            self.log.error(
+                "worker {} crashed", worker.index, exc_info=True)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def kill(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def forward(self, signum: int, frame=None):
+        if signum == signal.SIGHUP and not self.stopping:
+            # forking from a signal handler isn't safe, run() does it
+            self.restart_requested = True
+            return
+        self.stopping = True
+        for worker in self.workers:
+            worker.respawn_at = None
+        self.log.debug("forwarding signal {} to workers", signum)
+        for pid in [worker.pid for worker in self.workers] + list(
+                self.retiring):
+            if pid is not None:
+                self.kill(pid, signum)
+
+    def restart(self):
+        """
+        Replaces every worker, the new ones are listening
+        before the old ones stop accepting.
+        """
+        self.restart_requested = False
+        self.log.info("restarting workers")
+        for worker in self.workers:
+            old = worker.pid
+            worker.pid = None
+            worker.respawn_at = None
+            worker.restarts += 1
+            self.spawn(worker)
+            if old is not None:
+                self.retiring.add(old)
+                self.kill(old, signal.SIGTERM)
+
+    def on_status(self, signum: int, frame=None):
+        self.report()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.retiring:
+                self.retiring.remove(pid)
+                self.log.info("replaced worker pid {} {}", pid,
+                              _describe_exit(status))
+                continue
+            for worker in self.workers:
+                if worker.pid != pid:
+                    continue
+                worker.last_exit = _describe_exit(status)
+                worker.pid = None
+                if self.stopping:
+                    self.log.info("worker {} {}", worker.index,
+                                  worker.last_exit)
+                    break
+                if worker.uptime >= self.MIN_UPTIME:
+                    worker.fast_exits = 0
+                    self.log.warn("worker {} {}, restarting", worker.index,
+                                  worker.last_exit)
+                    worker.restarts += 1
+                    self.spawn(worker)
+                    break
+                worker.fast_exits += 1
+                if worker.fast_exits >= self.MAX_FAST_EXITS:
+                    self.log.error(
+                        "worker {} died {} times in a row right after "
+                        "starting, last {}, stopping", worker.index,
+                        worker.fast_exits, worker.last_exit)
+                    self.failed = True
+                    self.forward(signal.SIGTERM)
+                    break
+                # don't turn a broken worker into a fork bomb
+                delay = min(self.MIN_UPTIME * 2**(worker.fast_exits - 1),
+                            self.MAX_BACKOFF)
+                self.log.warn("worker {} {}, restarting in {:.1f}s",
+                              worker.index, worker.last_exit, delay)
+                worker.respawn_at = time.monotonic() + delay
+                break
+
+    def respawn(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.respawn_at is not None and worker.respawn_at <= now:
+                worker.respawn_at = None
+                worker.restarts += 1
+                self.spawn(worker)
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = tcp_server_socket(self.host, self.port)
+        for signum in self.FORWARD:
+            signal.signal(signum, self.forward)
+        signal.signal(signal.SIGUSR1, self.on_status)
+        for worker in self.workers:
+            self.spawn(worker)
+        self.report()
+        try:
+            while self.retiring or any(
+                    worker.pid is not None or worker.respawn_at is not None
+                    for worker in self.workers):
+                time.sleep(self.POLL_INTERVAL)
+                if self.restart_requested:
+                    self.restart()
+                self.reap()
+                self.respawn()
+        finally:
+            if self.sock is not None:
+                os.close(self.sock.detach())
+        self.log.info("all workers exited")
+        if self.failed:
+            raise Exception("a worker kept exiting right after it started")
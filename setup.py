@@ -16,5 +16,7 @@ setup(
     url='https://github.com/quiribot/responds',
     packages=['responds', 'responds.backends'],
     install_requires=['httptools', 'curio', 'werkzeug'],
+    # responds.backends.h2_, and the asyncio engine's faster loop
+    extras_require={'h2': ['h2'], 'uvloop': ['uvloop']},
     classifiers=['Programming Language :: Python :: 3']
 )
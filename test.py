@@ -43,6 +43,23 @@ async def handle_dump_body(ctx):
     return ctx.request.get_data()
 
 
+@s.route("/count/body", methods=("POST", ), max_body_size=2**20, stream=True)
+async def handle_count_body(ctx):
+    size = 0
+    async for chunk in ctx.body:
+        size += len(chunk)
+    return "{}\n".format(size)
+
+
+@s.route("/stream")
+async def handle_stream(ctx):
+    async def numbers():
+        for i in range(5):
+            yield "{}\n".format(i)
+
+    return numbers()
+
+
 s.add_group(TestGroup())
 
 s.build()
@@ -0,0 +1,117 @@
+"""
+A bare HTTP/1.1 client that reads one response at a time,
+so tests can pipeline requests and look at every byte
+the server sent back.
+"""
+import socket
+import typing
+
+TIMEOUT = 5
+
+
+class Response(object):
+    def __init__(self, status: int, headers: typing.Dict[str, str],
+                 body: bytes):
+        self.status = status
+        # names are lowercase
+        self.headers = headers
+        self.body = body
+
+
+class Connection(object):
+    def __init__(self, port: int):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.settimeout(TIMEOUT)
+        self.buffer = b""
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send(self, data: bytes):
+        self.sock.sendall(data)
+
+    def fill(self) -> bool:
+        data = self.sock.recv(65536)
+        self.buffer += data
+        return bool(data)
+
+    def read_until(self, marker: bytes) -> bytes:
+        while marker not in self.buffer:
+            if not self.fill():
+                raise EOFError("closed before {!r}".format(marker))
+        data, _, self.buffer = self.buffer.partition(marker)
+        return data
+
+    def read_exact(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            if not self.fill():
+                raise EOFError("closed {} bytes short".format(
+                    size - len(self.buffer)))
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_to_close(self) -> bytes:
+        while self.fill():
+            pass
+        data, self.buffer = self.buffer, b""
+        return data
+
+    def closed(self) -> bool:
+        """
+        Whether the server closed the connection
+        without sending anything else.
+        """
+        return not self.buffer and not self.fill()
+
+    def read_head(self) -> typing.Tuple[int, typing.Dict[str, str]]:
+        lines = self.read_until(b"\r\n\r\n").decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    def read_chunked(self) -> bytes:
+        body = b""
+        while True:
+            size = int(self.read_until(b"\r\n"), 16)
+            if not size:
+                self.read_until(b"\r\n")
+                return body
+            body += self.read_exact(size)
+            self.read_until(b"\r\n")
+
+    def response(self, head_only: bool = False) -> Response:
+        """
+        Reads the next response.
+        head_only is for responses to HEAD, which have no body.
+        """
+        status, headers = self.read_head()
+        if head_only or 100 <= status < 200 or status in (204, 304):
+            body = b""
+        elif headers.get("transfer-encoding") == "chunked":
+            body = self.read_chunked()
+        elif "content-length" in headers:
+            body = self.read_exact(int(headers["content-length"]))
+        else:
+            body = self.read_to_close()
+        return Response(status, headers, body)
+
+
+def request(method: str, path: str, headers: dict = None,
+            body: bytes = b"", version: str = "1.1") -> bytes:
+    lines = ["{} {} HTTP/{}".format(method, path, version), "Host: test"]
+    headers = dict(headers or {})
+    if body and "Content-Length" not in headers and \
+            "Transfer-Encoding" not in headers:
+        headers["Content-Length"] = str(len(body))
+    for name, value in headers.items():
+        lines.append("{}: {}".format(name, value))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
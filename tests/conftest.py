@@ -0,0 +1,41 @@
+import multiprocessing
+
+import pytest
+
+from benchmarks.bench_http import free_port, wait_for
+
+# the event loops a server can run on, see Application.use_engine
+ENGINES = ("curio", "asyncio")
+
+
+def _run(make_app, port: int, engine: str):
+    make_app().run("127.0.0.1", port, engine=engine)
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request) -> str:
+    return request.param
+
+
+@pytest.fixture
+def serve(engine: str):
+    """
+    Starts the application make_app() returns in a child process,
+    on every engine, and returns the port it listens on.
+    """
+    processes = []
+
+    def start(make_app) -> int:
+        port = free_port()
+        # forked, so make_app can be a closure
+        process = multiprocessing.get_context("fork").Process(
+            target=_run, args=(make_app, port, engine), daemon=True)
+        process.start()
+        processes.append(process)
+        wait_for(port)
+        return port
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.join()
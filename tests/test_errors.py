@@ -0,0 +1,90 @@
+from werkzeug.exceptions import Forbidden, NotFound
+
+from responds.app import Application
+from responds.backends.httptools_ import HTTPToolsBackend
+from responds.group import Group, error_handler, prefix, route
+
+from .client import Connection, request
+
+
+@prefix("/api")
+class Api(Group):
+    @route("/missing")
+    async def missing(self, ctx):
+        raise NotFound()
+
+    @route("/crash")
+    async def crash(self, ctx):
+        raise ZeroDivisionError()
+
+    @route("/forbidden")
+    async def forbidden(self, ctx):
+        raise Forbidden()
+
+    @error_handler(404)
+    async def not_found(self, environ, e):
+        return {"error": "api 404"}, 404
+
+    @error_handler(500, 600)
+    async def server_error(self, environ, e):
+        return {"error": e.code}, e.code
+
+
+def make_app() -> Application:
+    app = Application("test", HTTPToolsBackend)
+
+    @app.error_handler(404)
+    async def not_found(environ, e):
+        return "root 404", 404
+
+    @app.error_handler(401, 404)
+    async def client_error(environ, e):
+        return "root {}".format(e.code), e.code
+
+    @app.route("/post", methods=("POST", ))
+    async def post(ctx):
+        return "post"
+
+    app.add_group(Api())
+    app.build()
+    return app
+
+
+def get(port: int, path: str, method: str = "GET"):
+    with Connection(port) as conn:
+        conn.send(request(method, path))
+        return conn.response()
+
+
+def test_unmatched_paths_use_the_handler_of_their_prefix(serve):
+    port = serve(make_app)
+    assert get(port, "/nope").body == b"root 404"
+    assert get(port, "/api/nope").body == b'{"error":"api 404"}'
+    assert get(port, "/api").body == b'{"error":"api 404"}'
+    # a prefix only covers whole path segments
+    assert get(port, "/apix").body == b"root 404"
+
+
+def test_route_errors_use_the_handler_of_their_group(serve):
+    port = serve(make_app)
+    res = get(port, "/api/missing")
+    assert res.status == 404
+    assert res.body == b'{"error":"api 404"}'
+    res = get(port, "/api/crash")
+    assert res.status == 500
+    assert res.body == b'{"error":500}'
+
+
+def test_codes_a_group_doesnt_handle_fall_back_to_the_parent(serve):
+    port = serve(make_app)
+    res = get(port, "/api/forbidden")
+    assert res.status == 403
+    assert res.body == b"root 403"
+
+
+def test_codes_nobody_handles_get_werkzeugs_page(serve):
+    port = serve(make_app)
+    res = get(port, "/post")
+    assert res.status == 405
+    assert b"Method Not Allowed" in res.body
+    assert res.headers["allow"] == "POST"
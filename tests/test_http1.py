@@ -0,0 +1,157 @@
+import time
+
+from werkzeug.wrappers import Response
+
+from responds.app import Application
+from responds.backends.httptools_ import HTTPToolsBackend
+
+from .client import Connection, request
+
+
+def make_app() -> Application:
+    app = Application("test", HTTPToolsBackend)
+
+    @app.route("/")
+    async def index(ctx):
+        return "index"
+
+    def sleep(ctx):
+        time.sleep(ctx.params["seconds"])
+        return "slept {}".format(ctx.params["seconds"])
+
+    app.route("/sleep/<float:seconds>", executor="thread")(sleep)
+
+    @app.route("/echo", methods=("POST", ), max_body_size=16, stream=True)
+    async def echo(ctx):
+        return b"got " + await ctx.body.read()
+
+    @app.route("/iterator")
+    async def iterator(ctx):
+        def body():
+            yield b"x"
+            yield "yz"
+
+        return Response(body())
+
+    @app.route("/stream")
+    async def stream(ctx):
+        async def numbers():
+            for i in range(3):
+                yield "{}\n".format(i)
+
+        return numbers()
+
+    app.build()
+    return app
+
+
+def test_pipelined_responses_keep_their_order(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        # the first one takes the longest to answer
+        conn.send(
+            request("GET", "/sleep/0.3") + request("GET", "/sleep/0.0") +
+            request("GET", "/"))
+        assert conn.response().body == b"slept 0.3"
+        assert conn.response().body == b"slept 0.0"
+        assert conn.response().body == b"index"
+
+
+def test_body_over_the_limit_gets_413(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(request("POST", "/echo", body=b"a" * 32) +
+                  request("GET", "/"))
+        assert conn.response().status == 413
+        # the body was read, so the connection goes on
+        assert conn.response().body == b"index"
+
+
+def test_unread_body_over_the_limit_closes(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(
+            request("POST", "/echo", {"Content-Length": str(2**20)}) +
+            b"a" * 32)
+        res = conn.response()
+        assert res.status == 413
+        assert res.headers["connection"] == "close"
+        assert conn.closed()
+
+
+def test_body_under_the_limit(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(request("POST", "/echo", body=b"hello"))
+        assert conn.response().body == b"got hello"
+
+
+def test_100_continue_waits_for_earlier_responses(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(
+            request("GET", "/sleep/0.3") + request(
+                "POST", "/echo", {
+                    "Expect": "100-continue",
+                    "Content-Length": "2"
+                }))
+        first = conn.response()
+        assert first.body == b"slept 0.3"
+        assert conn.response().status == 100
+        conn.send(b"hi")
+        assert conn.response().body == b"got hi"
+
+
+def test_iterator_body_is_framed(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(request("GET", "/iterator") + request("GET", "/"))
+        res = conn.response()
+        assert res.headers["transfer-encoding"] == "chunked"
+        assert res.body == b"xyz"
+        assert conn.response().body == b"index"
+
+
+def test_streamed_body_is_chunked(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(request("GET", "/stream") + request("GET", "/"))
+        res = conn.response()
+        assert res.headers["transfer-encoding"] == "chunked"
+        assert res.body == b"0\n1\n2\n"
+        assert conn.response().body == b"index"
+
+
+def test_streamed_body_on_http_1_0_ends_with_the_connection(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(request("GET", "/stream", version="1.0"))
+        res = conn.response()
+        assert "transfer-encoding" not in res.headers
+        assert res.headers["connection"] == "close"
+        assert res.body == b"0\n1\n2\n"
+
+
+def test_unclaimed_upgrade_keeps_the_pipeline_going(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(
+            request("GET", "/", {
+                "Upgrade": "foo",
+                "Connection": "upgrade"
+            }) + request("GET", "/sleep/0.0"))
+        assert conn.response().body == b"index"
+        assert conn.response().body == b"slept 0.0"
+
+
+def test_unclaimed_upgrade_with_a_body_closes(serve):
+    port = serve(make_app)
+    with Connection(port) as conn:
+        conn.send(
+            request("POST", "/echo", {
+                "Upgrade": "foo",
+                "Connection": "upgrade"
+            }, b"abc") + request("GET", "/"))
+        res = conn.response()
+        assert res.headers["connection"] == "close"
+        assert conn.closed()
@@ -0,0 +1,103 @@
+"""
+The router has to answer every request the way
+werkzeug's Map, which it replaced, would have.
+"""
+import itertools
+
+import pytest
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, RequestRedirect, Rule
+
+from responds.router import Router
+
+# (rule, methods, strict_slashes)
+RULES = [
+    ("/", ("GET", ), False),
+    ("/hello", ("GET", ), False),
+    ("/hi", ("GET", ), True),
+    ("/a/", ("POST", ), True),
+    ("/dir/", ("GET", ), False),
+    ("/sdir/", ("GET", ), True),
+    ("/u/<int:id>", ("GET", ), False),
+    ("/u/<name>", ("GET", ), False),
+    ("/u/<name>/x", ("GET", ), False),
+    ("/u/me", ("GET", ), False),
+    ("/f/<path:p>", ("GET", ), False),
+    ("/f/<path:p>/edit", ("GET", ), False),
+    ("/s/<path:p>", ("GET", ), True),
+    ("/t/<path:p>/", ("GET", ), True),
+    ("/v<int:n>/<slug>", ("GET", ), False),
+    ("/d/<float:x>", None, False),
+    ("/x/y/z", ("GET", "PUT"), True),
+]
+SEGMENTS = ["", "hello", "hi", "a", "dir", "sdir", "u", "3", "bob", "x",
+            "me", "f", "s", "t", "edit", "v3", "d", "1.5", "y", "z"]
+# repeated slashes and trailing slashes on path converters
+EXTRA_PATHS = ["/hello//", "/hello//world", "/f/a//b", "/s//a//b",
+               "/s/a/b/", "/t/a/b", "/t/a/b/", "/x//y/z", "/x/y//z/",
+               "/u//me", "/dir//", "/sdir", "/sdir//"]
+
+
+class Endpoint(object):
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+
+
+def paths() -> list:
+    found = set(EXTRA_PATHS)
+    for count in range(1, 3):
+        for segments in itertools.product(SEGMENTS, repeat=count):
+            path = "/" + "/".join(segments)
+            found.add(path)
+            found.add(path + "/")
+    return sorted(found)
+
+
+def outcome(match, path: str, method: str) -> tuple:
+    try:
+        endpoint, params = match(path, method)
+    except RequestRedirect as e:
+        return "redirect", e.new_url.replace("http://test", "")
+    except MethodNotAllowed as e:
+        return "405", sorted(e.valid_methods)
+    except NotFound:
+        return "404",
+    return endpoint, params
+
+
+@pytest.fixture(scope="module")
+def matchers():
+    adapter = Map([
+        Rule(rule, methods=methods, strict_slashes=strict_slashes,
+             endpoint=str(i))
+        for i, (rule, methods, strict_slashes) in enumerate(RULES)
+    ]).bind("test")
+    router = Router()
+    for i, (rule, methods, strict_slashes) in enumerate(RULES):
+        router.add(rule, methods, strict_slashes, Endpoint(str(i)))
+    router.finish()
+
+    def lookup(path: str, method: str):
+        route, params = router.lookup(path, method)
+        return route.endpoint, params
+
+    return adapter.match, lookup
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_router_matches_werkzeug(matchers, method):
+    werkzeug, ours = matchers
+    differences = [(path, outcome(werkzeug, path, method),
+                    outcome(ours, path, method)) for path in paths()
+                   if outcome(werkzeug, path, method) != outcome(
+                       ours, path, method)]
+    assert differences == []
+
+
+def test_query_string_survives_a_redirect():
+    router = Router()
+    router.add("/dir/", ("GET", ), True, Endpoint("dir"))
+    router.finish()
+    with pytest.raises(RequestRedirect) as info:
+        router.lookup("/dir", "GET", "a=1")
+    assert info.value.new_url.endswith("/dir/?a=1")